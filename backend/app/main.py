@@ -1,15 +1,35 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from .routes.batch import router as batch_router
 from .routes.chat import router as chat_router
+from .routes.chat_ws import router as chat_ws_router
+from .routes.debug import router as debug_router
+from .routes.diagnose import router as diagnose_router
+from .services import runtime
+from .services.metrics import render_metrics
+from .services.capture import shutdown_capture
+from .logging_config import setup_logging, shutdown_logging
 import logging
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models and clients load in the background so /health answers immediately
+    runtime.start()
+    yield
+    shutdown_capture()
+    shutdown_logging()
+
+
 app = FastAPI(
     title="ViMedical API",
     description="API for ViMedical chatbot - Vietnamese medical assistant",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -28,6 +48,10 @@ app.add_middleware(
 
 # Include routers
 app.include_router(chat_router, prefix="/api/v1", tags=["chat"])
+app.include_router(chat_ws_router, prefix="/api/v1", tags=["chat"])
+app.include_router(diagnose_router, prefix="/api/v1", tags=["diagnose"])
+app.include_router(batch_router, prefix="/api/v1", tags=["batch"])
+app.include_router(debug_router, prefix="/debug", tags=["debug"], include_in_schema=False)
 
 @app.get("/")
 async def root():
@@ -37,6 +61,21 @@ async def root():
 async def health_check():
     return {"status": "healthy", "message": "ViMedical API is running"}
 
+@app.get("/ready")
+async def readiness_check():
+    # Also starts initialization if nothing else has yet
+    runtime.start()
+    ready = runtime.is_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "retrying": not ready and runtime.retry_pending(), "components": runtime.components}
+    )
+
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,3 +1,9 @@
 from .chat import ChatMessage, ChatRequest, ChatResponse, SessionState
+from .diagnose import DiagnoseRequest, DiagnoseResponse, SourceDocument
+from .batch import BatchItem, BatchRequest
 
-__all__ = ["ChatMessage", "ChatRequest", "ChatResponse", "SessionState"]
+__all__ = [
+    "ChatMessage", "ChatRequest", "ChatResponse", "SessionState",
+    "DiagnoseRequest", "DiagnoseResponse", "SourceDocument",
+    "BatchItem", "BatchRequest"
+]
@@ -0,0 +1,15 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    message: str
+    previous_symptoms: Optional[str] = ""
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    mode: str = "chat"  # "chat" (with LLM) or "diagnose" (retrieval only)
+    include_content: Optional[bool] = None
+    max_content_chars: Optional[int] = Field(None, ge=0)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 
@@ -21,11 +21,17 @@ class ChatResponse(BaseModel):
     symptoms: str = ""
     timestamp: str
     ask_confirmation: bool = False
+    tier: str = "llm"
+    trace: Optional[Dict[str, Any]] = None
 
 
 class SessionState(BaseModel):
     session_id: str
     messages: List[ChatMessage] = []
     symptoms: str = ""
+    # Disease scores of the last scored turn, reused by incremental diagnose_update turns
+    diagnostic_state: Optional[Dict[str, Any]] = None
+    # Bumped whenever a message is appended; used as the ETag of the message list
+    version: int = 0
     created_at: datetime
     updated_at: datetime
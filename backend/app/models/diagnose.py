@@ -0,0 +1,23 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+
+
+class DiagnoseRequest(BaseModel):
+    message: str
+    previous_symptoms: Optional[str] = ""
+    include_content: Optional[bool] = None
+    max_content_chars: Optional[int] = Field(None, ge=0)
+
+
+class SourceDocument(BaseModel):
+    content: Optional[str] = None
+    metadata: Dict[str, Any] = {}
+
+
+class DiagnoseResponse(BaseModel):
+    disease: str = ""
+    possible_diseases: List[str] = []
+    symptoms: str = ""
+    source_documents: List[SourceDocument] = []
+    ask_confirmation: bool = False
+    message: str = ""
@@ -1,3 +1,7 @@
+from .batch import router as batch_router
 from .chat import router as chat_router
+from .chat_ws import router as chat_ws_router
+from .debug import router as debug_router
+from .diagnose import router as diagnose_router
 
-__all__ = ["chat_router"]
+__all__ = ["batch_router", "chat_router", "chat_ws_router", "debug_router", "diagnose_router"]
\ No newline at end of file
@@ -0,0 +1,99 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from ..models.batch import BatchRequest
+from ..services import runtime
+from ..services.admission import OverloadedError, limit
+from ..services.metrics import stage_timer
+from ..services import cancellation
+from .diagnose import trim_documents, DIAGNOSE_INCLUDE_CONTENT, DIAGNOSE_MAX_CONTENT_CHARS
+import json
+import logging
+import os
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+# Items retrieved per batched pass; smaller chunks stream sooner and hold the inference slot for less time
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "32"))
+
+
+def item_line(index, item, result, include_content, max_chars):
+    line = {"index": index, "id": item.id}
+    if isinstance(result, Exception):
+        line["ok"] = False
+        line["error"] = str(result)
+    else:
+        line["ok"] = True
+        line["result"] = {
+            "message": result.get("result", ""),
+            "disease": result.get("disease", ""),
+            "possible_diseases": result.get("possible_diseases", []),
+            "symptoms": result.get("symptoms", ""),
+            "ask_confirmation": result.get("ask_confirmation", False),
+            "tier": result.get("tier"),
+            "source_documents": [
+                doc.model_dump() for doc in trim_documents(result.get("source_documents", []), include_content, max_chars)
+            ]
+        }
+    return json.dumps(line, ensure_ascii=False) + "\n"
+
+
+def run_chunk(chain, mode, messages, previous_symptoms):
+    """
+    Yield (offset, result or exception) for one chunk, in input order.
+    """
+    if mode == "diagnose":
+        with limit("diagnose"), limit("inference"):
+            results = chain.batch(messages, previous_symptoms)
+        yield from enumerate(results)
+    else:
+        yield from chain.batch(messages, previous_symptoms)
+
+
+def stream_batch(chain, request, include_content, max_chars):
+    items = request.items
+    for start in range(0, len(items), BATCH_CHUNK_SIZE):
+        chunk = items[start:start + BATCH_CHUNK_SIZE]
+        messages = [item.message for item in chunk]
+        previous_symptoms = [item.previous_symptoms or "" for item in chunk]
+        emitted = 0
+        cancellation.check("batch_chunk")
+        try:
+            with stage_timer("batch_chunk", mode=request.mode, items=len(chunk)):
+                for offset, result in run_chunk(chain, request.mode, messages, previous_symptoms):
+                    yield item_line(start + offset, chunk[offset], result, include_content, max_chars)
+                    emitted = offset + 1
+        except Exception as e:
+            # The whole chunk failed (e.g. no admission slot); report it per item and keep going
+            if not isinstance(e, OverloadedError):
+                logger.error("❌ Lỗi khi xử lý batch: %s", e, exc_info=True)
+            for offset, item in enumerate(chunk[emitted:], emitted):
+                yield item_line(start + offset, item, e, include_content, max_chars)
+
+
+@router.post("/batch")
+async def batch(request: BatchRequest, http_request: Request):
+    """
+    Process many messages in one request and stream one NDJSON line per item, in input order
+    """
+    if request.mode not in ("chat", "diagnose"):
+        raise HTTPException(status_code=422, detail="mode must be 'chat' or 'diagnose'")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Too many items (max {BATCH_MAX_ITEMS})")
+
+    if request.mode == "diagnose":
+        chain = runtime.get_qa_chain_instance()
+    else:
+        chain = runtime.get_llm_chain_instance()
+    if not chain:
+        raise HTTPException(status_code=503, detail="Chain is still loading", headers={"Retry-After": "5"})
+
+    include_content = DIAGNOSE_INCLUDE_CONTENT if request.include_content is None else request.include_content
+    max_chars = DIAGNOSE_MAX_CONTENT_CHARS if request.max_content_chars is None else request.max_content_chars
+
+    # The generator is sync and runs in the threadpool; a client disconnect cancels the remaining work
+    return StreamingResponse(
+        cancellation.stream_until_disconnected(http_request, stream_batch(chain, request, include_content, max_chars)),
+        media_type="application/x-ndjson"
+    )
@@ -1,34 +1,81 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Query, Request, Response
+from fastapi.responses import JSONResponse
+from typing import Optional
 from datetime import datetime
 from ..models.chat import ChatRequest, ChatResponse, ChatMessage
 from ..services.session_manager import session_manager
-from ..services.llm_chain import get_llm_chain
+from ..services import runtime
+from ..services.metrics import stage_timer
+from ..services import tracing
+from ..services import capture
+from ..services.admission import OverloadedError, request_deadline, reserve
+from ..services.cancellation import TurnCancelled, run_until_disconnected
+import gzip
 import logging
+import os
+
+try:
+    from fastapi.responses import ORJSONResponse
+    import orjson  # noqa: F401  (ORJSONResponse needs it at render time)
+    FastJSONResponse = ORJSONResponse
+except ImportError:
+    FastJSONResponse = JSONResponse
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Initialize LLM chain
-try:
-    llm_chain = get_llm_chain()
-    logger.info("✅ LLM Chain initialized successfully")
-except Exception as e:
-    logger.error(f"❌ Failed to initialize LLM Chain: {e}")
-    llm_chain = None
+MAX_PAGE_SIZE = 500
+# Session history responses at least this large are gzipped for clients that accept it; 0 disables
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1000"))
+
+
+def encode_json(payload, headers, accept_encoding):
+    response = FastJSONResponse(payload, headers=headers)
+    response.headers["Vary"] = "Accept-Encoding"
+    if GZIP_MIN_SIZE and "gzip" in (accept_encoding or "") and len(response.body) >= GZIP_MIN_SIZE:
+        response.body = gzip.compress(response.body, compresslevel=5)
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Content-Length"] = str(len(response.body))
+    return response
 
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+@router.post("/chat", response_model=ChatResponse, response_model_exclude_none=True)
+async def chat(
+    request: ChatRequest,
+    http_request: Request,
+    debug: bool = Query(False),
+    x_debug_trace: Optional[str] = Header(None)
+):
     """
-    Process chat message and return response
+    Process chat message and return response.
+    With ?debug=true or an X-Debug-Trace header the response includes a timing trace of the turn.
     """
+    debug = debug or bool(x_debug_trace)
+    if capture.CAPTURE_PATH and not request.session_id:
+        # Capture is sampled per session, so the id has to exist before the trace starts
+        request.session_id = session_manager.create_session()
+    capturing = bool(request.session_id) and capture.should_capture(request.session_id)
+    # Captured turns are traced for their stage timings, without filling the /debug/traces buffer
+    with tracing.start_trace("chat", force=debug, record=capturing) as trace:
+        response = await _chat_turn(request, http_request, capturing)
+    if debug and trace is not None:
+        response.trace = trace.to_dict()
+    return response
+
+
+async def _chat_turn(request: ChatRequest, http_request: Request, capturing: bool = False) -> ChatResponse:
     try:
+        llm_chain = runtime.get_llm_chain_instance()
         if not llm_chain:
-            raise HTTPException(status_code=500, detail="LLM Chain not initialized")
+            if not runtime.retry_pending():
+                raise HTTPException(status_code=500, detail="LLM Chain not initialized")
+            raise HTTPException(status_code=503, detail="LLM Chain is still loading", headers={"Retry-After": str(runtime.retry_after())})
         
         # Get or create session
         session_id = request.session_id or session_manager.create_session()
         previous_symptoms = session_manager.get_session_symptoms(session_id)
+        diagnostic_state = session_manager.get_diagnostic_state(session_id)
+        turn = session_manager.get_turn_count(session_id)
         
         # Add user message to session
         timestamp = datetime.now().strftime("%H:%M:%S")
@@ -39,11 +86,18 @@ async def chat(request: ChatRequest):
         )
         session_manager.update_session(session_id, user_message)
         
-        # Process with LLM
-        result = llm_chain(
-            request.message,
-            previous_symptoms=previous_symptoms
-        )
+        # Process with LLM off the event loop; admission gates inside the chain bound concurrency.
+        # The turn queues for its first gate here, so waiting turns do not hold threadpool threads.
+        # If the client disconnects, the chain stops at its next stage boundary.
+        with stage_timer("chat_turn"), request_deadline():
+            async with reserve("inference"):
+                result = await run_until_disconnected(
+                    http_request,
+                    llm_chain,
+                    request.message,
+                    previous_symptoms=previous_symptoms,
+                    diagnostic_state=diagnostic_state
+                )
         
         # Extract response data
         response_text = result.get("result", "Xin lỗi, tôi không thể trả lời câu hỏi này.")
@@ -57,29 +111,70 @@ async def chat(request: ChatRequest):
             content=response_text,
             timestamp=timestamp
         )
-        session_manager.update_session(session_id, assistant_message, symptoms)
+        with stage_timer("session_update"):
+            session_manager.update_session(session_id, assistant_message, symptoms)
+            session_manager.set_diagnostic_state(session_id, result.get("diagnostic_state"))
+        if capturing:
+            capture.record_turn(session_id, turn, request.message, previous_symptoms, result, tracing.current_trace())
         
         return ChatResponse(
             response=response_text,
             possible_diseases=possible_diseases,
             symptoms=symptoms,
             timestamp=timestamp,
-            ask_confirmation=ask_confirmation
+            ask_confirmation=ask_confirmation,
+            tier=result.get("tier", "error")
         )
         
+    except HTTPException:
+        raise
+    except TurnCancelled:
+        # Client Closed Request; nobody is listening for it
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=429 if e.reason == "queue_full" else 503,
+            detail=f"Server is busy ({e.stage}), please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
-        logger.error(f"❌ Error in chat endpoint: {e}")
+        logger.error("❌ Error in chat endpoint: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
 @router.get("/session/{session_id}/messages")
-async def get_session_messages(session_id: str):
+async def get_session_messages(
+    session_id: str,
+    after: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None)
+):
     """
-    Get all messages for a session
+    Get messages for a session. `after` is the number of messages the client already has
+    (the `next_cursor` of its previous read); re-reading an unchanged page answers 304 to If-None-Match.
     """
     try:
-        messages = session_manager.get_session_messages(session_id)
-        return {"messages": messages}
+        messages, next_cursor, total, version = session_manager.get_session_messages_page(session_id, after, limit)
+        # The page is part of the tag: the same version read from another cursor is a different response
+        etag = f'W/"{session_id}-{version}-{after}-{limit or 0}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        # Plain dicts straight to the encoder; no response-model validation on this hot poll path
+        return encode_json(
+            {
+                "messages": [
+                    {"role": m.role, "content": m.content, "timestamp": m.timestamp}
+                    for m in messages
+                ],
+                "next_cursor": next_cursor,
+                "has_more": next_cursor < total,
+                "version": version
+            },
+            headers,
+            accept_encoding
+        )
     except Exception as e:
         logger.error(f"❌ Error getting session messages: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -105,6 +200,6 @@ async def health_check():
     """
     return {
         "status": "healthy",
-        "llm_chain_status": "initialized" if llm_chain else "failed",
+        "llm_chain_status": runtime.components["llm_chain"]["status"],
         "timestamp": datetime.now().isoformat()
     }
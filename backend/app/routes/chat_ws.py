@@ -0,0 +1,182 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional
+from datetime import datetime
+from ..models.chat import ChatMessage
+from ..services.session_manager import session_manager
+from ..services import runtime
+from ..services.metrics import stage_timer
+from ..services.admission import OverloadedError, request_deadline, reserve
+from ..services.cancellation import TurnCancelled, cancel_scope
+import asyncio
+import json
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+class ConnectionState:
+    """
+    Conversation state held in memory for the lifetime of one WebSocket.
+    Loaded from the session on connect and written back on close.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.symptoms = session_manager.get_session_symptoms(session_id)
+        self.diagnostic_state = session_manager.get_diagnostic_state(session_id)
+        self.disease = ""
+        self.possible_diseases = []
+        self.pending_messages = []
+        self.turns = 0
+
+    def add_message(self, role, content, timestamp):
+        self.pending_messages.append(ChatMessage(role=role, content=content, timestamp=timestamp))
+
+    def apply(self, result):
+        self.symptoms = result.get("symptoms", self.symptoms) or self.symptoms
+        self.diagnostic_state = result.get("diagnostic_state")
+        self.possible_diseases = result.get("possible_diseases", [])
+        if result.get("disease"):
+            self.disease = result["disease"]
+
+    def flush(self):
+        for message in self.pending_messages:
+            session_manager.update_session(self.session_id, message)
+        self.pending_messages = []
+        session_manager.update_session_state(self.session_id, self.symptoms, self.diagnostic_state)
+
+
+class Turn:
+    def __init__(self, number):
+        self.number = number
+        self.token = None
+        self.task = None
+
+    async def cancel(self):
+        if self.task is None or self.task.done():
+            return
+        if self.token is not None:
+            self.token.cancel()
+        # Returns once the pipeline reaches its next stage boundary
+        await asyncio.gather(self.task, return_exceptions=True)
+
+
+async def run_turn(turn, state, llm_chain, message, send):
+    loop = asyncio.get_running_loop()
+
+    def on_event(kind, payload):
+        if kind == "chunk":
+            # None means the LLM call is being retried and the text so far should be dropped
+            event = {"type": "token", "text": payload["text"]} if payload["text"] is not None else {"type": "reset"}
+        else:
+            event = {"type": kind, **payload}
+        event["turn"] = turn.number
+        # Called from worker threads; hand the event to the socket's sender
+        loop.call_soon_threadsafe(send, event)
+
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    state.add_message("user", message, timestamp)
+    try:
+        with cancel_scope() as token, stage_timer("chat_turn"), request_deadline():
+            turn.token = token
+            async with reserve("inference"):
+                result = await run_in_threadpool(
+                    llm_chain,
+                    message,
+                    previous_symptoms=state.symptoms,
+                    diagnostic_state=state.diagnostic_state,
+                    on_event=on_event
+                )
+    except TurnCancelled:
+        send({"type": "cancelled", "turn": turn.number})
+        return
+    except OverloadedError as e:
+        send({
+            "type": "error", "turn": turn.number,
+            "status": 429 if e.reason == "queue_full" else 503,
+            "detail": f"Server is busy ({e.stage}), please retry later",
+            "retry_after": e.retry_after
+        })
+        return
+    except Exception as e:
+        logger.error("❌ Error in chat socket: %s", e, exc_info=True)
+        send({"type": "error", "turn": turn.number, "status": 500, "detail": f"Internal server error: {str(e)}"})
+        return
+
+    state.apply(result)
+    response_text = result.get("result", "Xin lỗi, tôi không thể trả lời câu hỏi này.")
+    state.add_message("assistant", response_text, timestamp)
+    send({
+        "type": "done",
+        "turn": turn.number,
+        "response": response_text,
+        "disease": state.disease,
+        "possible_diseases": state.possible_diseases,
+        "symptoms": state.symptoms,
+        "timestamp": timestamp,
+        "ask_confirmation": result.get("ask_confirmation", False),
+        "tier": result.get("tier", "error")
+    })
+
+
+async def pump(websocket, outbox):
+    while True:
+        event = await outbox.get()
+        await websocket.send_json(event)
+
+
+@router.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, session_id: Optional[str] = None):
+    """
+    Chat over a WebSocket. Client sends {"type": "message", "message": ...} or {"type": "cancel"};
+    a new message cancels the turn in progress. The server streams retrieval/token/done events.
+    """
+    await websocket.accept()
+    llm_chain = runtime.get_llm_chain_instance()
+    if not llm_chain:
+        await websocket.send_json({"type": "error", "status": 503, "detail": "LLM Chain is still loading", "retry_after": 5})
+        await websocket.close(code=1013)
+        return
+
+    state = ConnectionState(session_id or session_manager.create_session())
+    outbox = asyncio.Queue()
+    send = outbox.put_nowait
+    sender = asyncio.create_task(pump(websocket, outbox))
+    send({"type": "session", "session_id": state.session_id, "symptoms": state.symptoms})
+
+    turn = None
+    try:
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+            except ValueError:
+                send({"type": "error", "status": 400, "detail": "Invalid JSON"})
+                continue
+            if not isinstance(data, dict):
+                send({"type": "error", "status": 400, "detail": "Invalid JSON: expected an object"})
+                continue
+            kind = data.get("type", "message")
+            if kind not in ("message", "cancel"):
+                send({"type": "error", "status": 400, "detail": f"Unknown message type: {kind}"})
+                continue
+            if kind == "message" and not isinstance(data.get("message", ""), str):
+                send({"type": "error", "status": 400, "detail": "Invalid message: expected a string"})
+                continue
+
+            # Either way, the turn in progress is no longer wanted
+            if turn is not None:
+                await turn.cancel()
+            if kind == "message" and data.get("message"):
+                state.turns += 1
+                turn = Turn(state.turns)
+                turn.task = asyncio.create_task(run_turn(turn, state, llm_chain, data["message"], send))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if turn is not None:
+            await turn.cancel()
+        sender.cancel()
+        state.flush()
+        logger.info("🔌 Đóng WebSocket %s sau %d lượt", state.session_id, state.turns)
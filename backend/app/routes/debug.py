@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from ..services import tracing
+from ..services.profiler import profiler
+from ..services.llm_client import latency_stats
+import os
+
+router = APIRouter()
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Debug routes exist only when ADMIN_TOKEN is configured and the caller presents it
+    """
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@router.get("/traces", dependencies=[Depends(require_admin)])
+async def list_traces(offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=100)):
+    """
+    Page through recorded chat traces, newest first
+    """
+    return tracing.get_traces(offset=offset, limit=limit)
+
+
+@router.post("/profiler/start", dependencies=[Depends(require_admin)])
+async def start_profiler(
+    requests: Optional[int] = Query(None, ge=1),
+    seconds: Optional[float] = Query(None, gt=0, le=600),
+    interval_ms: int = Query(5, ge=1, le=1000)
+):
+    """
+    Sample the stacks of the next N chat turns and/or for the next T seconds
+    """
+    if requests is None and seconds is None:
+        raise HTTPException(status_code=400, detail="Specify requests and/or seconds")
+    try:
+        profiler.start(requests=requests, seconds=seconds, interval_ms=interval_ms)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.status()
+
+
+@router.post("/profiler/stop", dependencies=[Depends(require_admin)])
+async def stop_profiler():
+    profiler.stop()
+    return profiler.status()
+
+
+@router.get("/profiler", dependencies=[Depends(require_admin)])
+async def profiler_report(format: str = Query("json", pattern="^(json|collapsed)$"), limit: int = Query(30, ge=1, le=500)):
+    """
+    Aggregated samples: hot functions as JSON, or collapsed stacks for flamegraph tools
+    """
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed())
+    return {"status": profiler.status(), "hot_functions": profiler.hot_functions(limit=limit)}
+
+
+@router.get("/llm", dependencies=[Depends(require_admin)])
+async def llm_latency():
+    """
+    Recent per-model LLM latency quantiles (seconds) and the current hedge delay
+    """
+    from ..services.llm_chain import llm_client
+    return {"models": latency_stats.summary(), "hedge_enabled": llm_client.hedge, "hedge_delay": llm_client.hedge_delay()}
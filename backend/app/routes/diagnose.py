@@ -0,0 +1,75 @@
+from fastapi import APIRouter, HTTPException, Request
+from ..models.diagnose import DiagnoseRequest, DiagnoseResponse, SourceDocument
+from ..services import runtime
+from ..services.admission import OverloadedError, limit, request_deadline, reserve
+from ..services.cancellation import TurnCancelled, run_until_disconnected
+from ..services.metrics import stage_timer
+import logging
+import os
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Payload trimming defaults; callers can override per request
+DIAGNOSE_INCLUDE_CONTENT = os.getenv("DIAGNOSE_INCLUDE_CONTENT", "false").lower() == "true"
+DIAGNOSE_MAX_CONTENT_CHARS = int(os.getenv("DIAGNOSE_MAX_CONTENT_CHARS", "300"))
+
+
+def trim_documents(documents, include_content, max_chars):
+    trimmed = []
+    for doc in documents:
+        content = None
+        if include_content:
+            content = doc["content"]
+            if max_chars and len(content) > max_chars:
+                content = content[:max_chars] + "..."
+        trimmed.append(SourceDocument(content=content, metadata=doc.get("metadata", {})))
+    return trimmed
+
+
+def run_diagnosis(qa_chain, message, previous_symptoms):
+    # Own budget for this endpoint, then the CPU budget shared with /chat
+    with limit("diagnose"), limit("inference"):
+        return qa_chain(message, previous_symptoms=previous_symptoms)
+
+
+@router.post("/diagnose", response_model=DiagnoseResponse)
+async def diagnose(request: DiagnoseRequest, http_request: Request):
+    """
+    Run retrieval only (no LLM generation) and return the structured outcome
+    """
+    try:
+        qa_chain = runtime.get_qa_chain_instance()
+        if not qa_chain:
+            raise HTTPException(status_code=503, detail="QA Chain is still loading", headers={"Retry-After": "5"})
+
+        with stage_timer("diagnose_turn"), request_deadline():
+            # Queue for the endpoint's own budget on the event loop, not in a threadpool thread
+            async with reserve("diagnose"):
+                result = await run_until_disconnected(http_request, run_diagnosis, qa_chain, request.message, request.previous_symptoms or "")
+
+        include_content = DIAGNOSE_INCLUDE_CONTENT if request.include_content is None else request.include_content
+        max_chars = DIAGNOSE_MAX_CONTENT_CHARS if request.max_content_chars is None else request.max_content_chars
+
+        return DiagnoseResponse(
+            disease=result.get("disease", ""),
+            possible_diseases=result.get("possible_diseases", []),
+            symptoms=result.get("symptoms", ""),
+            source_documents=trim_documents(result.get("source_documents", []), include_content, max_chars),
+            ask_confirmation=result.get("ask_confirmation", False),
+            message=result.get("result", "")
+        )
+
+    except HTTPException:
+        raise
+    except TurnCancelled:
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=429 if e.reason == "queue_full" else 503,
+            detail=f"Server is busy ({e.stage}), please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        logger.error("❌ Error in diagnose endpoint: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -0,0 +1,207 @@
+import os
+import math
+import time
+import asyncio
+import threading
+import logging
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from . import cancellation
+from .metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_IN_FLIGHT, ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Time budget for a chat turn to get through all admission gates
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "20"))
+
+_deadline = ContextVar("admission_deadline", default=None)
+# Slots a turn reserved on the event loop ({stage: limiter}), consumed by its first limit(stage)
+_reservations = ContextVar("admission_reservations", default=None)
+# Poll interval for turns queued on the event loop
+ASYNC_POLL_SECONDS = 0.02
+
+
+class OverloadedError(Exception):
+    def __init__(self, stage, reason, retry_after):
+        super().__init__(f"{stage} overloaded ({reason})")
+        self.stage = stage
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    """
+    Concurrency limit for one class of work with a bounded wait queue.
+    Callers that find the queue full, or cannot get a slot before their deadline, are rejected.
+    """
+
+    def __init__(self, stage, concurrency, queue_size, timeout):
+        self.stage = stage
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.waiting = 0
+        self.in_flight = 0
+        # Moving average of how long a slot is held, used for Retry-After
+        self.avg_hold_seconds = 1.0
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        backlog = (self.waiting + 1) / self.concurrency
+        return max(1, math.ceil(backlog * self.avg_hold_seconds))
+
+    def _reject(self, reason):
+        ADMISSION_REJECTED.labels(stage=self.stage, reason=reason).inc()
+        logger.warning("⛔ Từ chối %s: %s (waiting=%d)", self.stage, reason, self.waiting)
+        raise OverloadedError(self.stage, reason, self.retry_after())
+
+    def _enqueue(self):
+        with self._lock:
+            if self.waiting >= self.queue_size:
+                self._reject("queue_full")
+            self.waiting += 1
+            ADMISSION_QUEUE_DEPTH.labels(stage=self.stage).set(self.waiting)
+
+    def _dequeue(self):
+        with self._lock:
+            self.waiting -= 1
+            ADMISSION_QUEUE_DEPTH.labels(stage=self.stage).set(self.waiting)
+
+    def _timeout(self):
+        timeout = self.timeout
+        deadline = _deadline.get()
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        return timeout
+
+    def _wait_for_slot(self):
+        if self._slots.acquire(blocking=False):
+            return 0.0
+        self._enqueue()
+        timeout = self._timeout()
+        start = time.monotonic()
+        acquired = False
+        try:
+            # Wait in short slices so a turn whose client left gives up its place in the queue
+            while not acquired:
+                cancellation.check(f"admission_{self.stage}")
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    break
+                acquired = self._slots.acquire(timeout=min(0.25, remaining))
+        finally:
+            self._dequeue()
+        waited = time.monotonic() - start
+        if not acquired:
+            self._reject("deadline")
+        return waited
+
+    async def _wait_for_slot_async(self):
+        """
+        Same queue and deadline as _wait_for_slot, but the wait happens on the event loop
+        and does not hold a threadpool thread.
+        """
+        if self._slots.acquire(blocking=False):
+            return 0.0
+        self._enqueue()
+        timeout = self._timeout()
+        start = time.monotonic()
+        acquired = False
+        try:
+            while not acquired:
+                cancellation.check(f"admission_{self.stage}")
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(ASYNC_POLL_SECONDS, remaining))
+                acquired = self._slots.acquire(blocking=False)
+        finally:
+            self._dequeue()
+        waited = time.monotonic() - start
+        if not acquired:
+            self._reject("deadline")
+        return waited
+
+    @contextmanager
+    def slot(self):
+        reservations = _reservations.get()
+        # pop() is atomic, so either this turn or reserve() releasing it gets the reserved slot
+        if reservations is not None and reservations.pop(self.stage, None) is self:
+            pass
+        else:
+            waited = self._wait_for_slot()
+            ADMISSION_WAIT_SECONDS.labels(stage=self.stage).observe(waited)
+        with self._lock:
+            self.in_flight += 1
+            ADMISSION_IN_FLIGHT.labels(stage=self.stage).set(self.in_flight)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - start
+            with self._lock:
+                self.in_flight -= 1
+                self.avg_hold_seconds = 0.8 * self.avg_hold_seconds + 0.2 * held
+                ADMISSION_IN_FLIGHT.labels(stage=self.stage).set(self.in_flight)
+            self._slots.release()
+
+
+def _limiter_from_env(stage, concurrency, queue_size, timeout):
+    prefix = f"LIMIT_{stage.upper()}"
+    return StageLimiter(
+        stage,
+        concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+        queue_size=int(os.getenv(f"{prefix}_QUEUE", str(queue_size))),
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", str(timeout)))
+    )
+
+
+# CPU-bound model inference and outbound LLM calls get separate budgets
+limiters = {
+    "inference": _limiter_from_env("inference", concurrency=2, queue_size=16, timeout=5.0),
+    "llm": _limiter_from_env("llm", concurrency=8, queue_size=32, timeout=10.0),
+    # Retrieval-only /diagnose callers get their own budget in front of the shared inference one
+    "diagnose": _limiter_from_env("diagnose", concurrency=2, queue_size=8, timeout=5.0)
+}
+
+
+def limit(stage):
+    return limiters[stage].slot()
+
+
+@asynccontextmanager
+async def reserve(stage):
+    """
+    Queue for a `stage` slot on the event loop before the turn is dispatched to the threadpool,
+    so turns waiting for admission do not tie up worker threads. The turn's first limit(stage)
+    takes over the slot; if it never gets that far, the slot is released on exit.
+    """
+    limiter = limiters[stage]
+    waited = await limiter._wait_for_slot_async()
+    ADMISSION_WAIT_SECONDS.labels(stage=stage).observe(waited)
+    reservations = _reservations.get()
+    token = None
+    if reservations is None:
+        reservations = {}
+        token = _reservations.set(reservations)
+    reservations[stage] = limiter
+    try:
+        yield
+    finally:
+        if reservations.pop(stage, None) is not None:
+            limiter._slots.release()
+        if token is not None:
+            _reservations.reset(token)
+
+
+@contextmanager
+def request_deadline(seconds=REQUEST_DEADLINE_SECONDS):
+    """
+    Bound the total time the enclosed turn may spend waiting for admission.
+    """
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
@@ -0,0 +1,141 @@
+import os
+import asyncio
+import threading
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi.concurrency import run_in_threadpool
+from .metrics import CANCELLED_TURNS
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting route checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+_current_token = ContextVar("cancel_token", default=None)
+
+
+class TurnCancelled(BaseException):
+    """
+    Raised at the next stage boundary once the turn's client has gone away.
+    Like asyncio.CancelledError it is a BaseException, so `except Exception`
+    fallbacks in the pipeline do not turn it into an error answer.
+    """
+
+    def __init__(self, stage):
+        super().__init__(f"turn cancelled at {stage}")
+        self.stage = stage
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self.stopped_at = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+
+    def check(self, stage):
+        if not self._event.is_set():
+            return
+        with self._lock:
+            # Count the turn once, at the first stage that noticed
+            first = self.stopped_at is None
+            if first:
+                self.stopped_at = stage
+        if first:
+            CANCELLED_TURNS.labels(stage=stage).inc()
+            logger.info("🛑 Dừng xử lý tại %s: client đã ngắt kết nối", stage)
+        raise TurnCancelled(stage)
+
+
+def current():
+    return _current_token.get()
+
+
+def check(stage):
+    """
+    Stage boundary: raise TurnCancelled if the current turn has been cancelled.
+    """
+    token = _current_token.get()
+    if token is not None:
+        token.check(stage)
+
+
+def bind(token):
+    """
+    Make `token` current for the rest of this context (a task, or a copied thread context).
+    """
+    _current_token.set(token)
+
+
+@contextmanager
+def cancel_scope():
+    token = CancelToken()
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+async def _wait_or_disconnect(request, task, token):
+    """
+    Wait for task while polling the client. Returns False (and cancels the token) if the
+    client disconnected first.
+    """
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        if done:
+            return True
+        if await request.is_disconnected():
+            token.cancel()
+            return False
+
+
+async def run_until_disconnected(request, func, *args, **kwargs):
+    """
+    Run func in the threadpool while watching the client. On disconnect the turn's token is
+    cancelled and the pipeline stops at its next stage boundary; TurnCancelled is raised here.
+    """
+    with cancel_scope() as token:
+        task = asyncio.ensure_future(run_in_threadpool(func, *args, **kwargs))
+        await _wait_or_disconnect(request, task, token)
+        result = await task
+        if token.cancelled:
+            # The work finished before any stage noticed; nobody will read the answer anyway
+            token.check("finished")
+        return result
+
+
+_EXHAUSTED = object()
+
+
+async def stream_until_disconnected(request, iterator):
+    """
+    Iterate a sync streaming generator in the threadpool while watching the client. On
+    disconnect the token is cancelled so the worker stops at its next stage boundary
+    instead of finishing work nobody will read.
+    """
+    token = CancelToken()
+    # Set in the streaming task's context, which every threadpool step copies
+    bind(token)
+    finished = False
+    try:
+        while True:
+            step = asyncio.ensure_future(run_in_threadpool(next, iterator, _EXHAUSTED))
+            if not await _wait_or_disconnect(request, step, token):
+                return
+            chunk = step.result()
+            if chunk is _EXHAUSTED:
+                finished = True
+                return
+            yield chunk
+    finally:
+        if not finished:
+            token.cancel()
@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import queue
+import hashlib
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+# JSONL file chat turns are appended to; empty disables capture
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "")
+# Fraction of sessions captured; whole sessions are kept so diagnose_update chains stay intact
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1"))
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(50 * 1024 * 1024)))
+CAPTURE_BACKUP_COUNT = int(os.getenv("CAPTURE_BACKUP_COUNT", "5"))
+# Salt for the session hash; a random one per process unlinks captures from different runs
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "") or os.urandom(16).hex()
+
+CAPTURE_VERSION = 1
+
+# Span attributes that describe what the pipeline decided, compared by the replay tool
+OUTCOME_ATTRIBUTES = ("intent", "decision", "disease", "incremental", "speculation")
+
+# Order matters: URLs and emails before the digit patterns that would eat parts of them
+SCRUB_PATTERNS = [
+    (re.compile(r"https?://\S+|www\.\S+", re.IGNORECASE), "<url>"),
+    (re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"), "<email>"),
+    # Health insurance card numbers: two letters followed by 13 digits
+    (re.compile(r"\b[A-Z]{2}\d{13}\b"), "<id>"),
+    (re.compile(r"(?:\+84|\b0)(?:[\s.-]?\d){9,10}\b"), "<phone>"),
+    # Citizen ID / passport / account numbers and anything else with a long run of digits
+    (re.compile(r"\b\d{6,}\b"), "<number>")
+]
+
+logger = logging.getLogger(__name__)
+
+_capture_logger = None
+_listener = None
+
+
+def scrub(text):
+    """
+    Replace contact details and identifying numbers with placeholders.
+    """
+    for pattern, placeholder in SCRUB_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def _session_hash(session_id):
+    return hashlib.sha256(f"{CAPTURE_SALT}:{session_id}".encode("utf-8")).hexdigest()
+
+
+def should_capture(session_id):
+    """
+    Whether turns of this session are recorded. The decision is a function of the session id,
+    so every turn of a sampled session is captured.
+    """
+    if not CAPTURE_PATH or CAPTURE_SAMPLE_RATE <= 0:
+        return False
+    return int(_session_hash(session_id)[:8], 16) / 0x100000000 < CAPTURE_SAMPLE_RATE
+
+
+def _get_logger():
+    """
+    Writes go through a queue to a rotating file handler on a background thread, off the event loop.
+    """
+    global _capture_logger, _listener
+    if _capture_logger is None:
+        directory = os.path.dirname(CAPTURE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            CAPTURE_PATH, maxBytes=CAPTURE_MAX_BYTES, backupCount=CAPTURE_BACKUP_COUNT, encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        capture_queue = queue.SimpleQueue()
+        capture_logger = logging.getLogger("vimedical.capture")
+        capture_logger.propagate = False
+        capture_logger.setLevel(logging.INFO)
+        capture_logger.addHandler(logging.handlers.QueueHandler(capture_queue))
+        _listener = logging.handlers.QueueListener(capture_queue, handler)
+        _listener.start()
+        _capture_logger = capture_logger
+        logger.info("🎙️ Ghi lại lượt chat vào %s (sample rate %s)", CAPTURE_PATH, CAPTURE_SAMPLE_RATE)
+    return _capture_logger
+
+
+def summarize_trace(trace):
+    """
+    Stage timings (ms, summed per stage name) and pipeline outcome attributes of a trace dict,
+    as produced by Trace.to_dict() or returned with ?debug=true.
+    """
+    stages = {}
+    outcome = {}
+    for attributes in [trace.get("attributes", {})] + [s.get("attributes", {}) for s in trace.get("spans", [])]:
+        for key in OUTCOME_ATTRIBUTES:
+            if key in attributes:
+                outcome[key] = attributes[key]
+    for s in trace.get("spans", []):
+        if s.get("duration_ms") is not None:
+            stages[s["name"]] = round(stages.get(s["name"], 0.0) + s["duration_ms"], 3)
+    return stages, outcome
+
+
+def turn_record(session_id, turn, query, previous_symptoms, result, trace):
+    """
+    One capture line: the inputs needed to replay the turn, what was decided and how long each stage took.
+    """
+    stages, outcome = summarize_trace(trace.to_dict()) if trace is not None else ({}, {})
+    scrubbed_query = scrub(query)
+    outcome.update(
+        tier=result.get("tier", "error"),
+        disease=result.get("disease", "") or outcome.get("disease", ""),
+        possible_diseases=result.get("possible_diseases", []),
+        ask_confirmation=result.get("ask_confirmation", False)
+    )
+    return {
+        "v": CAPTURE_VERSION,
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "session": _session_hash(session_id)[:16],
+        "turn": turn,
+        "query": scrubbed_query,
+        # A replay sends the scrubbed text, so its decisions may legitimately differ for these turns
+        "scrubbed": scrubbed_query != query,
+        "previous_symptoms": scrub(previous_symptoms or ""),
+        "outcome": outcome,
+        "latency_ms": stages.get("chat_turn"),
+        "stages": stages
+    }
+
+
+def record_turn(session_id, turn, query, previous_symptoms, result, trace):
+    """
+    Append a turn to the capture file. Never raises: capture must not break the chat route.
+    """
+    try:
+        record = turn_record(session_id, turn, query, previous_symptoms, result, trace)
+        _get_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+    except Exception as e:
+        logger.warning("⚠️ Không ghi được lượt chat: %s", e)
+
+
+def shutdown_capture():
+    """
+    Flush queued records and stop the writer thread.
+    """
+    global _capture_logger, _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _capture_logger is not None:
+        for handler in list(_capture_logger.handlers):
+            _capture_logger.removeHandler(handler)
+        _capture_logger = None
@@ -1,25 +1,39 @@
 import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from .rag_chain import get_qa_chain
-from .tools import process_context
+from .tools import process_context, process_contexts
+from .metrics import stage_timer
+from .tracing import span
+from .profiler import profiler
+from .admission import limit, OverloadedError
+from .circuit_breaker import CircuitBreaker
+from .llm_client import LLMClient
+from .turn_graph import TurnGraph
+from .cancellation import TurnCancelled
+from .metrics import RESPONSE_TIER
 import logging
 
 load_dotenv()
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+# Concurrent LLM calls per batch request; the "llm" admission limiter still applies on top
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+# Tiers of the degradation ladder, reported in the response
+TIER_LLM = "llm"
+TIER_RETRIEVAL_ONLY = "retrieval_only"
+TIER_NO_LLM = "no_llm"
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-llm = ChatOpenAI(
-    api_key=OPENROUTER_API_KEY,
-    base_url="https://openrouter.ai/api/v1/chat/completions",
-    model_name="mistralai/mistral-small-3.2-24b-instruct:free",
-    temperature=0.5
+llm_circuit = CircuitBreaker(
+    "llm",
+    failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURES", "3")),
+    recovery_timeout=float(os.getenv("LLM_CIRCUIT_RECOVERY_SECONDS", "30"))
 )
 
 prompt_template = """
@@ -43,51 +57,188 @@ Bạn là một trợ lý y tế thông minh, trả lời câu hỏi y tế bằ
 prompt = ChatPromptTemplate.from_template(prompt_template)
 output_parser = StrOutputParser()
 
-def get_llm_chain():
-    qa_chain = get_qa_chain()
-
-    def run(query, previous_symptoms=""):
+# Pooled HTTP client, retries and optional hedging live in llm_client
+llm_client = LLMClient(prompt, output_parser)
+
+# Used when the LLM is unavailable or overloaded: answer from the retrieved context alone
+RETRIEVAL_ONLY_TEMPLATE = """Đây là thông tin tham khảo về {disease}:
+
+{context}
+
+(Hệ thống đang quá tải nên câu trả lời được trích trực tiếp từ tài liệu. Hãy đến bác sĩ nếu triệu chứng nghiêm trọng.)"""
+RETRIEVAL_ONLY_CONTEXT_CHARS = 1500
+
+def render_retrieval_only(result):
+    if result.get("disease") and result.get("context"):
+        context = result["context"]
+        if len(context) > RETRIEVAL_ONLY_CONTEXT_CHARS:
+            context = context[:RETRIEVAL_ONLY_CONTEXT_CHARS].rsplit(" ", 1)[0] + "..."
+        return RETRIEVAL_ONLY_TEMPLATE.format(disease=result["disease"], context=context)
+    # Ambiguous / not-found results already carry a user-facing message
+    return result.get("result", "")
+
+def degrade(result, reason):
+    logger.warning("⚠️ Trả lời không qua LLM (%s)", reason)
+    result["result"] = render_retrieval_only(result)
+    result["tier"] = TIER_RETRIEVAL_ONLY
+    return result
+
+def error_result(e, previous_symptoms):
+    return {
+        "result": f"Đã xảy ra lỗi: {str(e)}",
+        "disease": "",
+        "possible_diseases": [],
+        "context": "",
+        "source_documents": [],
+        "symptoms": previous_symptoms,
+        "ask_confirmation": False
+    }
+
+def generate(query, new_symptoms, result, on_chunk=None):
+    """
+    Turn a retrieval result into the final answer: call the LLM when the circuit allows it,
+    otherwise (or on failure) fall back to a retrieval-only answer.
+    on_chunk receives the answer text as it streams in (None means: discard what was sent so far).
+    """
+    if result.get("ask_confirmation", False):
+        logger.info("🔍 ask_confirmation được kích hoạt, trả về câu hỏi xác nhận mà không gọi LLM.")
+        result["tier"] = TIER_NO_LLM
+        return result
+
+    if not llm_circuit.allow():
+        return degrade(result, "circuit_open")
+
+    context = result.get("context", "")
+    if not context and result.get("possible_diseases"):
+        context = f"Các bệnh có thể liên quan: {', '.join(result['possible_diseases'])}"
+
+    input_data = {
+        "context": context,
+        "question": query,
+        "previous_symptoms": new_symptoms if new_symptoms else ""
+    }
+
+    try:
+        with limit("llm"):
+            with stage_timer("llm", prompt_chars=sum(len(v) for v in input_data.values())) as current:
+                final_response, model = llm_client.invoke(input_data, on_chunk=on_chunk)
+                current.set(response_chars=len(final_response), model=model)
+    except OverloadedError:
+        llm_circuit.record_skipped()
+        return degrade(result, "llm_overloaded")
+    except TurnCancelled:
+        # Nobody is waiting for the answer; this says nothing about the LLM's health
+        llm_circuit.record_skipped()
+        raise
+    except Exception as e:
+        llm_circuit.record_failure()
+        logger.error("❌ Lỗi khi gọi LLM: %s", e)
+        return degrade(result, "llm_error")
+    llm_circuit.record_success()
+
+    result["result"] = final_response
+    result["tier"] = TIER_LLM
+    return result
+
+def get_llm_chain(qa_chain=None):
+    if qa_chain is None:
+        qa_chain = get_qa_chain()
+
+    def run(query, previous_symptoms="", diagnostic_state=None, on_event=None):
+        """
+        on_event(kind, payload), if given, receives partial results: "retrieval" once the
+        retrieval result is known and "chunk" for each piece of streamed answer text.
+        """
+        with profiler.profile_turn():
+            result = answer(query, previous_symptoms, diagnostic_state, on_event)
+        RESPONSE_TIER.labels(tier=result.get("tier", "error")).inc()
+        return result
+
+    def answer(query, previous_symptoms="", diagnostic_state=None, on_event=None):
+        graph = TurnGraph("chat")
         try:
-            logger.info(f"🔍 Xử lý câu hỏi LLM: {query}")
-            context_result = process_context(query, previous_symptoms)
-            processed_query = context_result["query"]
-            new_symptoms = context_result["symptoms"]
-            ask_confirmation = context_result.get("ask_confirmation", False)
-
-            result = qa_chain(processed_query, previous_symptoms=new_symptoms)
-
-            if result.get("ask_confirmation", False):
-                logger.info("🔍 ask_confirmation được kích hoạt, trả về câu hỏi xác nhận mà không gọi LLM.")
+            logger.debug("🔍 Xử lý câu hỏi LLM: %s", query)
+            with limit("inference"):
+                # Disease-name match and question search start now and overlap with intent detection
+                prefetched = qa_chain.prefetch(query, graph)
+                with graph.step("detect_intent"), span("process_context"):
+                    context_result = process_context(query, previous_symptoms)
+                processed_query = context_result["query"]
+                new_symptoms = context_result["symptoms"]
+                if context_result.get("reset", False):
+                    diagnostic_state = None
+
+                with span("retrieval"):
+                    result = qa_chain(
+                        processed_query,
+                        previous_symptoms=new_symptoms,
+                        prefetched=prefetched,
+                        diagnostic_state=diagnostic_state,
+                        intent=context_result.get("intent")
+                    )
+
+            on_chunk = None
+            if on_event:
+                on_event("retrieval", {
+                    "disease": result.get("disease", ""),
+                    "possible_diseases": result.get("possible_diseases", []),
+                    "symptoms": result.get("symptoms", new_symptoms),
+                    "ask_confirmation": result.get("ask_confirmation", False)
+                })
+                on_chunk = lambda text: on_event("chunk", {"text": text})
+
+            with graph.step("generate"):
+                return generate(query, new_symptoms, result, on_chunk=on_chunk)
+
+        except OverloadedError:
+            raise
+        except Exception as e:
+            logger.error("❌ Lỗi trong LLM chain: %s", e, exc_info=True)
+            return error_result(e, previous_symptoms)
+        finally:
+            graph.finish()
+
+    def run_batch(queries, previous_symptoms_list=None, retrieval_only=False):
+        """
+        Answer a batch of queries. Retrieval runs as one batched pass under a single
+        inference slot; LLM calls then run with bounded concurrency. Yields
+        (index, result or exception) in input order as soon as each item is ready.
+        """
+        previous_symptoms_list = previous_symptoms_list or [""] * len(queries)
+        with limit("inference"):
+            with span("process_context", batch=len(queries)):
+                context_results = process_contexts(queries, previous_symptoms_list)
+            processed = [c["query"] for c in context_results]
+            symptoms = [c["symptoms"] for c in context_results]
+            with span("retrieval", batch=len(queries)):
+                results = qa_chain.batch(processed, symptoms)
+
+        if retrieval_only:
+            for i, result in enumerate(results):
+                yield i, result
+            return
+
+        def finish(i):
+            result = results[i]
+            if isinstance(result, Exception):
                 return result
-
-            context = result.get("context", "")
-            if not context and result.get("possible_diseases"):
-                context = f"Các bệnh có thể liên quan: {', '.join(result['possible_diseases'])}"
-
-            input_data = {
-                "context": context,
-                "question": query,
-                "previous_symptoms": new_symptoms if new_symptoms else ""
-            }
-
-            response = prompt | llm | output_parser
-            final_response = response.invoke(input_data)
-
-            result["result"] = final_response
+            try:
+                # Each item's LLM call is profiled like a chat turn
+                with profiler.profile_turn():
+                    result = generate(queries[i], symptoms[i], result)
+            except Exception as e:
+                logger.error("❌ Lỗi trong LLM chain: %s", e, exc_info=True)
+                return e
+            RESPONSE_TIER.labels(tier=result.get("tier", "error")).inc()
             return result
 
-        except Exception as e:
-            logger.error(f"❌ Lỗi trong LLM chain: {e}")
-            return {
-                "result": f"Đã xảy ra lỗi: {str(e)}",
-                "disease": "",
-                "possible_diseases": [],
-                "context": "",
-                "source_documents": [],
-                "symptoms": previous_symptoms,
-                "ask_confirmation": False
-            }
+        with ThreadPoolExecutor(max_workers=max(1, BATCH_LLM_CONCURRENCY), thread_name_prefix="batch-llm") as pool:
+            # Copy the context so trace spans and the cancel token follow each item
+            futures = [pool.submit(contextvars.copy_context().run, finish, i) for i in range(len(queries))]
+            for i, future in enumerate(futures):
+                yield i, future.result()
 
+    run.batch = run_batch
     return run
 
 def is_reference_to_last_disease(query):
@@ -0,0 +1,293 @@
+import os
+import time
+import random
+import threading
+import contextvars
+import importlib.util
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import httpx
+import openai
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from .metrics import LLM_REQUEST_SECONDS, LLM_RETRIES, LLM_HEDGES
+from .tracing import annotate
+from . import cancellation
+from .cancellation import TurnCancelled
+from .profiler import profiler
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1/chat/completions")
+LLM_MODEL = os.getenv("LLM_MODEL", "mistralai/mistral-small-3.2-24b-instruct:free")
+# Model for the hedged attempt; defaults to the primary model
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "") or LLM_MODEL
+
+# Total time budget for one answer, across retries and hedges
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "25"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "3"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "20"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+# HTTP/2 needs the optional `h2` package (httpx[http2]); falls back to HTTP/1.1 without it
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "4"))
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+# Hedge after this quantile of recent primary latencies, clamped to [min, max]
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "15"))
+# Delay used until enough samples have been collected
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8"))
+LLM_HEDGE_MIN_SAMPLES = 20
+
+LATENCY_WINDOW = 200
+
+# Transient failures worth another attempt; anything else (bad request, auth) fails fast
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError
+)
+
+
+class LatencyStats:
+    """
+    Sliding window of successful call latencies per model.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model, seconds):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, model, q):
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def count(self, model):
+        with self._lock:
+            return len(self._samples.get(model, ()))
+
+    def summary(self):
+        with self._lock:
+            models = list(self._samples)
+        return {
+            model: {
+                "samples": self.count(model),
+                "p50": self.quantile(model, 0.5),
+                "p95": self.quantile(model, 0.95),
+                "p99": self.quantile(model, 0.99)
+            }
+            for model in models
+        }
+
+
+latency_stats = LatencyStats()
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """
+    Process-wide pooled client shared by every model, so connections stay warm between turns.
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            http2 = LLM_HTTP2 and importlib.util.find_spec("h2") is not None
+            if LLM_HTTP2 and not http2:
+                logger.warning("⚠️ Thiếu gói h2, dùng HTTP/1.1 cho LLM")
+            _http_client = httpx.Client(
+                http2=http2,
+                timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_SECONDS
+                )
+            )
+        return _http_client
+
+
+def backoff_delay(attempt):
+    # Full jitter: uniform in [0, base * 2^attempt], capped
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * (2 ** attempt)))
+
+
+class LLMClient:
+    """
+    Runs `prompt | ChatOpenAI | output_parser` over the shared HTTP client with a time budget,
+    jittered retries on transient errors and, optionally, a hedged second attempt.
+    """
+
+    def __init__(self, prompt, output_parser, model=LLM_MODEL, fallback_model=LLM_FALLBACK_MODEL,
+                 temperature=0.5, hedge=LLM_HEDGE_ENABLED):
+        self.model = model
+        self.fallback_model = fallback_model or model
+        self.hedge = hedge
+        self._chains = {}
+        self._parts = {}
+        for name in {self.model, self.fallback_model}:
+            llm = ChatOpenAI(
+                api_key=OPENROUTER_API_KEY,
+                base_url=LLM_BASE_URL,
+                model_name=name,
+                temperature=temperature,
+                timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                # Retries are handled here so they share the turn's budget
+                max_retries=0,
+                http_client=get_http_client()
+            )
+            self._chains[name] = prompt | llm | output_parser
+            self._parts[name] = (prompt, llm, output_parser)
+        self._executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONNECTIONS, thread_name_prefix="llm-hedge")
+
+    def hedge_delay(self):
+        if latency_stats.count(self.model) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        delay = latency_stats.quantile(self.model, LLM_HEDGE_QUANTILE)
+        return max(LLM_HEDGE_MIN_DELAY, min(LLM_HEDGE_MAX_DELAY, delay))
+
+    def _chain(self, model, remaining):
+        if remaining >= LLM_READ_TIMEOUT:
+            return self._chains[model]
+        # Late attempts get a per-request timeout, so a stalled read cannot outlast the turn's budget
+        prompt, llm, output_parser = self._parts[model]
+        timeout = httpx.Timeout(remaining, connect=min(LLM_CONNECT_TIMEOUT, remaining))
+        return prompt | llm.bind(timeout=timeout) | output_parser
+
+    def _attempt(self, model, input_data, deadline, abandoned=None, on_chunk=None):
+        """
+        One HTTP attempt. The response is streamed so that a cancelled turn, a hedge that
+        already lost or an answer past the turn's deadline closes the connection instead of
+        paying for the rest of the generation. Returns None when abandoned.
+        """
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            cancellation.check("llm")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                outcome = "timeout"
+                raise TimeoutError(f"LLM did not answer within {LLM_TIMEOUT_SECONDS}s")
+            parts = []
+            stream = self._chain(model, remaining).stream(input_data)
+            try:
+                for chunk in stream:
+                    if abandoned is not None and abandoned.is_set():
+                        outcome = "abandoned"
+                        return None
+                    cancellation.check("llm")
+                    if time.monotonic() > deadline:
+                        # The read timeout only bounds the gap between chunks, not the whole answer
+                        outcome = "timeout"
+                        raise TimeoutError(f"LLM did not answer within {LLM_TIMEOUT_SECONDS}s")
+                    parts.append(chunk)
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+            finally:
+                stream.close()
+            outcome = "ok"
+        except TurnCancelled:
+            outcome = "cancelled"
+            raise
+        except RETRYABLE_ERRORS:
+            outcome = "retryable"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            LLM_REQUEST_SECONDS.labels(model=model, outcome=outcome).observe(elapsed)
+        latency_stats.observe(model, elapsed)
+        return "".join(parts)
+
+    def _call_with_retries(self, model, input_data, deadline, abandoned=None, on_chunk=None):
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(model, input_data, deadline, abandoned, on_chunk), model
+            except RETRYABLE_ERRORS as e:
+                delay = backoff_delay(attempt)
+                if attempt >= LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                LLM_RETRIES.labels(model=model).inc()
+                logger.warning("🔁 Thử lại LLM %s (lần %d) sau %.2fs: %s", model, attempt, delay, e)
+                if on_chunk is not None:
+                    # The retry streams the answer again from the start
+                    on_chunk(None)
+                time.sleep(delay)
+
+    def _submit(self, model, input_data, deadline, abandoned):
+        # Keep the caller's trace context, cancel token and profiling session in the worker thread
+        ctx = contextvars.copy_context()
+
+        def attempt():
+            with profiler.worker():
+                return self._call_with_retries(model, input_data, deadline, abandoned)
+
+        return self._executor.submit(ctx.run, attempt)
+
+    def invoke(self, input_data, on_chunk=None):
+        """
+        Returns (text, model that answered). on_chunk gets the text as it streams in; with
+        hedging enabled the answer is only known once an attempt wins, so it gets it whole.
+        """
+        deadline = time.monotonic() + LLM_TIMEOUT_SECONDS
+        if not self.hedge:
+            return self._call_with_retries(self.model, input_data, deadline, on_chunk=on_chunk)
+        text, model = self._hedged(input_data, deadline)
+        if on_chunk is not None:
+            on_chunk(text)
+        return text, model
+
+    def _hedged(self, input_data, deadline):
+        delay = self.hedge_delay()
+        attempts = {}
+        primary = self._submit(self.model, input_data, deadline, attempts.setdefault("primary", threading.Event()))
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        LLM_HEDGES.labels(outcome="fired").inc()
+        annotate(hedged_after_ms=round(delay * 1000))
+        logger.info("🪁 Gửi yêu cầu dự phòng tới %s sau %.2fs", self.fallback_model, delay)
+        hedge = self._submit(self.fallback_model, input_data, deadline, attempts.setdefault("hedge", threading.Event()))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                done, pending = wait(pending, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError(f"LLM did not answer within {LLM_TIMEOUT_SECONDS}s")
+                for future in done:
+                    error = future.exception()
+                    if error is None:
+                        if future is hedge:
+                            LLM_HEDGES.labels(outcome="won").inc()
+                        return future.result()
+                    if isinstance(error, TurnCancelled):
+                        raise error
+            raise error
+        finally:
+            # Whatever happened, the other attempt is no longer needed
+            for abandoned in attempts.values():
+                abandoned.set()
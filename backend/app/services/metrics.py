@@ -0,0 +1,129 @@
+import time
+from contextlib import ContextDecorator
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from .tracing import span, annotate
+
+# LLM calls on the free tier can take tens of seconds, so the buckets go well past the defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "vimedical_stage_seconds",
+    "Time spent in each stage of a chat turn",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+DECISIONS = Counter(
+    "vimedical_decisions_total",
+    "Outcome of the retrieval decision for each turn",
+    ["outcome"]
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "vimedical_admission_queue_depth",
+    "Requests waiting for an admission slot",
+    ["stage"]
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "vimedical_admission_in_flight",
+    "Requests currently holding an admission slot",
+    ["stage"]
+)
+
+ADMISSION_WAIT_SECONDS = Histogram(
+    "vimedical_admission_wait_seconds",
+    "Time spent waiting for an admission slot",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+ADMISSION_REJECTED = Counter(
+    "vimedical_admission_rejected_total",
+    "Requests rejected by admission control",
+    ["stage", "reason"]
+)
+
+RESPONSE_TIER = Counter(
+    "vimedical_response_tier_total",
+    "Which degradation tier served each chat turn",
+    ["tier"]
+)
+
+CIRCUIT_STATE = Gauge(
+    "vimedical_circuit_state",
+    "Circuit breaker state (0=closed, 1=half_open, 2=open)",
+    ["name"]
+)
+
+LLM_REQUEST_SECONDS = Histogram(
+    "vimedical_llm_request_seconds",
+    "Latency of each LLM HTTP attempt",
+    ["model", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+
+LLM_RETRIES = Counter(
+    "vimedical_llm_retries_total",
+    "LLM attempts retried after a transient error",
+    ["model"]
+)
+
+LLM_HEDGES = Counter(
+    "vimedical_llm_hedges_total",
+    "Hedged LLM requests (fired = second attempt sent, won = second attempt answered first)",
+    ["outcome"]
+)
+
+CRITICAL_PATH_SECONDS = Histogram(
+    "vimedical_critical_path_seconds",
+    "Time each stage contributed to the critical path of a turn",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+TURN_BRANCHES = Counter(
+    "vimedical_turn_branches_total",
+    "Concurrent branches started within a turn, by whether their result was used",
+    ["branch", "outcome"]
+)
+
+CANCELLED_TURNS = Counter(
+    "vimedical_cancelled_turns_total",
+    "Turns abandoned because the client went away, by the stage where work stopped",
+    ["stage"]
+)
+
+
+class stage_timer(ContextDecorator):
+    """
+    Context manager / decorator that records the duration of a pipeline stage
+    in the stage histogram and as a span of the active trace.
+    """
+
+    def __init__(self, stage, **attributes):
+        self.stage = stage
+        self.attributes = attributes
+
+    def _recreate_cm(self):
+        # Each decorated call needs its own timer state
+        return stage_timer(self.stage, **self.attributes)
+
+    def __enter__(self):
+        self._span_cm = span(self.stage, **self.attributes)
+        current = self._span_cm.__enter__()
+        self._start = time.perf_counter()
+        return current
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.labels(stage=self.stage).observe(time.perf_counter() - self._start)
+        return self._span_cm.__exit__(exc_type, exc, tb)
+
+
+def record_decision(outcome):
+    DECISIONS.labels(outcome=outcome).inc()
+    annotate(decision=outcome)
+
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
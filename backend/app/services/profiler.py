@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import threading
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 128
+
+# Session a turn was registered in; worker threads running in a copy of its context follow it
+_profiled_session = ContextVar("profiled_session", default=None)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+class SamplingProfiler:
+    """
+    Stack sampler for chat turns. While a session is active a background thread
+    samples the stacks of threads currently inside profile_turn(), and of the worker
+    threads those turns hand work to (see worker()); when idle, both cost a single
+    attribute check.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = False
+        self._threads = Counter()
+        self._stacks = Counter()
+        self._sampler = None
+        self._session = {}
+        # Bumped by every start(), so a sampler or turn from an earlier session cannot touch the new one
+        self._generation = 0
+
+    def start(self, requests=None, seconds=None, interval_ms=5):
+        with self._lock:
+            if self.active:
+                raise RuntimeError("Profiler is already running")
+            self._stacks = Counter()
+            self._threads = Counter()
+            self._session = {
+                "requests": requests,
+                "seconds": seconds,
+                "interval_ms": interval_ms,
+                "turns_started": 0,
+                "turns_finished": 0,
+                "samples": 0,
+                "started_at": time.time(),
+                "deadline": time.time() + seconds if seconds else None,
+                "stopped_at": None
+            }
+            self.active = True
+            self._generation += 1
+            self._sampler = threading.Thread(target=self._run, args=(self._generation,), name="chat-profiler", daemon=True)
+            self._sampler.start()
+        logger.info(f"🔥 Profiler bật: requests={requests}, seconds={seconds}, interval={interval_ms}ms")
+
+    def stop(self, generation=None):
+        with self._lock:
+            if not self.active or (generation is not None and generation != self._generation):
+                return
+            self.active = False
+            self._session["stopped_at"] = time.time()
+        logger.info(f"🔥 Profiler tắt sau {self._session['samples']} mẫu")
+
+    @contextmanager
+    def profile_turn(self):
+        if not self.active:
+            yield
+            return
+        thread_id = threading.get_ident()
+        with self._lock:
+            generation = self._generation
+            limit = self._session["requests"]
+            registered = self.active and (limit is None or self._session["turns_started"] < limit)
+            if registered:
+                self._session["turns_started"] += 1
+                self._threads[thread_id] += 1
+        token = _profiled_session.set(generation) if registered else None
+        try:
+            yield
+        finally:
+            if registered:
+                _profiled_session.reset(token)
+                done = False
+                with self._lock:
+                    # A restart mid-turn reset the counters; this turn belongs to the old session
+                    if generation == self._generation:
+                        self._release(thread_id)
+                        self._session["turns_finished"] += 1
+                        done = limit is not None and self._session["turns_finished"] >= limit
+                if done:
+                    self.stop(generation)
+
+    @contextmanager
+    def worker(self):
+        """
+        Sample the current thread while it works for a profiled turn. For code that runs in
+        a copy of the turn's context on another thread (turn-graph branches, LLM attempts).
+        """
+        if not self.active:
+            yield
+            return
+        thread_id = threading.get_ident()
+        with self._lock:
+            generation = self._generation
+            registered = self.active and _profiled_session.get() == generation
+            if registered:
+                self._threads[thread_id] += 1
+        try:
+            yield
+        finally:
+            if registered:
+                with self._lock:
+                    if generation == self._generation:
+                        self._release(thread_id)
+
+    def _release(self, thread_id):
+        self._threads[thread_id] -= 1
+        if self._threads[thread_id] <= 0:
+            del self._threads[thread_id]
+
+    def _run(self, generation):
+        interval = self._session["interval_ms"] / 1000.0
+        own_id = threading.get_ident()
+        while self.active and generation == self._generation:
+            time.sleep(interval)
+            deadline = self._session["deadline"]
+            if deadline and time.time() >= deadline:
+                self.stop(generation)
+                break
+            with self._lock:
+                thread_ids = [tid for tid in self._threads if tid != own_id]
+            if not thread_ids:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                if not self.active or generation != self._generation:
+                    break
+                for tid in thread_ids:
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        self._stacks[_collapse(frame)] += 1
+                        self._session["samples"] += 1
+
+    def status(self):
+        with self._lock:
+            return {"active": self.active, **self._session}
+
+    def collapsed(self):
+        """
+        Collapsed stacks ("frame;frame;frame count"), ready for flamegraph.pl or speedscope.
+        """
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return "\n".join(f"{stack} {count}" for stack, count in stacks)
+
+    def hot_functions(self, limit=30):
+        with self._lock:
+            stacks = list(self._stacks.items())
+        total = sum(count for _, count in stacks) or 1
+        self_counts = Counter()
+        inclusive_counts = Counter()
+        for stack, count in stacks:
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for frame in set(frames):
+                inclusive_counts[frame] += count
+        return [
+            {
+                "function": name,
+                "inclusive_samples": count,
+                "inclusive_pct": round(100.0 * count / total, 2),
+                "self_samples": self_counts.get(name, 0),
+                "self_pct": round(100.0 * self_counts.get(name, 0) / total, 2)
+            }
+            for name, count in inclusive_counts.most_common(limit)
+        ]
+
+
+# Global profiler instance
+profiler = SamplingProfiler()
@@ -1,24 +1,42 @@
 import os
+import re
 from dotenv import load_dotenv
 from langchain_community.vectorstores import Qdrant
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Filter, FieldCondition, MatchValue
-from sentence_transformers import CrossEncoder
+from qdrant_client.http.models import Filter, FieldCondition, MatchValue, SearchRequest
 import logging
-from .tools import process_context, COMMON_SYMPTOMS
+from .tools import process_context, process_contexts, get_cross_encoder, COMMON_SYMPTOMS
+from .metrics import stage_timer, record_decision
+from .turn_graph import TurnGraph
+from . import cancellation
+from .tracing import span, annotate
 
 load_dotenv()
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+# Directory of an embedded (in-process) Qdrant, used instead of QDRANT_URL when set, e.g. by the load test
+QDRANT_PATH = os.getenv("QDRANT_PATH")
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
 COLLECTION_QUESTIONS = "vimedical-questions"
 COLLECTION_INFORMATION = "vimedical-information"
 
-logging.basicConfig(level=logging.INFO)
+# Questions retrieved (and reranked) per diagnosis, information chunks passed to the LLM
+QUESTION_K = int(os.getenv("QUESTION_K", "20"))
+INFORMATION_K = int(os.getenv("INFORMATION_K", "6"))
+# A disease is picked without asking back when its score beats the runner-up by this ratio and reaches the floor
+DIAGNOSIS_MARGIN = float(os.getenv("DIAGNOSIS_MARGIN", "1.125"))
+DIAGNOSIS_MIN_SCORE = float(os.getenv("DIAGNOSIS_MIN_SCORE", "0.92"))
+# Upper bound for the catalog scan of collection_information
+CATALOG_SCAN_LIMIT = 8317
+# Weight of the previous turn's disease scores when a diagnose_update turn adds symptoms
+DIAGNOSIS_SCORE_DECAY = float(os.getenv("DIAGNOSIS_SCORE_DECAY", "0.5"))
+
 logger = logging.getLogger(__name__)
 
-reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+def get_reranker():
+    return get_cross_encoder()
 
 def normalize_disease_name(name):
     return " ".join(w.capitalize() for w in name.strip().split())
@@ -37,9 +55,14 @@ def is_disease_name(query, known_diseases):
         return max(candidates, key=len)
     return None
 
+def get_qdrant_client():
+    if QDRANT_PATH:
+        return QdrantClient(path=QDRANT_PATH)
+    return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+
 def load_vectorstores():
-    client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-    embedding = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    client = get_qdrant_client()
+    embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
 
     questions_vs = Qdrant(
         client=client,
@@ -59,138 +82,383 @@ def load_vectorstores():
 
     return questions_vs, information_vs
 
-def get_qa_chain():
-    questions_vs, information_vs = load_vectorstores()
+def build_result(message, symptoms, disease="", possible_diseases=None, context="", source_documents=None, ask_confirmation=False):
+    return {
+        "result": message,
+        "disease": disease,
+        "possible_diseases": possible_diseases or [],
+        "context": context,
+        "source_documents": source_documents or [],
+        "symptoms": symptoms,
+        "ask_confirmation": ask_confirmation
+    }
+
+def disease_filter(disease):
+    return Filter(should=[
+        FieldCondition(key="metadata.disease", match=MatchValue(value=disease)),
+        FieldCondition(key="metadata.diseases", match=MatchValue(value=disease))
+    ])
+
+def score_diseases(ranked_docs):
+    """
+    Sum reranker scores per disease; returns (disease, score) pairs, best first.
+    """
+    disease_scores = {}
+    for doc in ranked_docs:
+        disease = doc["metadata"].get("disease", "").strip()
+        if disease:
+            disease = normalize_disease_name(disease)
+            disease_scores[disease] = disease_scores.get(disease, 0) + doc["score"]
+    return sorted(disease_scores.items(), key=lambda x: x[1], reverse=True)
+
+def symptom_delta(previous_query, processed_query):
+    """
+    Text a diagnose_update turn appended to the previously scored query, minus symptoms that
+    were already scored. None when the query does not extend the previous one. Callers only
+    use it for diagnose_update turns; a prefix match alone does not make a turn an update.
+    """
+    if not previous_query or not processed_query.startswith(previous_query):
+        return None
+    delta = processed_query[len(previous_query):]
+    previous_lower = previous_query.lower()
+    for symptom in COMMON_SYMPTOMS:
+        if symptom in previous_lower:
+            delta = re.sub(rf"(?<!\w){re.escape(symptom)}(?!\w)", " ", delta, flags=re.IGNORECASE)
+    return " ".join(delta.split())
+
+def merge_scores(previous_scores, new_scores, decay=DIAGNOSIS_SCORE_DECAY):
+    """
+    Decayed accumulation: previous turn's scores weighted by `decay` plus this turn's. Best first.
+    """
+    merged = {disease: decay * score for disease, score in previous_scores.items()}
+    for disease, score in new_scores:
+        merged[disease] = merged.get(disease, 0) + score
+    return sorted(merged.items(), key=lambda x: x[1], reverse=True)
+
+def is_confident(sorted_candidates, margin=DIAGNOSIS_MARGIN, min_score=DIAGNOSIS_MIN_SCORE):
+    top1_score = sorted_candidates[0][1]
+    top2_score = sorted_candidates[1][1] if len(sorted_candidates) > 1 else 0
+    return top1_score > margin * top2_score and top1_score >= min_score
+
+def decide_disease(sorted_candidates, new_symptoms, margin=DIAGNOSIS_MARGIN, min_score=DIAGNOSIS_MIN_SCORE):
+    """
+    Apply the confidence rule. Returns (disease, None) when confident, otherwise (None, result to return).
+    """
+    if not sorted_candidates:
+        record_decision("not_found")
+        return None, build_result("Tôi chưa xác định được bệnh cụ thể. Vui lòng cung cấp thêm thông tin.", new_symptoms)
+
+    annotate(candidates=[{"disease": name, "score": float(score)} for name, score in sorted_candidates[:5]])
+    if is_confident(sorted_candidates, margin, min_score):
+        return sorted_candidates[0][0], None
+
+    top3 = [name for name, _ in sorted_candidates[:3]]
+    record_decision("ambiguous_top3")
+    return None, build_result(
+        f"Tôi chưa chắc chắn. Bạn có thể đang mắc một trong các bệnh: {', '.join(top3)}. Vui lòng chọn bệnh hoặc cung cấp thêm thông tin.",
+        new_symptoms,
+        possible_diseases=top3
+    )
+
+def information_result(disease_detected, info_docs, new_symptoms):
+    if info_docs:
+        context = "\n\n".join([doc["content"] for doc in info_docs])
+        annotate(disease=disease_detected, context_docs=len(info_docs), context_chars=len(context))
+        return build_result(
+            f"Đây là thông tin chi tiết về {disease_detected}:",
+            new_symptoms,
+            disease=disease_detected,
+            possible_diseases=[disease_detected],
+            context=context,
+            source_documents=info_docs
+        )
+    return build_result(
+        f"Tôi chưa tìm thấy thông tin chi tiết về {disease_detected}.",
+        new_symptoms,
+        disease=disease_detected,
+        possible_diseases=[disease_detected]
+    )
 
+def load_known_diseases(information_vs):
+    """
+    Catalog of normalized disease names, for matching disease names in queries.
+    """
     known_diseases = set()
     try:
-        info_docs = information_vs.as_retriever(search_kwargs={"k": 8317}).invoke("all diseases")
+        info_docs = information_vs.as_retriever(search_kwargs={"k": CATALOG_SCAN_LIMIT}).invoke("all diseases")
         for doc in info_docs:
-            disease = doc.metadata.get("disease", "").strip()
-            if disease:
-                known_diseases.add(normalize_disease_name(disease))
-        logger.info(f"🔍 Đã tải {len(known_diseases)} bệnh từ collection_information")
+            # Deduplicated chunks list every disease they stand in for
+            for disease in [doc.metadata.get("disease", "")] + doc.metadata.get("diseases", []):
+                disease = disease.strip()
+                if disease:
+                    known_diseases.add(normalize_disease_name(disease))
+        logger.info("🔍 Đã tải %d bệnh từ collection_information", len(known_diseases))
     except Exception as e:
-        logger.error(f"❌ Lỗi khi lấy danh sách bệnh: {e}")
+        logger.error("❌ Lỗi khi lấy danh sách bệnh: %s", e)
+    return known_diseases
+
+def get_qa_chain():
+    questions_vs, information_vs = load_vectorstores()
+    reranker = get_reranker()
+    known_diseases = load_known_diseases(information_vs)
+
+    def rerank(pairs):
+        # One cross-encoder call for all (query, document) pairs
+        with stage_timer("rerank", pairs=len(pairs)):
+            return reranker.predict(pairs, show_progress_bar=False) if pairs else []
+
+    def resolve_context(context_result):
+        """
+        Shared pre-retrieval step: returns (processed_query, new_symptoms, early_result).
+        """
+        processed_query = context_result["query"]
+        new_symptoms = context_result["symptoms"]
+
+        if context_result.get("ask_confirmation", False):
+            logger.info("🔍 Yêu cầu xác nhận bệnh, không truy xuất thông tin.")
+            record_decision("ask_confirmation")
+            return processed_query, new_symptoms, build_result(processed_query, new_symptoms, ask_confirmation=True)
+
+        if context_result.get("reset", False):
+            logger.info("🔍 Reset ngữ cảnh")
+            new_symptoms = ""
+        return processed_query, new_symptoms, None
+
+    def match_disease_name(processed_query):
+        with stage_timer("is_disease_name", catalog_size=len(known_diseases)) as current:
+            disease = is_disease_name(processed_query, known_diseases)
+            current.set(match=disease)
+        if disease:
+            logger.info("🔍 Phát hiện tên bệnh: %s", disease, extra={"disease": disease})
+        return disease
+
+    def search_questions(query, cancelled=None):
+        with stage_timer("question_retrieval") as current:
+            vector = questions_vs.embeddings.embed_query(query)
+            if cancelled is not None and cancelled.is_set():
+                current.set(cancelled=True)
+                return None
+            cancellation.check("question_retrieval")
+            question_docs = questions_vs.similarity_search_by_vector(vector, k=QUESTION_K)
+            current.set(hits=len(question_docs))
+        return question_docs
 
-    def run(query, previous_symptoms=""):
+    def prefetch(query, graph=None):
+        """
+        Start the branches that only need the raw query (disease-name match and question search)
+        so they overlap with intent detection. run() uses them when the processed query is unchanged.
+        """
+        graph = graph or TurnGraph("qa")
+        return {
+            "query": query,
+            "graph": graph,
+            "disease_match": graph.spawn("is_disease_name", match_disease_name, query),
+            "question_search": graph.spawn("question_retrieval", search_questions, query, cancellable=True)
+        }
+
+    def score_questions(query, question_docs):
+        scores = rerank([(query, doc.page_content) for doc in question_docs])
+        ranked_docs = [
+            {"content": doc.page_content, "metadata": doc.metadata, "score": float(score)}
+            for doc, score in zip(question_docs, scores)
+        ]
+        return score_diseases(sorted(ranked_docs, key=lambda x: x["score"], reverse=True))
+
+    def run(query, previous_symptoms="", prefetched=None, diagnostic_state=None, intent=None):
+        """
+        diagnostic_state is the previous turn's {"query", "scores"}; the result carries the next one
+        under "diagnostic_state" (None when there is nothing worth carrying over). intent is the
+        caller's own detection for the raw turn, when query is already the processed one.
+        """
+        own_graph = prefetched is None
+        if own_graph:
+            prefetched = prefetch(query)
+        try:
+            result = answer(query, previous_symptoms, prefetched, diagnostic_state, intent)
+        finally:
+            if own_graph:
+                prefetched["graph"].finish()
+        result.setdefault("diagnostic_state", None)
+        return result
+
+    def answer(query, previous_symptoms, prefetched, diagnostic_state, intent):
+        new_symptoms = previous_symptoms
+        graph = prefetched["graph"]
+        branches = (prefetched["disease_match"], prefetched["question_search"])
         try:
-            logger.info(f"🔍 Xử lý câu hỏi: {query}")
-            context_result = process_context(query, previous_symptoms)
-            processed_query = context_result["query"]
-            new_symptoms = context_result["symptoms"]
-            reset = context_result.get("reset", False)
-            ask_confirmation = context_result.get("ask_confirmation", False)
-
-            if ask_confirmation:
-                logger.info("🔍 Yêu cầu xác nhận bệnh, không truy xuất thông tin.")
-                return {
-                    "result": processed_query,
-                    "disease": "",
-                    "possible_diseases": [],
-                    "context": "",
-                    "source_documents": [],
-                    "symptoms": new_symptoms,
-                    "ask_confirmation": True
-                }
-
-            if reset:
-                logger.info(f"🔍 Reset ngữ cảnh")
-                new_symptoms = ""
-
-            if (disease := is_disease_name(processed_query, known_diseases)):
-                logger.info(f"🔍 Phát hiện tên bệnh: {disease}")
-                disease_detected = disease
+            logger.debug("🔍 Xử lý câu hỏi: %s", query)
+            with graph.step("process_context"), span("process_context"):
+                context_result = process_context(query, previous_symptoms)
+            processed_query, new_symptoms, early_result = resolve_context(context_result)
+            if context_result.get("reset", False):
+                # A new topic: the previous turn's scores must not leak into it
+                diagnostic_state = None
+            if early_result:
+                graph.cancel(*branches)
+                early_result["diagnostic_state"] = diagnostic_state
+                return early_result
+
+            # The prefetched branches are only valid for the query they were started with
+            speculated = processed_query == prefetched["query"]
+            annotate(speculation="hit" if speculated else "miss")
+            if speculated:
+                disease_detected = graph.wait(prefetched["disease_match"])
             else:
-                question_retriever = questions_vs.as_retriever(search_kwargs={"k": 20})
-                question_docs = question_retriever.invoke(processed_query)
-                if not question_docs:
-                    return {
-                        "result": "Tôi không tìm thấy thông tin phù hợp. Vui lòng mô tả rõ hơn hoặc nêu tên bệnh.",
-                        "disease": "",
-                        "possible_diseases": [],
-                        "context": "",
-                        "source_documents": [],
-                        "symptoms": new_symptoms,
-                        "ask_confirmation": False
-                    }
-
-                ranked_docs = []
-                for doc in question_docs:
-                    score = reranker.predict([(processed_query, doc.page_content)])[0]
-                    ranked_docs.append({"content": doc.page_content, "metadata": doc.metadata, "score": score})
-                ranked_docs = sorted(ranked_docs, key=lambda x: x["score"], reverse=True)
-
-                disease_scores = {}
-                for doc in ranked_docs:
-                    disease = doc["metadata"].get("disease", "").strip()
-                    if disease:
-                        disease = normalize_disease_name(disease)
-                        disease_scores[disease] = disease_scores.get(disease, 0) + doc["score"]
-
-                if not disease_scores:
-                    return {
-                        "result": "Tôi chưa xác định được bệnh cụ thể. Vui lòng cung cấp thêm thông tin.",
-                        "disease": "",
-                        "possible_diseases": [],
-                        "context": "",
-                        "source_documents": [],
-                        "symptoms": new_symptoms,
-                        "ask_confirmation": False
-                    }
-
-                sorted_candidates = sorted(disease_scores.items(), key=lambda x: x[1], reverse=True)
-                top1_score = sorted_candidates[0][1]
-                top2_score = sorted_candidates[1][1] if len(sorted_candidates) > 1 else 0
-
-                if top1_score > 1.125 * top2_score and top1_score >= 0.92:
-                    disease_detected = sorted_candidates[0][0]
-                else:
-                    top3 = [name for name, _ in sorted_candidates[:3]]
-                    return {
-                        "result": f"Tôi chưa chắc chắn. Bạn có thể đang mắc một trong các bệnh: {', '.join(top3)}. Vui lòng chọn bệnh hoặc cung cấp thêm thông tin.",
-                        "disease": "",
-                        "possible_diseases": top3,
-                        "context": "",
-                        "source_documents": [],
-                        "symptoms": new_symptoms,
-                        "ask_confirmation": False
-                    }
-
-            filter_condition = Filter(must=[FieldCondition(key="metadata.disease", match=MatchValue(value=disease_detected))])
-            info_docs = information_vs.as_retriever(search_kwargs={"k": 6, "filter": filter_condition}).invoke(disease_detected)
-            if info_docs:
-                context = "\n\n".join([doc.page_content for doc in info_docs])
-                return {
-                    "result": f"Đây là thông tin chi tiết về {disease_detected}:",
-                    "disease": disease_detected,
-                    "possible_diseases": [disease_detected],
-                    "context": context,
-                    "source_documents": [{"content": doc.page_content, "metadata": doc.metadata} for doc in info_docs],
-                    "symptoms": new_symptoms,
-                    "ask_confirmation": False
-                }
+                graph.cancel(*branches)
+                with graph.step("is_disease_name"):
+                    disease_detected = match_disease_name(processed_query)
+
+            next_state = None
+            if disease_detected:
+                graph.cancel(prefetched["question_search"])
             else:
-                return {
-                    "result": f"Tôi chưa tìm thấy thông tin chi tiết về {disease_detected}.",
-                    "disease": disease_detected,
-                    "possible_diseases": [disease_detected],
-                    "context": "",
-                    "source_documents": [],
-                    "symptoms": new_symptoms,
-                    "ask_confirmation": False
-                }
+                delta = None
+                if diagnostic_state and (intent or context_result.get("intent")) == "diagnose_update":
+                    delta = symptom_delta(diagnostic_state["query"], processed_query)
+                if delta is not None:
+                    # Symptoms were added to an ongoing diagnosis: score only what is new
+                    graph.cancel(prefetched["question_search"])
+                    annotate(incremental=True, delta_chars=len(delta))
+                    if delta:
+                        new_scores = []
+                        with graph.step("question_retrieval"):
+                            question_docs = search_questions(delta)
+                        if question_docs:
+                            with graph.step("rerank"):
+                                new_scores = score_questions(delta, question_docs)
+                        # Decay only when the new symptoms brought evidence; otherwise keep the ranking as is
+                        sorted_candidates = merge_scores(diagnostic_state["scores"], new_scores,
+                                                         decay=DIAGNOSIS_SCORE_DECAY if new_scores else 1.0)
+                    else:
+                        # Nothing new to score; keep the previous ranking as is
+                        sorted_candidates = merge_scores(diagnostic_state["scores"], [], decay=1.0)
+                else:
+                    if speculated:
+                        question_docs = graph.wait(prefetched["question_search"])
+                    else:
+                        with graph.step("question_retrieval"):
+                            question_docs = search_questions(processed_query)
+                    if not question_docs:
+                        record_decision("not_found")
+                        return build_result("Tôi không tìm thấy thông tin phù hợp. Vui lòng mô tả rõ hơn hoặc nêu tên bệnh.", new_symptoms)
+
+                    with graph.step("rerank"):
+                        sorted_candidates = score_questions(processed_query, question_docs)
+
+                next_state = {"query": processed_query, "scores": dict(sorted_candidates)}
+                disease_detected, undecided = decide_disease(sorted_candidates, new_symptoms)
+                if undecided:
+                    undecided["diagnostic_state"] = next_state
+                    return undecided
+
+            record_decision("disease_detected")
+            with graph.step("information_retrieval"), stage_timer("information_retrieval"):
+                info_docs = information_vs.as_retriever(
+                    search_kwargs={"k": INFORMATION_K, "filter": disease_filter(disease_detected)}
+                ).invoke(disease_detected)
+            result = information_result(
+                disease_detected,
+                [{"content": doc.page_content, "metadata": doc.metadata} for doc in info_docs],
+                new_symptoms
+            )
+            result["diagnostic_state"] = next_state
+            return result
 
         except Exception as e:
-            logger.error(f"❌ Lỗi trong truy vấn: {e}")
-            return {
-                "result": f"Đã xảy ra lỗi: {str(e)}",
-                "disease": "",
-                "possible_diseases": [],
-                "context": "",
-                "source_documents": [],
-                "symptoms": new_symptoms,
-                "ask_confirmation": False
-            }
+            logger.error("❌ Lỗi trong truy vấn: %s", e, exc_info=True)
+            return build_result(f"Đã xảy ra lỗi: {str(e)}", new_symptoms)
+
+    def search_batch(vectorstore, vectors, k, filters=None):
+        filters = filters or [None] * len(vectors)
+        requests = [
+            SearchRequest(vector=list(vector), limit=k, filter=flt, with_payload=True)
+            for vector, flt in zip(vectors, filters)
+        ]
+        responses = vectorstore.client.search_batch(collection_name=vectorstore.collection_name, requests=requests)
+        return [
+            [{"content": point.payload.get("text", ""), "metadata": point.payload.get("metadata", {})} for point in points]
+            for points in responses
+        ]
+
+    def run_batch(queries, previous_symptoms_list=None):
+        """
+        Batched version of run: one intent pass, one embedding call, one Qdrant search_batch
+        per collection and one rerank call for the whole batch. Returns one result per query,
+        or the exception that item failed with.
+        """
+        previous_symptoms_list = previous_symptoms_list or [""] * len(queries)
+        results = [None] * len(queries)
+        symptoms = list(previous_symptoms_list)
+        processed = {}
+        detected = {}
+
+        try:
+            with span("process_context", batch=len(queries)):
+                context_results = process_contexts(queries, previous_symptoms_list)
+        except Exception as e:
+            return [e] * len(queries)
+
+        for i, context_result in enumerate(context_results):
+            try:
+                processed_query, symptoms[i], early_result = resolve_context(context_result)
+                if early_result:
+                    results[i] = early_result
+                    continue
+                disease = match_disease_name(processed_query)
+                if disease:
+                    detected[i] = disease
+                else:
+                    processed[i] = processed_query
+            except Exception as e:
+                results[i] = e
+
+        if processed:
+            indices = list(processed)
+            try:
+                with stage_timer("question_retrieval", batch=len(indices)):
+                    vectors = questions_vs.embeddings.embed_documents([processed[i] for i in indices])
+                    hits = search_batch(questions_vs, vectors, QUESTION_K)
+                pairs = [(processed[i], doc["content"]) for i, docs in zip(indices, hits) for doc in docs]
+                scores = list(rerank(pairs))
+            except Exception as e:
+                for i in indices:
+                    results[i] = e
+                indices, hits = [], []
+
+            offset = 0
+            for i, docs in zip(indices, hits):
+                item_scores = scores[offset:offset + len(docs)]
+                offset += len(docs)
+                if not docs:
+                    record_decision("not_found")
+                    results[i] = build_result("Tôi không tìm thấy thông tin phù hợp. Vui lòng mô tả rõ hơn hoặc nêu tên bệnh.", symptoms[i])
+                    continue
+                ranked_docs = sorted(
+                    [dict(doc, score=score) for doc, score in zip(docs, item_scores)],
+                    key=lambda x: x["score"], reverse=True
+                )
+                disease, undecided = decide_disease(score_diseases(ranked_docs), symptoms[i])
+                if undecided:
+                    results[i] = undecided
+                else:
+                    detected[i] = disease
+
+        if detected:
+            indices = list(detected)
+            for i in indices:
+                record_decision("disease_detected")
+            try:
+                with stage_timer("information_retrieval", batch=len(indices)):
+                    vectors = information_vs.embeddings.embed_documents([detected[i] for i in indices])
+                    hits = search_batch(information_vs, vectors, INFORMATION_K, [disease_filter(detected[i]) for i in indices])
+                for i, info_docs in zip(indices, hits):
+                    results[i] = information_result(detected[i], info_docs, symptoms[i])
+            except Exception as e:
+                for i in indices:
+                    results[i] = e
+
+        return results
 
+    run.batch = run_batch
+    run.prefetch = prefetch
     return run
\ No newline at end of file
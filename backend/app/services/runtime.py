@@ -0,0 +1,168 @@
+import os
+import math
+import time
+import threading
+import logging
+from .tools import get_intent_model, detect_intent
+from .rag_chain import get_reranker, get_qa_chain
+from .llm_chain import get_llm_chain as build_llm_chain
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+WARMUP_QUERY = "Tôi bị đau đầu và sốt, tôi có thể bị bệnh gì"
+# Delay before a failed initialization may be retried; doubles on each failure up to the max
+INIT_RETRY_SECONDS = float(os.getenv("INIT_RETRY_SECONDS", "5"))
+INIT_RETRY_MAX_SECONDS = float(os.getenv("INIT_RETRY_MAX_SECONDS", "300"))
+# Failed attempts after which initialization gives up (0 retries forever)
+INIT_MAX_RETRIES = int(os.getenv("INIT_MAX_RETRIES", "10"))
+
+# Load order; each step needs the ones before it
+CORE_COMPONENTS = ("intent_model", "reranker", "qa_chain", "llm_chain")
+
+# Readiness of each component, reported by /ready
+components = {
+    name: {"status": "pending", "error": None, "load_seconds": None}
+    for name in CORE_COMPONENTS + ("warmup",)
+}
+
+_chains = {"qa_chain": None, "llm_chain": None}
+_init_lock = threading.Lock()
+# Separate from _init_lock, which is held for the whole load: start() runs on every request
+_start_lock = threading.Lock()
+_init_thread = None
+_failures = 0
+_retry_at = 0.0
+
+
+def _load(name, loader):
+    components[name]["status"] = "loading"
+    start = time.perf_counter()
+    try:
+        result = loader()
+    except Exception as e:
+        components[name].update(status="failed", error=str(e))
+        logger.error(f"❌ Không thể khởi tạo {name}: {e}")
+        raise
+    components[name].update(status="ready", error=None, load_seconds=round(time.perf_counter() - start, 3))
+    logger.info(f"✅ {name} sẵn sàng sau {components[name]['load_seconds']}s")
+    return result
+
+
+def warm_up():
+    """
+    Run one dummy inference through every model so the first real request
+    does not pay for lazy allocations.
+    """
+    detect_intent(WARMUP_QUERY)
+    get_reranker().predict([(WARMUP_QUERY, WARMUP_QUERY)])
+    _chains["qa_chain"](WARMUP_QUERY)
+
+
+def _fail_dependents(failed):
+    """
+    Components after `failed` will not load in this attempt; report them as failed rather than pending.
+    """
+    for name in CORE_COMPONENTS[CORE_COMPONENTS.index(failed) + 1:] + ("warmup",):
+        components[name].update(status="failed", error=f"{failed} failed")
+
+
+def initialize():
+    """
+    Load models, connect to Qdrant and build the chains. Safe to call more than once;
+    components that already loaded are not loaded again. Returns False if a component failed.
+    """
+    global _failures, _retry_at
+    loaders = {
+        "intent_model": get_intent_model,
+        "reranker": get_reranker,
+        "qa_chain": get_qa_chain,
+        "llm_chain": lambda: build_llm_chain(_chains["qa_chain"])
+    }
+    with _init_lock:
+        if _chains["llm_chain"] is not None:
+            return True
+        for name in CORE_COMPONENTS + ("warmup",):
+            if components[name]["status"] == "failed":
+                components[name].update(status="pending", error=None)
+        for name in CORE_COMPONENTS:
+            if components[name]["status"] == "ready":
+                continue
+            try:
+                result = _load(name, loaders[name])
+            except Exception:
+                _fail_dependents(name)
+                _failures += 1
+                delay = min(INIT_RETRY_SECONDS * 2 ** (_failures - 1), INIT_RETRY_MAX_SECONDS)
+                _retry_at = time.monotonic() + delay
+                logger.warning(f"⚠️ Khởi tạo thất bại ({_failures} lần), thử lại sau {delay:.0f}s")
+                return False
+            if name in _chains:
+                _chains[name] = result
+        _failures = 0
+
+    if WARMUP_ON_STARTUP:
+        try:
+            _load("warmup", warm_up)
+        except Exception:
+            pass
+    else:
+        components["warmup"]["status"] = "skipped"
+    return True
+
+
+def _initialize_with_retries():
+    # Retries run on the init thread itself, so recovery does not depend on incoming requests
+    while not initialize():
+        if INIT_MAX_RETRIES and _failures > INIT_MAX_RETRIES:
+            logger.error(f"❌ Bỏ cuộc khởi tạo sau {_failures} lần thất bại")
+            return
+        time.sleep(max(0.0, _retry_at - time.monotonic()))
+
+
+def start():
+    """
+    Start initialization in a background thread (idempotent). The thread retries failed
+    attempts with backoff until everything loads or INIT_MAX_RETRIES is reached.
+    """
+    global _init_thread
+    with _start_lock:
+        if _init_thread is None:
+            _init_thread = threading.Thread(target=_initialize_with_retries, name="runtime-init", daemon=True)
+            _init_thread.start()
+
+
+def retry_pending():
+    """
+    Whether initialization is still loading or waiting out its backoff, as opposed to given up.
+    """
+    return _init_thread is not None and _init_thread.is_alive()
+
+
+def retry_after():
+    """
+    Seconds a client should wait before trying again while initialization is pending.
+    """
+    return max(1, math.ceil(_retry_at - time.monotonic())) if _failures else 5
+
+
+def is_ready():
+    # A failed warm-up only costs latency on the first requests, so it does not block readiness
+    core = all(components[name]["status"] == "ready" for name in CORE_COMPONENTS)
+    return core and components["warmup"]["status"] not in ("pending", "loading")
+
+
+def get_qa_chain_instance():
+    """
+    Return the retrieval chain, or None while it is still loading.
+    """
+    start()
+    return _chains["qa_chain"]
+
+
+def get_llm_chain_instance():
+    """
+    Return the LLM chain, or None while it is still loading.
+    """
+    start()
+    return _chains["llm_chain"]
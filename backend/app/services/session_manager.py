@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 import uuid
 from ..models.chat import ChatMessage, SessionState
@@ -34,6 +34,7 @@ class SessionManager:
     def update_session(self, session_id: str, message: ChatMessage, symptoms: str = ""):
         session = self.get_session(session_id)
         session.messages.append(message)
+        session.version += 1
         if symptoms:
             session.symptoms = symptoms
         session.updated_at = datetime.now()
@@ -43,10 +44,40 @@ class SessionManager:
         session = self.get_session(session_id)
         return session.messages
     
+    def get_session_messages_page(self, session_id: str, after: int = 0, limit: Optional[int] = None):
+        """
+        Messages after the cursor (the number of messages already seen), plus the session version.
+        """
+        session = self.get_session(session_id)
+        end = len(session.messages) if limit is None else min(len(session.messages), after + limit)
+        return session.messages[after:end], end, len(session.messages), session.version
+
+    def get_turn_count(self, session_id: str) -> int:
+        """
+        Number of user messages so far, i.e. the index of the session's next turn.
+        """
+        session = self.get_session(session_id)
+        return sum(1 for m in session.messages if m.role == "user")
+
     def get_session_symptoms(self, session_id: str) -> str:
         session = self.get_session(session_id)
         return session.symptoms
 
+    def get_diagnostic_state(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session = self.get_session(session_id)
+        return session.diagnostic_state
+
+    def update_session_state(self, session_id: str, symptoms: str, state: Optional[Dict[str, Any]]):
+        session = self.get_session(session_id)
+        if symptoms:
+            session.symptoms = symptoms
+        session.diagnostic_state = state
+        session.updated_at = datetime.now()
+
+    def set_diagnostic_state(self, session_id: str, state: Optional[Dict[str, Any]]):
+        session = self.get_session(session_id)
+        session.diagnostic_state = state
+
 
 # Global session manager instance
 session_manager = SessionManager()
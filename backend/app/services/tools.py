@@ -1,10 +1,27 @@
+import os
 from sentence_transformers import CrossEncoder
+import threading
 import logging
+from .metrics import stage_timer
+from .tracing import annotate
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-intent_model = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+CROSS_ENCODER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+# Cross-encoders are loaded on first use and shared by name (intent scoring and reranking use the same model)
+_cross_encoders = {}
+_cross_encoder_lock = threading.Lock()
+
+def get_cross_encoder(model_name=CROSS_ENCODER_MODEL):
+    with _cross_encoder_lock:
+        if model_name not in _cross_encoders:
+            logger.info("⏳ Đang tải CrossEncoder %s", model_name)
+            _cross_encoders[model_name] = CrossEncoder(model_name)
+        return _cross_encoders[model_name]
+
+def get_intent_model():
+    return get_cross_encoder()
 
 REFERENCE_LAST_PATTERNS = [
     "Bệnh này",
@@ -59,6 +76,9 @@ INTENT_PATTERNS = {
     ]
 }
 
+# Below this cross-encoder score no intent is assumed and the query is taken as is
+INTENT_THRESHOLD = float(os.getenv("INTENT_THRESHOLD", "0.5"))
+
 COMMON_SYMPTOMS = ["đau đầu", "sốt", "ho", "khó thở", "mệt", "chóng mặt", "buồn nôn", "ra máu", "đau ngực", "sưng phù"]
 
 def check_symptom_overlap(query_symptoms, previous_symptoms):
@@ -83,34 +103,33 @@ def check_reference_last(query):
             pattern = pattern.format(context="nêu")
         pattern = pattern.replace("{disease}", "").strip()
         if pattern.lower() in query_lower:
-            logger.info(f"🔍 Phát hiện từ khóa reference_last: {pattern}")
+            logger.info("🔍 Phát hiện từ khóa reference_last: %s", pattern)
             return True
     return False
 
-def detect_intent(query, previous_symptoms=""):
-    logger.info(f"🔍 Đang phân tích ý định cho câu hỏi: {query}")
-    query_symptoms = extract_symptoms(query)
-
-    if check_reference_last(query):
-        logger.info("🔍 Phát hiện ý định reference_last")
-        return {"intent": "reference_last", "context": {"ask_confirmation": True}, "reset": False}
-
-    intent_scores = {}
+def intent_pairs(query, query_symptoms):
+    """
+    (query, pattern) pairs for every intent pattern, plus the intent each pair belongs to.
+    """
+    pairs = []
+    owners = []
     for intent, patterns in INTENT_PATTERNS.items():
-        scores = []
         for pattern in patterns:
             if "{symptom}" in pattern:
                 pattern = pattern.format(symptom=query_symptoms if query_symptoms else "triệu chứng")
-            score = intent_model.predict([(query, pattern)])[0]
-            scores.append(score)
-        intent_scores[intent] = max(scores) if scores else 0.0
+            pairs.append((query, pattern))
+            owners.append(intent)
+    return pairs, owners
 
+def decide_intent(intent_scores, query_symptoms, previous_symptoms="", threshold=INTENT_THRESHOLD):
     best_intent = max(intent_scores.items(), key=lambda x: x[1])[0] if intent_scores else None
     best_score = intent_scores.get(best_intent, 0.0)
 
-    logger.info(f"🔍 Ý định phát hiện: {best_intent} với điểm {best_score}")
+    logger.info("🔍 Ý định phát hiện: %s với điểm %s", best_intent, best_score,
+                extra={"intent": best_intent, "score": float(best_score)})
+    annotate(intent=best_intent, score=float(best_score))
 
-    if best_score < 0.5:
+    if best_score < threshold:
         return {"intent": None, "context": {"reset": True}}
 
     context = {}
@@ -132,21 +151,67 @@ def detect_intent(query, previous_symptoms=""):
 
     return {"intent": best_intent, "context": context, "reset": reset}
 
-def process_context(query, previous_symptoms=""):
-    result = detect_intent(query, previous_symptoms)
+@stage_timer("detect_intent")
+def detect_intents(queries, previous_symptoms_list=None):
+    """
+    Detect the intent of several queries with a single cross-encoder call.
+    """
+    previous_symptoms_list = previous_symptoms_list or [""] * len(queries)
+    results = [None] * len(queries)
+    pairs = []
+    pending = []
+
+    for i, query in enumerate(queries):
+        logger.debug("🔍 Đang phân tích ý định cho câu hỏi: %s", query)
+        query_symptoms = extract_symptoms(query)
+        if check_reference_last(query):
+            logger.info("🔍 Phát hiện ý định reference_last")
+            results[i] = {"intent": "reference_last", "context": {"ask_confirmation": True}, "reset": False}
+            continue
+        query_pairs, owners = intent_pairs(query, query_symptoms)
+        pending.append((i, query_symptoms, len(pairs), owners))
+        pairs.extend(query_pairs)
+
+    scores = get_intent_model().predict(pairs, show_progress_bar=False) if pairs else []
+
+    for i, query_symptoms, offset, owners in pending:
+        intent_scores = {}
+        for intent, score in zip(owners, scores[offset:offset + len(owners)]):
+            intent_scores[intent] = max(intent_scores.get(intent, score), score)
+        results[i] = decide_intent(intent_scores, query_symptoms, previous_symptoms_list[i] or "")
+
+    return results
+
+def detect_intent(query, previous_symptoms=""):
+    return detect_intents([query], [previous_symptoms])[0]
+
+def context_from_intent(query, previous_symptoms, result):
     intent = result["intent"]
     context = result["context"]
     reset = result.get("reset", False)
 
     if intent == "reference_last":
         if context.get("ask_confirmation"):
-            return {"query": "Bạn đang đề cập đến bệnh nào? Vui lòng cung cấp tên bệnh để tôi hỗ trợ tốt hơn.", "symptoms": previous_symptoms, "reset": False, "ask_confirmation": True}
+            resolved = {"query": "Bạn đang đề cập đến bệnh nào? Vui lòng cung cấp tên bệnh để tôi hỗ trợ tốt hơn.", "symptoms": previous_symptoms, "reset": False, "ask_confirmation": True}
         else:
-            return {"query": query, "symptoms": previous_symptoms, "reset": False, "ask_confirmation": False}
+            resolved = {"query": query, "symptoms": previous_symptoms, "reset": False, "ask_confirmation": False}
     elif intent == "info_new_disease" or (intent == "diagnose_new" and context.get("reset")):
-        return {"query": query, "symptoms": "", "reset": True, "ask_confirmation": False}
+        resolved = {"query": query, "symptoms": "", "reset": True, "ask_confirmation": False}
     elif intent == "diagnose_update" and context.get("symptoms"):
         combined_query = context["symptoms"]
-        return {"query": combined_query, "symptoms": context["symptoms"], "reset": False, "ask_confirmation": False}
+        resolved = {"query": combined_query, "symptoms": context["symptoms"], "reset": False, "ask_confirmation": False}
     else:
-        return {"query": query, "symptoms": previous_symptoms, "reset": reset, "ask_confirmation": False}
\ No newline at end of file
+        resolved = {"query": query, "symptoms": previous_symptoms, "reset": reset, "ask_confirmation": False}
+    resolved["intent"] = intent
+    return resolved
+
+def process_contexts(queries, previous_symptoms_list=None):
+    previous_symptoms_list = previous_symptoms_list or [""] * len(queries)
+    results = detect_intents(queries, previous_symptoms_list)
+    return [
+        context_from_intent(query, previous_symptoms, result)
+        for query, previous_symptoms, result in zip(queries, previous_symptoms_list, results)
+    ]
+
+def process_context(query, previous_symptoms=""):
+    return process_contexts([query], [previous_symptoms])[0]
\ No newline at end of file
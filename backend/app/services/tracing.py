@@ -0,0 +1,152 @@
+import os
+import time
+import uuid
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+# Fraction of ordinary (non-debug) turns recorded into the ring buffer
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+
+_buffer = deque(maxlen=TRACE_BUFFER_SIZE)
+_buffer_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "parent", "start", "duration", "attributes")
+
+    def __init__(self, name, parent, start, attributes):
+        self.name = name
+        self.parent = parent
+        self.start = start
+        self.duration = None
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Trace:
+    def __init__(self, name, attributes=None):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes or {}
+        self.spans = []
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": _ms(self.duration),
+            "attributes": self.attributes,
+            "spans": [
+                {
+                    "name": s.name,
+                    "parent": s.parent,
+                    "start_ms": _ms(s.start - self.start),
+                    "duration_ms": _ms(s.duration),
+                    "attributes": s.attributes
+                }
+                for s in self.spans
+            ]
+        }
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Record a timed span in the active trace. Costs a context-var lookup when no trace is active.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.name if parent else None, time.perf_counter(), attributes)
+    trace.spans.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _current_span.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def annotate(**attributes):
+    """
+    Attach attributes to the innermost active span (or the trace itself).
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+    elif (trace := _current_trace.get()) is not None:
+        trace.attributes.update(attributes)
+
+
+@contextmanager
+def start_trace(name, force=False, record=False, **attributes):
+    """
+    Trace the enclosed work if forced (debug requests) or sampled. Yields the Trace or None.
+    With record=True the work is traced for the caller's own use (turn capture), but only
+    kept in the /debug/traces buffer if it was forced or sampled as well.
+    """
+    keep = force or (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE)
+    if not keep and not record:
+        yield None
+        return
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        trace.duration = time.perf_counter() - trace.start
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        if keep:
+            with _buffer_lock:
+                _buffer.append(trace)
+
+
+def get_traces(offset=0, limit=20):
+    """
+    Page through recorded traces, newest first.
+    """
+    with _buffer_lock:
+        traces = list(_buffer)
+    traces.reverse()
+    return {
+        "total": len(traces),
+        "offset": offset,
+        "limit": limit,
+        "traces": [t.to_dict() for t in traces[offset:offset + limit]]
+    }
@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from .metrics import CRITICAL_PATH_SECONDS, TURN_BRANCHES
+from .tracing import annotate
+from . import cancellation
+from .profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+TURN_GRAPH_WORKERS = int(os.getenv("TURN_GRAPH_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=TURN_GRAPH_WORKERS, thread_name_prefix="turn-graph")
+
+
+class Node:
+    __slots__ = ("name", "deps", "start", "end", "future", "cancelled")
+
+    def __init__(self, name, deps):
+        self.name = name
+        self.deps = deps
+        self.start = None
+        self.end = None
+        self.future = None
+        self.cancelled = threading.Event()
+
+
+class TurnGraph:
+    """
+    Dependency graph for one turn. Branches started with spawn() run on a shared pool while
+    the calling thread works through step()s; wait() joins a branch into the next step.
+    Every node records its dependencies, so the critical path can be rebuilt when the turn ends.
+    """
+
+    def __init__(self, name="turn"):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.nodes = []
+        self._cursor = None
+        self._joined = []
+        self._used = set()
+
+    def _after(self):
+        return [self._cursor] if self._cursor else []
+
+    def spawn(self, name, fn, *args, cancellable=False):
+        """
+        Run fn(*args) concurrently. With cancellable=True it also receives `cancelled`,
+        an Event it should check between expensive calls.
+        """
+        node = Node(name, self._after())
+        ctx = contextvars.copy_context()
+        kwargs = {"cancelled": node.cancelled} if cancellable else {}
+
+        def task():
+            # The cancel token lives in the caller's context, so the check runs inside it too
+            cancellation.check(name)
+            node.start = time.perf_counter()
+            try:
+                with profiler.worker():
+                    return fn(*args, **kwargs)
+            finally:
+                node.end = time.perf_counter()
+
+        node.future = _executor.submit(ctx.run, task)
+        self.nodes.append(node)
+        return node
+
+    def wait(self, node):
+        result = node.future.result()
+        TURN_BRANCHES.labels(branch=node.name, outcome="used").inc()
+        self._used.add(node)
+        self._joined.append(node)
+        return result
+
+    def cancel(self, *nodes):
+        for node in nodes:
+            if node.future is None or node in self._used or node.cancelled.is_set():
+                continue
+            if node.future.done():
+                TURN_BRANCHES.labels(branch=node.name, outcome="discarded").inc()
+                continue
+            node.cancelled.set()
+            # Only stops a branch that has not started; a running one sees the event
+            node.future.cancel()
+            TURN_BRANCHES.labels(branch=node.name, outcome="cancelled").inc()
+
+    @contextmanager
+    def step(self, name):
+        cancellation.check(name)
+        node = Node(name, self._after() + self._joined)
+        self._joined = []
+        node.start = time.perf_counter()
+        self.nodes.append(node)
+        try:
+            yield node
+        finally:
+            node.end = time.perf_counter()
+            self._cursor = node
+
+    def critical_path(self):
+        """
+        Walk back from the last step, always through the dependency that finished last.
+        Returns [(stage, seconds contributed)] in execution order.
+        """
+        def finished(node):
+            return node.end is not None and not node.cancelled.is_set()
+
+        node = self._cursor
+        path = []
+        while node is not None:
+            deps = [dep for dep in node.deps if finished(dep)]
+            previous = max(deps, key=lambda n: n.end) if deps else None
+            ready_at = previous.end if previous else self.t0
+            path.append((node.name, node.end - max(node.start, ready_at)))
+            node = previous
+        path.reverse()
+        return path
+
+    def finish(self):
+        """
+        Cancel branches nobody waited for and report the critical path.
+        """
+        self.cancel(*self.nodes)
+        path = self.critical_path()
+        for stage, seconds in path:
+            CRITICAL_PATH_SECONDS.labels(stage=stage).observe(seconds)
+        total = time.perf_counter() - self.t0
+        annotate(
+            critical_path=[{"stage": stage, "ms": round(seconds * 1000, 3)} for stage, seconds in path],
+            critical_path_ms=round(total * 1000, 3)
+        )
+        logger.debug("⏱️ Critical path %s: %s", self.name, " -> ".join(stage for stage, _ in path))
+        return path
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Send a file of messages to the /api/v1/batch endpoint and write the NDJSON results.
+
+Input: .jsonl (one {"id", "message", "previous_symptoms"} object per line),
+.csv (columns message[, id, previous_symptoms]) or plain text (one message per line).
+
+    python batch_cli.py questions.csv -o results.ndjson --mode diagnose
+"""
+import argparse
+import csv
+import json
+import sys
+import httpx
+
+
+def read_items(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            items = [json.loads(line) for line in f if line.strip()]
+        elif path.endswith(".csv"):
+            items = [dict(row) for row in csv.DictReader(f)]
+        else:
+            items = [{"message": line.strip()} for line in f if line.strip()]
+    for index, item in enumerate(items):
+        yield {
+            "id": str(item.get("id") or index),
+            "message": item["message"],
+            "previous_symptoms": item.get("previous_symptoms") or ""
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk chat / diagnosis through the batch API")
+    parser.add_argument("input", help="Input file (.jsonl, .csv or plain text)")
+    parser.add_argument("-o", "--output", help="Output NDJSON file (default: stdout)")
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--mode", choices=["chat", "diagnose"], default="chat")
+    parser.add_argument("--batch-size", type=int, default=200, help="Items per request (server limit: BATCH_MAX_ITEMS)")
+    parser.add_argument("--include-content", action="store_true", help="Include source document text")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    args = parser.parse_args()
+
+    items = list(read_items(args.input))
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    failed = 0
+    try:
+        with httpx.Client(base_url=args.url, timeout=args.timeout) as client:
+            for start in range(0, len(items), args.batch_size):
+                payload = {
+                    "items": items[start:start + args.batch_size],
+                    "mode": args.mode,
+                    "include_content": args.include_content
+                }
+                with client.stream("POST", "/api/v1/batch", json=payload) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        record = json.loads(line)
+                        # Indices are per request; make them global across the file
+                        record["index"] += start
+                        failed += not record["ok"]
+                        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        out.flush()
+                print(f"✅ {min(start + args.batch_size, len(items))}/{len(items)}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"✅ Xong: {len(items)} mục, {failed} lỗi", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
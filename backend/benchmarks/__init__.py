@@ -0,0 +1,3 @@
+"""
+Micro-benchmarks for the pipeline hot functions, compared against committed baselines.
+"""
@@ -0,0 +1,138 @@
+"""
+Run the micro-benchmarks and compare them with the committed baseline.
+
+    python -m benchmarks.run                      # fail (exit 1) on regressions beyond --threshold
+    python -m benchmarks.run -k is_disease_name   # only matching benchmarks
+    python -m benchmarks.run --update             # record the current numbers as the baseline
+
+Models are replaced with deterministic stubs (benchmarks/stubs.py). Timings depend on the machine:
+regenerate the baseline with --update before using it as a reference on different hardware.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_THRESHOLD = 0.3
+
+
+def machine_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine()
+    }
+
+
+def _time(fn, loops):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def measure(fn, ops, repeats, min_time):
+    """
+    timeit-style: grow the loop count until one repeat takes at least `min_time`, then take
+    `repeats` samples. Returns microseconds per operation (min and median over repeats).
+    """
+    loops = 1
+    while True:
+        elapsed = _time(fn, loops)
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed * 1.2))
+    samples = [elapsed] + [_time(fn, loops) for _ in range(repeats - 1)]
+    per_op = [sample / loops / ops * 1e6 for sample in samples]
+    return {"min_us": round(min(per_op), 3), "median_us": round(statistics.median(per_op), 3), "loops": loops, "ops": ops}
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {"machine": None, "results": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(result, reference, threshold):
+    if reference is None:
+        return "new", None
+    change = result["min_us"] / reference["min_us"] - 1
+    if change > threshold:
+        return "REGRESSION", change
+    if change < -threshold:
+        return "faster", change
+    return "ok", change
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ViMedical micro-benchmarks")
+    parser.add_argument("-k", "--filter", help="Only run benchmarks whose name contains this string")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per repeat")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown of the min time against the baseline (0.3 = 30%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update", action="store_true", help="Write the results as the new baseline")
+    args = parser.parse_args()
+
+    # Keep per-call logging out of the numbers; must be set before the app configures logging on import
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from . import stubs
+    from .suite import BENCHMARKS, SkipBenchmark
+    stubs.install()
+
+    baseline = load_baseline(args.baseline)
+    if baseline["machine"] and baseline["machine"] != machine_info() and not args.update:
+        print(f"⚠️ Baseline được ghi trên máy khác: {baseline['machine']}")
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<28}{'µs/op':>12}{'median':>12}{'baseline':>12}{'change':>10}  status")
+    for name, setup, param in BENCHMARKS:
+        if args.filter and args.filter not in name:
+            continue
+        try:
+            fn, ops = setup() if param is None else setup(param)
+        except SkipBenchmark as e:
+            print(f"{name:<28}{'-':>12}{'-':>12}{'-':>12}{'-':>10}  skipped ({e})")
+            continue
+        result = measure(fn, ops, args.repeats, args.min_time)
+        results[name] = result
+        reference = baseline["results"].get(name)
+        status, change = compare(result, reference, args.threshold)
+        if status == "REGRESSION":
+            regressions.append(name)
+        print(
+            f"{name:<28}{result['min_us']:>12.2f}{result['median_us']:>12.2f}"
+            f"{reference['min_us'] if reference else '-':>12}"
+            f"{'-' if change is None else f'{change:+.1%}':>10}  {status}"
+        )
+
+    if args.update:
+        merged = {**baseline["results"], **results} if args.filter else results
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine_info(), "results": merged}, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n💾 Đã ghi baseline: {args.baseline}")
+        return
+
+    if regressions:
+        print(f"\n❌ Chậm hơn baseline quá {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n✅ Không có regression")
+
+
+if __name__ == "__main__":
+    main()
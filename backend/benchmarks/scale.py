@@ -0,0 +1,324 @@
+"""
+Scaling benchmark: synthesize corpora at multiples of today's size (benchmarks/synthetic.py), ingest them with
+create_index into an embedded Qdrant, and measure how ingest time, index memory, disease-catalog loading,
+query latency and session memory grow.
+
+    python -m benchmarks.scale                                   # 1x, 3x, 10x
+    python -m benchmarks.scale --scales 1,10,100 -o scale.csv --plot scale.png
+
+Embeddings are the deterministic stub (benchmarks/stubs.py), so ingest time is our pipeline plus Qdrant,
+not model inference. Each scale runs in a fresh process so memory numbers do not carry over.
+The embedded Qdrant searches by brute force and ignores payload indexes, so retrieval latency is an upper
+bound on what Qdrant server would show, and uploads run on a single worker; the catalog, is_disease_name
+and session numbers carry over as they are.
+"""
+import os
+import gc
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+COLUMNS = (
+    "scale", "diseases", "pages", "chunks", "questions",
+    "extract_s", "dedup_s", "upsert_information_s", "upsert_questions_s", "ingest_s",
+    "rss_mb", "disk_mb", "vectors_mb",
+    "catalog_load_s", "catalog_size", "catalog_coverage",
+    "is_disease_name_ms", "is_disease_name_full_ms", "question_search_ms", "information_ms",
+    "sessions", "session_kb", "update_session_us"
+)
+LABELS = (
+    "scale", "disease", "pages", "chunks", "quest", "extract", "dedup", "up_info", "up_q", "ingest",
+    "rss_mb", "disk_mb", "vec_mb", "cat_s", "catalog", "cover", "name_ms", "full_ms", "q_ms", "info_ms",
+    "sessions", "sess_kb", "upd_us"
+)
+
+# Active sessions at 1x; scaled with the corpus
+BASE_SESSIONS = 500
+TURNS_PER_SESSION = 3
+
+
+def rss_mb():
+    """
+    Current resident set size; peak RSS where /proc is not available.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def dir_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / (1024 * 1024)
+
+
+def per_call_ms(fn, inputs):
+    start = time.perf_counter()
+    for value in inputs:
+        fn(value)
+    return (time.perf_counter() - start) / len(inputs) * 1000 if inputs else None
+
+
+def ingest(create_index, client, items, questions, dedup_threshold):
+    """
+    Run create_index's own extraction, dedup and rebuild path against `client`, with stub embeddings.
+    """
+    from .stubs import StubEmbeddings
+
+    create_index.qdrant_client = client
+    create_index.model = StubEmbeddings()
+    row = {}
+
+    start = time.perf_counter()
+    chunks = create_index.extract_chunks(items)
+    question_items = create_index.extract_questions(questions)
+    row["extract_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if dedup_threshold > 0:
+        chunks, _ = create_index.dedupe_chunks(chunks, threshold=dedup_threshold)
+    row["dedup_s"] = time.perf_counter() - start
+
+    manifest = {}
+    for alias, column, points in (
+        (create_index.COLLECTION_INFORMATION, "upsert_information_s", chunks),
+        (create_index.COLLECTION_QUESTIONS, "upsert_questions_s", question_items)
+    ):
+        start = time.perf_counter()
+        create_index.rebuild_collection(alias, points, manifest)
+        row[column] = time.perf_counter() - start
+
+    row["ingest_s"] = row["extract_s"] + row["dedup_s"] + row["upsert_information_s"] + row["upsert_questions_s"]
+    row["chunks"] = len(chunks)
+    row["questions"] = len(question_items)
+    return row
+
+
+def session_memory(sessions, diseases, seed):
+    """
+    Traced memory of `sessions` sessions holding TURNS_PER_SESSION turns and a diagnostic state,
+    and the cost of one update_session with that many sessions alive.
+    """
+    from app.models.chat import ChatMessage
+    from app.services.session_manager import SessionManager
+    from app.services.rag_chain import QUESTION_K
+
+    rng = random.Random(seed)
+    tracemalloc.start()
+    try:
+        manager = SessionManager()
+        session_ids = []
+        for _ in range(sessions):
+            session_id = manager.create_session()
+            symptoms = ""
+            for turn in range(TURNS_PER_SESSION):
+                symptoms = f"{symptoms} đau đầu sốt ho {turn}".strip()
+                now = datetime.now().strftime("%H:%M:%S")
+                manager.update_session(session_id, ChatMessage(role="user", content=f"Tôi bị {symptoms}, tôi bị bệnh gì?", timestamp=now))
+                manager.update_session(session_id, ChatMessage(role="assistant", content="Bạn có thể bị một trong các bệnh sau. " * 8, timestamp=now), symptoms)
+            manager.set_diagnostic_state(session_id, {
+                "query": symptoms,
+                "scores": {disease: rng.random() for disease in rng.sample(diseases, min(QUESTION_K, len(diseases)))}
+            })
+            session_ids.append(session_id)
+        traced, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    message = ChatMessage(role="user", content="Tôi còn bị buồn nôn", timestamp="00:00:00")
+    targets = rng.choices(session_ids, k=1000)
+    start = time.perf_counter()
+    for session_id in targets:
+        manager.update_session(session_id, message, "đau đầu sốt buồn nôn")
+    return {
+        "sessions": sessions,
+        "session_kb": traced / sessions / 1024,
+        "update_session_us": (time.perf_counter() - start) / len(targets) * 1e6
+    }
+
+
+def measure(scale, args):
+    """
+    One row of the report; meant to run in its own process.
+    """
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from qdrant_client import QdrantClient
+    from langchain_community.vectorstores import Qdrant
+    from app.services.rag_chain import (
+        COLLECTION_QUESTIONS, COLLECTION_INFORMATION, QUESTION_K, INFORMATION_K,
+        is_disease_name, load_known_diseases, disease_filter
+    )
+    from .stubs import StubEmbeddings
+    from .suite import import_create_index
+    from .synthetic import BASE_DISEASES, generate_corpus
+
+    # The embedded Qdrant takes one writer at a time; must be set before create_index reads it
+    os.environ["INGEST_UPLOAD_WORKERS"] = "1"
+    create_index = import_create_index()
+    rng = random.Random(args.seed)
+    diseases = max(1, round(BASE_DISEASES * scale))
+    items, questions = generate_corpus(diseases, seed=args.seed)
+    row = {"scale": scale, "diseases": diseases, "pages": len(items)}
+
+    workdir = tempfile.mkdtemp(prefix="vimedical-scale-")
+    try:
+        gc.collect()
+        rss_before = rss_mb()
+        client = QdrantClient(path=os.path.join(workdir, "qdrant"))
+        row.update(ingest(create_index, client, items, questions, args.dedup_threshold))
+        gc.collect()
+        row["rss_mb"] = rss_mb() - rss_before
+        row["disk_mb"] = dir_mb(workdir)
+        # What any Qdrant deployment keeps in RAM at minimum: the float32 vectors themselves
+        row["vectors_mb"] = (row["chunks"] + row["questions"]) * 384 * 4 / (1024 * 1024)
+
+        embeddings = StubEmbeddings()
+        questions_vs, information_vs = (
+            Qdrant(client=client, collection_name=name, embeddings=embeddings,
+                   content_payload_key="text", metadata_payload_key="metadata")
+            for name in (COLLECTION_QUESTIONS, COLLECTION_INFORMATION)
+        )
+
+        # The API's catalog: one similarity search capped at CATALOG_SCAN_LIMIT chunks
+        start = time.perf_counter()
+        catalog = load_known_diseases(information_vs)
+        row["catalog_load_s"] = time.perf_counter() - start
+        row["catalog_size"] = len(catalog)
+        row["catalog_coverage"] = len(catalog) / diseases
+
+        names = list(questions)
+        query_pool = [q for qs in questions.values() for q in qs]
+        queries = rng.sample(query_pool, min(args.queries, len(query_pool)))
+        name_queries = queries[:args.name_queries]
+        full_catalog = {" ".join(w.capitalize() for w in name.split()) for name in names}
+        row["is_disease_name_ms"] = per_call_ms(lambda q: is_disease_name(q, catalog), name_queries)
+        row["is_disease_name_full_ms"] = per_call_ms(lambda q: is_disease_name(q, full_catalog), name_queries)
+        row["question_search_ms"] = per_call_ms(
+            lambda q: questions_vs.similarity_search_by_vector(questions_vs.embeddings.embed_query(q), k=QUESTION_K),
+            queries
+        )
+        row["information_ms"] = per_call_ms(
+            lambda d: information_vs.as_retriever(search_kwargs={"k": INFORMATION_K, "filter": disease_filter(d)}).invoke(d),
+            rng.sample(sorted(full_catalog), min(args.queries, len(full_catalog)))
+        )
+        client.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    row.update(session_memory(max(1, round(BASE_SESSIONS * scale)), names, args.seed))
+    return {name: round(value, 4) if isinstance(value, float) else value for name, value in row.items()}
+
+
+def run_isolated(scale, args):
+    command = [
+        sys.executable, "-m", "benchmarks.scale", "--worker", str(scale),
+        "--dedup-threshold", str(args.dedup_threshold), "--queries", str(args.queries),
+        "--name-queries", str(args.name_queries), "--seed", str(args.seed)
+    ]
+    completed = subprocess.run(command, cwd=os.path.join(os.path.dirname(__file__), ".."),
+                               stdout=subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Scale {scale:g} failed (exit {completed.returncode})")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_table(rows):
+    print("".join(f"{label:>9}" for label in LABELS))
+    for row in rows:
+        print("".join(
+            f"{'-' if row.get(name) is None else (f'{row[name]:.3g}' if isinstance(row[name], float) else row[name]):>9}"
+            for name in COLUMNS
+        ))
+
+
+def plot(rows, path):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("⚠️ Cần cài matplotlib để vẽ biểu đồ (pip install matplotlib)")
+        return
+
+    chunks = [row["chunks"] for row in rows]
+    panels = [
+        ("Ingest (s)", ("extract_s", "dedup_s", "upsert_information_s", "upsert_questions_s", "ingest_s")),
+        ("Index memory (MB)", ("rss_mb", "disk_mb", "vectors_mb")),
+        ("Query latency (ms)", ("is_disease_name_ms", "is_disease_name_full_ms", "question_search_ms", "information_ms")),
+        ("Catalog and sessions", ("catalog_load_s", "catalog_coverage", "session_kb"))
+    ]
+    figure, axes = plt.subplots(2, 2, figsize=(12, 9))
+    for axis, (title, names) in zip(axes.flat, panels):
+        for name in names:
+            axis.plot(chunks, [row[name] for row in rows], marker="o", label=name)
+        axis.set_xscale("log")
+        axis.set_yscale("log")
+        axis.set_xlabel("information chunks")
+        axis.set_title(title)
+        axis.legend(fontsize="small")
+    figure.tight_layout()
+    figure.savefig(path)
+    print(f"📈 Đã vẽ biểu đồ: {path}")
+
+
+def main():
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    parser = argparse.ArgumentParser(description="Measure ingest, index memory and query latency against corpus size")
+    parser.add_argument("--scales", default="1,3,10", help="Corpus sizes as multiples of today's corpus")
+    parser.add_argument("--dedup-threshold", type=float, default=0.85, help="Near-duplicate merging at ingest (0 disables)")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per retrieval latency measurement")
+    parser.add_argument("--name-queries", type=int, default=10, help="Queries per is_disease_name measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--in-process", action="store_true", help="Run every scale in this process (memory numbers overlap)")
+    parser.add_argument("-o", "--output", help="Write the rows to this CSV file")
+    parser.add_argument("--plot", help="Draw the curves to this image file (needs matplotlib)")
+    parser.add_argument("--worker", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(measure(args.worker, args)))
+        return
+
+    rows = []
+    for scale in sorted(float(value) for value in args.scales.split(",") if value.strip()):
+        print(f"⏳ Scale {scale:g}x ...")
+        rows.append(measure(scale, args) if args.in_process else run_isolated(scale, args))
+
+    print()
+    print_table(rows)
+    from app.services.rag_chain import CATALOG_SCAN_LIMIT
+    truncated = [row for row in rows if row["catalog_coverage"] < 1]
+    if truncated:
+        print(
+            f"\n⚠️ Catalog bị cắt ở CATALOG_SCAN_LIMIT={CATALOG_SCAN_LIMIT} chunk: từ {truncated[0]['scale']:g}x "
+            f"chỉ tải được {truncated[0]['catalog_coverage']:.0%} tên bệnh"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\n💾 Đã ghi {len(rows)} dòng vào {args.output}")
+    if args.plot:
+        plot(rows, args.plot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Deterministic stand-ins for the Hugging Face models, so benchmarks time our code rather than model inference.
+"""
+import re
+import hashlib
+
+
+def _words(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+class StubCrossEncoder:
+    """
+    Scores a (query, text) pair by word overlap, scaled to roughly the logit range of the real
+    cross-encoder. Same input, same score, on every machine.
+    """
+
+    def predict(self, pairs, show_progress_bar=False, **kwargs):
+        scores = []
+        for query, text in pairs:
+            a, b = _words(query), _words(text)
+            scores.append(8.0 * len(a & b) / (len(a | b) or 1) - 2.0)
+        return scores
+
+
+class StubEmbeddings:
+    """
+    Bag-of-words hashing into 384 dimensions, L2-normalized: texts sharing words land close together.
+    Serves both as a SentenceTransformer (encode) and as LangChain embeddings (embed_query/embed_documents).
+    """
+
+    def __init__(self, size=384):
+        self.size = size
+
+    def _vector(self, text):
+        import numpy as np
+
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in _words(text):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+            vector[int.from_bytes(digest, "little") % self.size] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, texts, batch_size=32, show_progress_bar=False, **kwargs):
+        import numpy as np
+
+        return np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.size), dtype=np.float32)
+
+    def embed_documents(self, texts):
+        return [self._vector(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text).tolist()
+
+
+def install():
+    """
+    Put the stub in the shared cross-encoder cache used by intent detection and reranking.
+    """
+    from app.services import tools
+
+    with tools._cross_encoder_lock:
+        tools._cross_encoders[tools.CROSS_ENCODER_MODEL] = StubCrossEncoder()
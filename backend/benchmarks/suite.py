@@ -0,0 +1,160 @@
+"""
+Benchmark definitions. Each setup function builds its inputs and returns (callable, ops): the callable
+runs one pass over a fixed workload of `ops` operations, and results are reported per operation.
+"""
+import os
+import sys
+import random
+import itertools
+from datetime import datetime
+from loadtest.seed import load_corpus
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "src")
+
+BENCHMARKS = []
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+def benchmark(*params):
+    """
+    Register a setup function, once per parameter; the parameter shows in the name, e.g. is_disease_name[600].
+    """
+    def register(setup):
+        for param in params or (None,):
+            name = setup.__name__ if param is None else f"{setup.__name__}[{param}]"
+            BENCHMARKS.append((name, setup, param))
+        return setup
+    return register
+
+
+def fixture_questions():
+    return [q for questions in load_corpus()["questions"].values() for q in questions]
+
+
+DISEASE_PREFIXES = ["Viêm", "Ung Thư", "Suy", "Sỏi", "Rối Loạn", "U", "Thoái Hóa", "Xơ", "Giãn", "Nhiễm Trùng"]
+ORGANS = [
+    "Gan", "Thận", "Phổi", "Dạ Dày", "Tim", "Não", "Da", "Khớp Gối", "Tuyến Giáp",
+    "Đại Tràng", "Bàng Quang", "Tai Giữa", "Xoang", "Họng", "Mắt"
+]
+QUALIFIERS = [
+    "", "Cấp", "Mạn Tính", "Giai Đoạn 1", "Giai Đoạn 2", "Ở Trẻ Em", "Sau Sinh",
+    "Do Virus", "Do Vi Khuẩn", "Tái Phát", "Bẩm Sinh", "Ở Người Già", "Tự Miễn", "Dị Ứng"
+]
+
+
+def disease_catalog(size):
+    """
+    Deterministic catalog of plausible disease names (the production catalog has ~600).
+    """
+    names = [" ".join(filter(None, parts)) for parts in itertools.product(DISEASE_PREFIXES, ORGANS, QUALIFIERS)]
+    random.Random(0).shuffle(names)
+    return set(names[:size])
+
+
+@benchmark()
+def detect_intent():
+    from app.services import tools
+
+    queries = fixture_questions()[:20]
+    return lambda: [tools.detect_intent(query, "sốt") for query in queries], len(queries)
+
+
+@benchmark()
+def extract_symptoms():
+    from app.services import tools
+
+    queries = fixture_questions()
+    return lambda: [tools.extract_symptoms(query) for query in queries], len(queries)
+
+
+@benchmark(100, 600, 2000)
+def is_disease_name(size):
+    from app.services.rag_chain import is_disease_name as match
+
+    catalog = disease_catalog(size)
+    named = sorted(catalog)[:5]
+    queries = fixture_questions()[:15] + [f"Cho tôi biết về bệnh {name.lower()}" for name in named]
+    return lambda: [match(query, catalog) for query in queries], len(queries)
+
+
+@benchmark()
+def rerank_aggregate():
+    """
+    What a diagnosis turn does after question retrieval: rerank QUESTION_K documents, sum scores
+    per disease and merge them with the previous turn's scores.
+    """
+    from app.services import tools
+    from app.services.rag_chain import QUESTION_K, score_diseases, merge_scores
+
+    corpus = load_corpus()["questions"]
+    docs = [{"content": q, "metadata": {"disease": disease}} for disease, qs in corpus.items() for q in qs]
+    rng = random.Random(0)
+    turns = [(query, rng.sample(docs, QUESTION_K)) for query in fixture_questions()[:20]]
+    previous = {disease: 1.0 for disease in list(corpus)[:5]}
+    reranker = tools.get_cross_encoder()
+
+    def run():
+        for query, question_docs in turns:
+            scores = reranker.predict([(query, doc["content"]) for doc in question_docs], show_progress_bar=False)
+            ranked_docs = [{**doc, "score": float(score)} for doc, score in zip(question_docs, scores)]
+            merge_scores(previous, score_diseases(sorted(ranked_docs, key=lambda x: x["score"], reverse=True)))
+    return run, len(turns)
+
+
+@benchmark(1000, 10000)
+def update_session(sessions):
+    from app.models.chat import ChatMessage
+    from app.services.session_manager import SessionManager
+
+    manager = SessionManager()
+    session_ids = [manager.create_session() for _ in range(sessions)]
+    targets = random.Random(0).choices(session_ids, k=1000)
+    message = ChatMessage(role="user", content="Tôi bị đau đầu và sốt", timestamp=datetime.now().isoformat())
+    return lambda: [manager.update_session(session_id, message, "đau đầu sốt") for session_id in targets], len(targets)
+
+
+def chunk_items(count):
+    """
+    Crawled pages in the clean_chunks.jsonl shape, built from the fixture information chunks.
+    """
+    information = load_corpus()["information"]
+    items = []
+    for i in range(count):
+        main, sub = information[i % len(information)], information[(i + 1) % len(information)]
+        items.append({
+            "title": f"{main['metadata']['disease']}: Tổng quan {i}",
+            "source": f"https://example.com/benh/{i}",
+            "sections": [{
+                "content": main["text"],
+                "subsections": [
+                    {"title": sub["metadata"]["section_title"], "content": sub["text"]},
+                    {"title": "Liên hệ", "content": "Gọi hotline để đặt lịch hẹn với bác sĩ chuyên khoa ngay hôm nay, ưu đãi giảm giá cho khách hàng mới."}
+                ]
+            }]
+        })
+    return items
+
+
+def import_create_index():
+    # create_index builds a Qdrant client at import; placeholders keep it from refusing to load (nothing connects)
+    os.environ.setdefault("QDRANT_URL", "http://localhost:6333")
+    os.environ.setdefault("QDRANT_API_KEY", "benchmark")
+    os.environ.setdefault("TQDM_DISABLE", "1")
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    import create_index
+    return create_index
+
+
+@benchmark(200)
+def extract_chunks(count):
+    try:
+        create_index = import_create_index()
+    except Exception as e:
+        raise SkipBenchmark(f"create_index unavailable: {e}")
+
+    items = chunk_items(count)
+    return lambda: create_index.extract_chunks(items), len(items)
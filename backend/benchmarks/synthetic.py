@@ -0,0 +1,133 @@
+"""
+Synthetic corpus in the shapes create_index consumes, at any size: crawled pages as in clean_chunks.jsonl
+({title, source, sections: [{content, subsections: [{title, content}]}]}) and a {disease: [question, ...]}
+dict as in questions_merged.json. Deterministic for a given seed.
+
+    python -m benchmarks.synthetic --scale 10 --out-dir /tmp/vimedical-10x
+"""
+import os
+import json
+import random
+import argparse
+import itertools
+from .suite import DISEASE_PREFIXES, ORGANS, QUALIFIERS
+
+# Roughly today's corpus: ~600 diseases, a few thousand information chunks
+BASE_DISEASES = 600
+PAGES_PER_DISEASE = 2
+SUBSECTIONS_PER_PAGE = 2
+QUESTIONS_PER_DISEASE = 10
+SYMPTOMS_PER_DISEASE = 5
+
+SYMPTOMS = [
+    "đau đầu", "sốt", "ho", "khó thở", "mệt mỏi", "buồn nôn", "chóng mặt", "đau bụng", "tiêu chảy",
+    "phát ban", "ngứa", "đau ngực", "đau khớp", "sưng", "ớn lạnh", "đổ mồ hôi đêm", "sụt cân", "chán ăn",
+    "mất ngủ", "đau lưng", "tê bì tay chân", "khàn tiếng", "nghẹt mũi", "đau họng", "ù tai", "mờ mắt",
+    "tiểu buốt", "tiểu nhiều", "vàng da", "phù chân", "tim đập nhanh", "co giật", "run tay", "đau cơ",
+    "nôn ra máu", "ho ra máu", "táo bón", "đầy hơi", "khô miệng", "rụng tóc"
+]
+SUBSECTION_TITLES = ["Triệu chứng", "Nguyên nhân", "Chẩn đoán", "Điều trị", "Phòng ngừa", "Biến chứng", "Đối tượng nguy cơ"]
+
+MAIN_TEMPLATES = [
+    "{disease} là tình trạng bệnh lý thường gặp, người bệnh có thể xuất hiện {s0}, {s1} và {s2}. "
+    "Bệnh tiến triển theo từng giai đoạn và cần được theo dõi bởi bác sĩ chuyên khoa để tránh biến chứng.",
+    "Người mắc {disease} thường than phiền về {s0} kéo dài, đôi khi kèm theo {s1}. "
+    "Nếu không được phát hiện sớm, bệnh có thể ảnh hưởng nghiêm trọng đến chất lượng cuộc sống."
+]
+SUBSECTION_TEMPLATES = [
+    "Các dấu hiệu điển hình của {disease} gồm {s0}, {s1}, {s3} và {s4}. Triệu chứng có thể nặng hơn "
+    "vào ban đêm hoặc khi người bệnh làm việc quá sức trong thời gian dài.",
+    "Nguyên nhân gây {disease} có thể do di truyền, môi trường sống hoặc thói quen sinh hoạt không lành mạnh. "
+    "Người bệnh thường đến khám khi thấy {s2} và {s3} không thuyên giảm.",
+    "Điều trị {disease} cần kết hợp dùng thuốc theo chỉ định, nghỉ ngơi hợp lý và tái khám định kỳ. "
+    "Khi xuất hiện {s4} hoặc {s0} dữ dội, người bệnh cần đến cơ sở y tế ngay."
+]
+QUESTION_TEMPLATES = [
+    "Tôi bị {s0} và {s1} mấy ngày nay, tôi có thể bị bệnh gì?",
+    "Dạo gần đây tôi thường xuyên {s0}, kèm theo {s2} thì có nguy hiểm không?",
+    "Con tôi bị {s1}, {s3} và {s4}, có phải là dấu hiệu của bệnh gì không?",
+    "Triệu chứng {s0} kèm {s4} kéo dài thì nên đi khám chuyên khoa nào?",
+    "Bệnh {disease_lower} có những triệu chứng gì và điều trị như thế nào?"
+]
+# Real pages carry these; extract_chunks drops the ad and dedup merges the repeated disclaimer
+AD_TEXT = "Liên hệ hotline của bệnh viện để đặt lịch hẹn với bác sĩ chuyên khoa, ưu đãi giảm giá cho khách hàng đăng ký trong tháng này."
+DISCLAIMER_TEXT = (
+    "Thông tin trong bài viết chỉ mang tính chất tham khảo, không thay thế cho việc chẩn đoán hoặc điều trị y khoa. "
+    "Người bệnh cần tuân theo hướng dẫn của bác sĩ chuyên môn."
+)
+
+
+def disease_names(count, seed=0):
+    """
+    `count` distinct disease names: the benchmark catalog vocabulary, then repeated rounds with a "Thể N" suffix.
+    """
+    base = [" ".join(filter(None, parts)) for parts in itertools.product(DISEASE_PREFIXES, ORGANS, QUALIFIERS)]
+    random.Random(seed).shuffle(base)
+    names = []
+    for round_index in itertools.count():
+        for name in base:
+            if len(names) >= count:
+                return names
+            names.append(name if round_index == 0 else f"{name} Thể {round_index + 1}")
+
+
+def generate_corpus(diseases, pages=PAGES_PER_DISEASE, subsections=SUBSECTIONS_PER_PAGE,
+                    questions=QUESTIONS_PER_DISEASE, seed=0):
+    """
+    Returns (pages, questions) for `diseases` diseases. Each disease gets its own symptom profile,
+    used by both its pages and its questions, so retrieval has something to find.
+    """
+    rng = random.Random(seed)
+    items = []
+    question_map = {}
+    for index, disease in enumerate(disease_names(diseases, seed)):
+        profile = rng.sample(SYMPTOMS, SYMPTOMS_PER_DISEASE)
+        fields = {f"s{i}": symptom for i, symptom in enumerate(profile)}
+        fields.update(disease=disease, disease_lower=disease.lower())
+        for page in range(pages):
+            titles = rng.sample(SUBSECTION_TITLES, min(subsections, len(SUBSECTION_TITLES)))
+            section_subsections = [
+                {"title": title, "content": rng.choice(SUBSECTION_TEMPLATES).format(**fields)}
+                for title in titles
+            ]
+            if rng.random() < 0.3:
+                section_subsections.append({"title": "Liên hệ", "content": AD_TEXT})
+            if rng.random() < 0.2:
+                section_subsections.append({"title": "Lưu ý", "content": DISCLAIMER_TEXT})
+            items.append({
+                "title": f"{disease}: {rng.choice(SUBSECTION_TITLES)} và cách điều trị",
+                "source": f"https://example.com/benh/{index}/{page}",
+                "sections": [{
+                    "content": rng.choice(MAIN_TEMPLATES).format(**fields),
+                    "subsections": section_subsections
+                }]
+            })
+        question_map[disease] = [rng.choice(QUESTION_TEMPLATES).format(**fields) for _ in range(questions)]
+    return items, question_map
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic ViMedical corpus (clean_chunks.jsonl, questions_merged.json)")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--scale", type=float, default=1.0, help=f"Multiple of today's corpus ({BASE_DISEASES} diseases)")
+    size.add_argument("--diseases", type=int, help="Number of diseases")
+    parser.add_argument("--pages", type=int, default=PAGES_PER_DISEASE, help="Pages per disease")
+    parser.add_argument("--subsections", type=int, default=SUBSECTIONS_PER_PAGE, help="Subsections per page")
+    parser.add_argument("--questions", type=int, default=QUESTIONS_PER_DISEASE, help="Questions per disease")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out-dir", required=True)
+    args = parser.parse_args()
+
+    diseases = args.diseases or round(BASE_DISEASES * args.scale)
+    items, questions = generate_corpus(diseases, args.pages, args.subsections, args.questions, args.seed)
+    os.makedirs(args.out_dir, exist_ok=True)
+    with open(os.path.join(args.out_dir, "clean_chunks.jsonl"), "w", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    with open(os.path.join(args.out_dir, "questions_merged.json"), "w", encoding="utf-8") as f:
+        json.dump(questions, f, ensure_ascii=False)
+    print(f"💾 {diseases} bệnh, {len(items)} trang, {sum(len(qs) for qs in questions.values())} câu hỏi -> {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
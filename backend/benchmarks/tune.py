@@ -0,0 +1,345 @@
+"""
+Latency/accuracy sweep of the retrieval decision constants over the ViMedical question dataset.
+
+Each question is replayed once through the real models and vector store (intent scores, disease-name
+match, question search + rerank, information search); outputs and stage timings are cached on disk, so
+the sweep itself and later runs need neither. For every combination of QUESTION_K, DIAGNOSIS_MARGIN,
+DIAGNOSIS_MIN_SCORE, INFORMATION_K and INTENT_THRESHOLD it reports top-1/top-3 accuracy, clarification
+rate, turns-to-answer and modelled per-query retrieval latency, and prints the Pareto-optimal settings.
+
+    python -m benchmarks.tune --limit 1000
+    python -m benchmarks.tune --question-k 10,20,30 --margin 1.0,1.125,1.25 -o sweep.csv
+
+Turns-to-answer: 1 when the pipeline answers with the right disease, 2 when it asks back and the right
+disease is among the three offered, --miss-turns otherwise (wrong answer, or nothing useful offered).
+"""
+import os
+import csv
+import json
+import time
+import random
+import argparse
+import itertools
+import statistics
+
+REPO_ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", ".."))
+DATASET_PATH = os.path.join(REPO_ROOT, "data", "ViMedical_Disease.csv")
+QUESTIONS_JSON_PATH = os.path.join(REPO_ROOT, "scripts", "questions_merged.json")
+CACHE_PATH = os.path.join(os.path.dirname(__file__), ".tune_cache.json")
+
+
+def load_dataset(path):
+    """
+    (disease, question) pairs from the raw CSV (Disease, Question columns) or questions_merged.json.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = [(row["Disease"], row["Question"]) for row in csv.DictReader(f)]
+        else:
+            rows = [(disease, q) for disease, questions in json.load(f).items() for q in questions]
+    return [(" ".join(d.split()), " ".join(q.split())) for d, q in rows if d and q and d.strip() and q.strip()]
+
+
+def parse_values(spec, cast):
+    return [cast(value) for value in spec.split(",") if value.strip()]
+
+
+class ModelCache:
+    """
+    Model and vector-store outputs per query, with the time each took when first computed.
+    Invalidated when the models or collections it was built from change.
+    """
+
+    def __init__(self, path, identity, on_miss=None):
+        self.path = path
+        # Called before timing a computation, so one-off loading does not count as query latency
+        self.on_miss = on_miss
+        self.data = {"identity": identity}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("identity") == identity:
+                self.data = cached
+            else:
+                print("♻️ Cache được tạo với model/collection khác, bỏ qua")
+        for section in ("intent", "match", "questions", "rerank", "information"):
+            self.data.setdefault(section, {})
+        self.dirty = False
+
+    def get(self, section, key, compute):
+        entries = self.data[section]
+        if key not in entries:
+            if self.on_miss:
+                self.on_miss()
+            start = time.perf_counter()
+            value = compute()
+            entries[key] = {"value": value, "seconds": time.perf_counter() - start}
+            self.dirty = True
+        return entries[key]
+
+    def save(self):
+        if self.path and self.dirty:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+class Pipeline:
+    """
+    The retrieval steps of rag_chain, exposed one by one so their outputs can be cached.
+    Models and vector stores are only loaded on the first cache miss.
+    """
+
+    def __init__(self, max_question_k):
+        from app.services import tools, rag_chain
+
+        self.tools = tools
+        self.rag_chain = rag_chain
+        self.max_question_k = max_question_k
+        self.loaded = False
+
+    def load(self):
+        if self.loaded:
+            return
+        print("⏳ Đang tải model và vector store ...")
+        self.questions_vs, self.information_vs = self.rag_chain.load_vectorstores()
+        self.reranker = self.rag_chain.get_reranker()
+        self.intent_model = self.tools.get_intent_model()
+        self.known_diseases = self.rag_chain.load_known_diseases(self.information_vs)
+        self.loaded = True
+
+    def intent_scores(self, query):
+        pairs, _ = self.tools.intent_pairs(query, self.tools.extract_symptoms(query))
+        return [float(score) for score in self.intent_model.predict(pairs, show_progress_bar=False)]
+
+    def match(self, query):
+        return self.rag_chain.is_disease_name(query, self.known_diseases)
+
+    def search(self, query):
+        vector = self.questions_vs.embeddings.embed_query(query)
+        docs = self.questions_vs.similarity_search_by_vector(vector, k=self.max_question_k)
+        return [[doc.metadata.get("disease", ""), doc.page_content] for doc in docs]
+
+    def rerank(self, query, hits):
+        if not hits:
+            return []
+        return [float(score) for score in self.reranker.predict([(query, text) for _, text in hits], show_progress_bar=False)]
+
+    def information(self, disease, k):
+        docs = self.information_vs.as_retriever(
+            search_kwargs={"k": k, "filter": self.rag_chain.disease_filter(disease)}
+        ).invoke(disease)
+        return sum(len(doc.page_content) for doc in docs)
+
+
+def prepare(dataset, pipeline, cache, grid):
+    """
+    Run every model/store call the sweep can need (through the cache) and return per-question records.
+    """
+    tools, rag_chain = pipeline.tools, pipeline.rag_chain
+    records = []
+    for index, (truth, question) in enumerate(dataset, 1):
+        record = {"truth": rag_chain.normalize_disease_name(truth), "question": question, "paths": {}}
+        if tools.check_reference_last(question):
+            record["ask_confirmation"] = True
+            records.append(record)
+            continue
+        intent = cache.get("intent", question, lambda: pipeline.intent_scores(question))
+        record["intent_seconds"] = intent["seconds"]
+        query_symptoms = tools.extract_symptoms(question)
+        _, owners = tools.intent_pairs(question, query_symptoms)
+        intent_scores = {}
+        for owner, score in zip(owners, intent["value"]):
+            intent_scores[owner] = max(intent_scores.get(owner, score), score)
+
+        for threshold in grid["intent_threshold"]:
+            decided = tools.decide_intent(intent_scores, query_symptoms, "", threshold=threshold)
+            processed = tools.context_from_intent(question, "", decided)["query"]
+            match = cache.get("match", processed, lambda: pipeline.match(processed))
+            path = {"match": match["value"], "match_seconds": match["seconds"]}
+            if not match["value"]:
+                search = cache.get("questions", processed, lambda: pipeline.search(processed))
+                hits = search["value"]
+                rerank = cache.get("rerank", processed, lambda: pipeline.rerank(processed, hits))
+                path.update(hits=hits, search_seconds=search["seconds"], scores=rerank["value"],
+                            pair_seconds=rerank["seconds"] / max(len(hits), 1))
+            record["paths"][threshold] = path
+        records.append(record)
+        if index % 50 == 0:
+            cache.save()
+            print(f"   {index}/{len(dataset)} câu hỏi")
+    cache.save()
+    return records
+
+
+def information_cost(cache, pipeline, disease, k):
+    entry = cache.get("information", f"{disease}|{k}", lambda: pipeline.information(disease, k))
+    return entry["value"], entry["seconds"]
+
+
+def evaluate(records, config, cache, pipeline, miss_turns):
+    rag_chain = pipeline.rag_chain
+    question_k, margin, min_score, information_k, threshold = config
+    top1 = top3 = clarified = wrong = 0
+    turns, latencies, context_chars = [], [], []
+    for record in records:
+        truth = record["truth"].lower()
+        if record.get("ask_confirmation"):
+            clarified += 1
+            turns.append(miss_turns)
+            continue
+        path = record["paths"][threshold]
+        latency = record["intent_seconds"] + path["match_seconds"]
+        if path["match"]:
+            candidates = [path["match"]]
+            confident = True
+        else:
+            hits = path["hits"][:question_k]
+            ranked = sorted(
+                [{"metadata": {"disease": disease}, "score": score} for (disease, _), score in zip(hits, path["scores"])],
+                key=lambda x: x["score"], reverse=True
+            )
+            sorted_candidates = rag_chain.score_diseases(ranked)
+            candidates = [name for name, _ in sorted_candidates]
+            confident = bool(sorted_candidates) and rag_chain.is_confident(sorted_candidates, margin, min_score)
+            latency += path["search_seconds"] + len(hits) * path["pair_seconds"]
+
+        offered = [name.lower() for name in candidates[:3]]
+        top1 += bool(offered) and offered[0] == truth
+        top3 += truth in offered
+        if confident:
+            chars, seconds = information_cost(cache, pipeline, candidates[0], information_k)
+            latency += seconds
+            context_chars.append(chars)
+            if offered[0] == truth:
+                turns.append(1)
+            else:
+                wrong += 1
+                turns.append(miss_turns)
+        else:
+            clarified += 1
+            turns.append(2 if truth in offered else miss_turns)
+        latencies.append(latency)
+
+    total = len(records) or 1
+    latencies.sort()
+    return {
+        "question_k": question_k,
+        "margin": margin,
+        "min_score": min_score,
+        "information_k": information_k,
+        "intent_threshold": threshold,
+        "top1": round(top1 / total, 4),
+        "top3": round(top3 / total, 4),
+        "clarification_rate": round(clarified / total, 4),
+        "wrong_answer_rate": round(wrong / total, 4),
+        "turns": round(statistics.mean(turns), 4) if turns else 0.0,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0.0,
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else 0.0,
+        "context_chars": round(statistics.mean(context_chars)) if context_chars else 0
+    }
+
+
+def pareto_front(rows):
+    """
+    Rows not dominated on (fewer turns, lower p95 latency, higher top-1 accuracy). Of several settings
+    with identical outcomes only the cheapest (smallest k, then information k) is kept.
+    """
+    def dominates(a, b):
+        no_worse = a["turns"] <= b["turns"] and a["p95_ms"] <= b["p95_ms"] and a["top1"] >= b["top1"]
+        better = a["turns"] < b["turns"] or a["p95_ms"] < b["p95_ms"] or a["top1"] > b["top1"]
+        return no_worse and better
+    front = {}
+    for row in sorted(rows, key=lambda row: (row["question_k"], row["information_k"])):
+        key = (row["turns"], row["p95_ms"], row["top1"])
+        if key not in front and not any(dominates(other, row) for other in rows):
+            front[key] = row
+    return list(front.values())
+
+
+COLUMNS = ("question_k", "margin", "min_score", "information_k", "intent_threshold", "top1", "top3",
+           "clarification_rate", "wrong_answer_rate", "turns", "p50_ms", "p95_ms", "context_chars")
+
+
+def print_table(rows, current):
+    labels = ("k", "margin", "floor", "info_k", "intent", "top1", "top3", "clarify", "wrong", "turns", "p50ms", "p95ms", "ctx")
+    print("  " + "".join(f"{label:>9}" for label in labels))
+    for row in rows:
+        marker = "* " if tuple(row[name] for name in COLUMNS[:5]) == current else "  "
+        print(marker + "".join(f"{row[name]:>9}" for name in COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the retrieval decision constants")
+    parser.add_argument("--dataset", default=None, help="ViMedical_Disease.csv or questions_merged.json")
+    parser.add_argument("--limit", type=int, default=1000, help="Questions sampled from the dataset (0 = all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", default=CACHE_PATH, help="Model output cache ('' disables)")
+    parser.add_argument("--question-k", default="10,15,20,30")
+    parser.add_argument("--margin", default="1.0,1.05,1.125,1.25,1.5")
+    parser.add_argument("--min-score", default="0,0.5,0.92,1.5,3")
+    parser.add_argument("--information-k", default="3,6,10")
+    parser.add_argument("--intent-threshold", default="0.3,0.5,0.7")
+    parser.add_argument("--miss-turns", type=float, default=3.0, help="Turns charged for a wrong or unresolved answer")
+    parser.add_argument("--all", action="store_true", help="Print every configuration, not only the Pareto front")
+    parser.add_argument("-o", "--output", help="Write every configuration to this CSV file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.services import rag_chain, tools
+
+    dataset_path = args.dataset or (DATASET_PATH if os.path.exists(DATASET_PATH) else QUESTIONS_JSON_PATH)
+    dataset = load_dataset(dataset_path)
+    if args.limit and len(dataset) > args.limit:
+        dataset = random.Random(args.seed).sample(dataset, args.limit)
+    grid = {
+        "question_k": parse_values(args.question_k, int),
+        "margin": parse_values(args.margin, float),
+        "min_score": parse_values(args.min_score, float),
+        "information_k": parse_values(args.information_k, int),
+        "intent_threshold": parse_values(args.intent_threshold, float)
+    }
+    print(f"📂 {dataset_path}: {len(dataset)} câu hỏi")
+
+    identity = {
+        "qdrant": rag_chain.QDRANT_PATH or rag_chain.QDRANT_URL,
+        "collections": [rag_chain.COLLECTION_QUESTIONS, rag_chain.COLLECTION_INFORMATION],
+        "embedding": rag_chain.EMBEDDING_MODEL,
+        "cross_encoder": tools.CROSS_ENCODER_MODEL,
+        "max_question_k": max(grid["question_k"])
+    }
+    pipeline = Pipeline(max(grid["question_k"]))
+    cache = ModelCache(args.cache, identity, on_miss=pipeline.load)
+
+    start = time.perf_counter()
+    records = prepare(dataset, pipeline, cache, grid)
+    print(f"✅ Chuẩn bị xong sau {time.perf_counter() - start:.1f}s")
+
+    configs = list(itertools.product(
+        grid["question_k"], grid["margin"], grid["min_score"], grid["information_k"], grid["intent_threshold"]
+    ))
+    rows = [evaluate(records, config, cache, pipeline, args.miss_turns) for config in configs]
+    cache.save()
+
+    current = (rag_chain.QUESTION_K, rag_chain.DIAGNOSIS_MARGIN, rag_chain.DIAGNOSIS_MIN_SCORE,
+               rag_chain.INFORMATION_K, tools.INTENT_THRESHOLD)
+    front = sorted(pareto_front(rows), key=lambda row: (row["turns"], row["p95_ms"]))
+    print(f"\n📊 {len(front)}/{len(rows)} cấu hình trên Pareto front (turns ↓, p95 ↓, top1 ↑); * = cấu hình hiện tại")
+    print_table(sorted(rows, key=lambda row: (row["turns"], row["p95_ms"])) if args.all else front, current)
+    baseline = [row for row in rows if tuple(row[name] for name in COLUMNS[:5]) == current]
+    if baseline and not args.all and baseline[0] not in front:
+        print("\nCấu hình hiện tại:")
+        print_table(baseline, current)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\n💾 Đã ghi {len(rows)} cấu hình vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
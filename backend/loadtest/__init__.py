@@ -0,0 +1,3 @@
+"""
+Load-testing harness: virtual-user driver, fake OpenAI-compatible LLM server and embedded Qdrant seeding.
+"""
@@ -0,0 +1,143 @@
+"""
+OpenAI-compatible stand-in for OpenRouter, with configurable latency, streaming and error injection.
+
+    python -m loadtest.fake_llm --port 8100 --llm-latency-ms 800 --llm-token-ms 20
+    LLM_BASE_URL=http://127.0.0.1:8100/v1 OPENROUTER_API_KEY=loadtest python run.py
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+settings = {
+    "latency_ms": 800.0,     # time to first token
+    "token_ms": 20.0,        # delay between streamed tokens
+    "tokens": 60,            # length of each answer, in words
+    "jitter": 0.3,           # each delay is scaled by a random factor in [1 - jitter, 1 + jitter]
+    "slow_rate": 0.0,        # fraction of requests that are slow_factor times slower (tail latency)
+    "slow_factor": 5.0,
+    "error_rate": 0.0        # fraction of requests answered with 429 / 500
+}
+
+stats = {"requests": 0, "streamed": 0, "errors": 0, "completed": 0}
+
+ANSWER_WORDS = (
+    "Dựa trên các triệu chứng bạn mô tả, bạn có thể đang gặp tình trạng cần được theo dõi thêm. "
+    "Bạn nên nghỉ ngơi, uống đủ nước và theo dõi nhiệt độ cơ thể. Nếu triệu chứng kéo dài hoặc nặng hơn, "
+    "hãy đến cơ sở y tế gần nhất để được bác sĩ thăm khám và tư vấn điều trị phù hợp."
+).split()
+
+app = FastAPI(title="Fake LLM", docs_url=None, redoc_url=None)
+
+
+def _delay(base_ms, slow):
+    jitter = settings["jitter"]
+    factor = random.uniform(1 - jitter, 1 + jitter) * (settings["slow_factor"] if slow else 1.0)
+    return max(0.0, base_ms * factor / 1000.0)
+
+
+def _answer_words():
+    return [ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(int(settings["tokens"]))]
+
+
+def _chunk(completion_id, model, delta, finish_reason=None):
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _stream(completion_id, model, words, slow):
+    stats["streamed"] += 1
+    await asyncio.sleep(_delay(settings["latency_ms"], slow))
+    yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+    for i, word in enumerate(words):
+        if i:
+            await asyncio.sleep(_delay(settings["token_ms"], slow))
+        yield _chunk(completion_id, model, {"content": word if i == 0 else f" {word}"})
+    yield _chunk(completion_id, model, {}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+    stats["completed"] += 1
+
+
+# Matches whatever prefix LLM_BASE_URL carries (/v1/chat/completions, /api/v1/chat/completions, ...)
+@app.post("/{path:path}")
+async def chat_completions(path: str, request: Request):
+    if not path.endswith("chat/completions"):
+        return JSONResponse({"error": {"message": f"Unknown endpoint /{path}"}}, status_code=404)
+    body = await request.json()
+    stats["requests"] += 1
+    model = body.get("model", "fake-model")
+
+    if random.random() < settings["error_rate"]:
+        stats["errors"] += 1
+        status = random.choice((429, 500))
+        return JSONResponse({"error": {"message": "Injected failure", "code": status}}, status_code=status)
+
+    slow = random.random() < settings["slow_rate"]
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    words = _answer_words()
+    if body.get("stream"):
+        return StreamingResponse(_stream(completion_id, model, words, slow), media_type="text/event-stream")
+
+    await asyncio.sleep(_delay(settings["latency_ms"], slow) + len(words) * _delay(settings["token_ms"], slow))
+    stats["completed"] += 1
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return {"settings": settings, **stats}
+
+
+def add_arguments(parser):
+    parser.add_argument("--llm-latency-ms", type=float, default=settings["latency_ms"], help="Fake LLM time to first token")
+    parser.add_argument("--llm-token-ms", type=float, default=settings["token_ms"], help="Fake LLM delay between tokens")
+    parser.add_argument("--llm-tokens", type=int, default=settings["tokens"], help="Fake LLM answer length (words)")
+    parser.add_argument("--llm-jitter", type=float, default=settings["jitter"])
+    parser.add_argument("--llm-slow-rate", type=float, default=settings["slow_rate"])
+    parser.add_argument("--llm-slow-factor", type=float, default=settings["slow_factor"])
+    parser.add_argument("--llm-error-rate", type=float, default=settings["error_rate"])
+
+
+def configure(args):
+    settings.update(
+        latency_ms=args.llm_latency_ms,
+        token_ms=args.llm_token_ms,
+        tokens=args.llm_tokens,
+        jitter=args.llm_jitter,
+        slow_rate=args.llm_slow_rate,
+        slow_factor=args.llm_slow_factor,
+        error_rate=args.llm_error_rate
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
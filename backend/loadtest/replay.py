@@ -0,0 +1,343 @@
+"""
+Replay chat turns captured with CAPTURE_PATH against a build, then diff its latency distributions and
+decisions with the capture (or any earlier replay). Sessions replay turn by turn, in their original
+order, so diagnose_update chains reach the same pipeline paths as in production.
+
+    python -m loadtest.replay capture.jsonl capture.jsonl.1 --url http://localhost:8000 -o candidate.jsonl
+
+Offline, with the fake LLM and an embedded Qdrant seeded from the fixture corpus (--stub-models also
+replaces the cross-encoder with the benchmark stub):
+    python -m loadtest.replay capture.jsonl --local --stub-models -o main.jsonl
+    python -m loadtest.replay --diff main.jsonl branch.jsonl
+
+Against the fixture index, decisions differ from production ones by construction; compare two replays
+on the same index instead.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import importlib.util
+from collections import defaultdict
+import httpx
+from . import fake_llm
+from .seed import CORPUS_PATH
+from .run import API_PREFIX, percentile, start_local
+
+CAPTURE_MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "services", "capture.py")
+
+_capture = None
+
+
+def capture_module():
+    """
+    app/services/capture.py loaded by path: it only needs the standard library, while importing
+    it through the app package would load the whole backend (models, LangChain, logging setup).
+    """
+    global _capture
+    if _capture is None:
+        spec = importlib.util.spec_from_file_location("vimedical_capture", CAPTURE_MODULE_PATH)
+        _capture = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_capture)
+    return _capture
+
+# Outcome fields compared between the two runs; possible_diseases is compared as a set
+DECISION_FIELDS = ("intent", "decision", "disease", "tier", "ask_confirmation", "possible_diseases")
+QUANTILES = (50, 95, 99)
+
+
+def load_records(paths):
+    """
+    Records of one or more capture/replay JSONL files (rotated captures may be passed together),
+    keyed by (session, turn); a later file wins on duplicates.
+    """
+    records = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    records[(record["session"], record["turn"])] = record
+    return records
+
+
+def group_sessions(records):
+    sessions = defaultdict(list)
+    for session, turn in sorted(records):
+        sessions[session].append(records[(session, turn)])
+    return sessions
+
+
+async def replay_session(client, turns, results):
+    """
+    Send the captured turns of one session to a fresh session, in order, with a debug trace per turn.
+    A chain whose first captured turn is not the session's first starts from an empty state and is marked partial.
+    """
+    capture = capture_module()
+
+    response = await client.post(f"{API_PREFIX}/session/new")
+    response.raise_for_status()
+    session_id = response.json()["session_id"]
+    partial = turns[0]["turn"] > 0
+    symptoms = ""
+    for captured in turns:
+        record = {
+            "v": capture.CAPTURE_VERSION,
+            "session": captured["session"],
+            "turn": captured["turn"],
+            "query": captured["query"],
+            "previous_symptoms": symptoms,
+            "partial": partial,
+            "scrubbed": captured.get("scrubbed", False),
+            "replay": True
+        }
+        start = time.perf_counter()
+        try:
+            response = await client.post(
+                f"{API_PREFIX}/chat",
+                params={"debug": "true"},
+                json={"message": captured["query"], "session_id": session_id}
+            )
+            record["status"] = response.status_code
+        except httpx.HTTPError as e:
+            record["status"] = type(e).__name__
+        record["wall_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        if record["status"] == 200:
+            data = response.json()
+            stages, outcome = capture.summarize_trace(data.get("trace") or {})
+            outcome.setdefault("disease", "")
+            outcome.update(
+                tier=data.get("tier", "error"),
+                possible_diseases=data.get("possible_diseases", []),
+                ask_confirmation=data.get("ask_confirmation", False)
+            )
+            symptoms = data.get("symptoms", symptoms)
+            record.update(outcome=outcome, latency_ms=stages.get("chat_turn"), stages=stages)
+        results.append(record)
+
+
+async def replay(base_url, records, args):
+    sessions = group_sessions(records)
+    results = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(turns):
+        async with semaphore:
+            try:
+                await replay_session(client, turns, results)
+            except httpx.HTTPError as e:
+                print(f"❌ Không tạo được phiên cho {turns[0]['session']}: {e}")
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout) as client:
+        print(f"🔁 Replay {len(records)} lượt trong {len(sessions)} phiên tới {base_url} (concurrency={args.concurrency})")
+        await asyncio.gather(*(run(turns) for turns in sessions.values()))
+    return results
+
+
+def distribution(values):
+    values = sorted(v for v in values if v is not None)
+    stats = {f"p{q}": percentile(values, q) for q in QUANTILES}
+    stats["mean"] = round(sum(values) / len(values), 3) if values else None
+    stats["n"] = len(values)
+    return stats
+
+
+def _change(baseline, candidate):
+    if baseline is None or candidate is None or baseline <= 0:
+        return None
+    return candidate / baseline - 1
+
+
+def _depth(turn):
+    return str(turn) if turn < 3 else "3+"
+
+
+def compare_latency(pairs, key):
+    """
+    Latency distributions of both runs, grouped by key(baseline record, candidate record).
+    """
+    groups = defaultdict(lambda: ([], []))
+    for base, cand in pairs:
+        for name, value_base, value_cand in key(base, cand):
+            groups[name][0].append(value_base)
+            groups[name][1].append(value_cand)
+    return {name: (distribution(a), distribution(b)) for name, (a, b) in sorted(groups.items())}
+
+
+def _value(outcome, field):
+    value = outcome.get(field)
+    return sorted(value) if field == "possible_diseases" and value else value
+
+
+def _answered(record):
+    return record.get("status", 200) == 200 and "outcome" in record
+
+
+def _comparable(base, cand):
+    """
+    Decisions are compared only where both runs saw the same input: not for chains that started
+    mid-session, nor for scrubbed turns against the capture that saw the original text.
+    """
+    if base.get("partial") or cand.get("partial"):
+        return False
+    return not (base.get("scrubbed") and not base.get("replay"))
+
+
+def diff(baseline, candidate):
+    """
+    Pair the runs by (session, turn) and compare latency (overall, per stage, per intent, per turn depth)
+    and decision outcomes. Turns that failed in either run only count towards `failed`.
+    """
+    common = sorted(set(baseline) & set(candidate))
+    pairs = [(baseline[key], candidate[key]) for key in common if _answered(baseline[key]) and _answered(candidate[key])]
+
+    mismatches = defaultdict(int)
+    examples = []
+    compared = 0
+    for base, cand in pairs:
+        if not _comparable(base, cand):
+            continue
+        compared += 1
+        changed = [f for f in DECISION_FIELDS if _value(base["outcome"], f) != _value(cand["outcome"], f)]
+        for field in changed:
+            mismatches[field] += 1
+        if changed:
+            examples.append({
+                "session": base["session"],
+                "turn": base["turn"],
+                "query": base["query"],
+                "changed": {f: [base["outcome"].get(f), cand["outcome"].get(f)] for f in changed}
+            })
+
+    return {
+        "turns": {"baseline": len(baseline), "candidate": len(candidate), "paired": len(pairs),
+                  "failed": len(common) - len(pairs), "unmatched": len(set(baseline) ^ set(candidate))},
+        "latency": compare_latency(pairs, lambda b, c: [("chat_turn", b.get("latency_ms"), c.get("latency_ms"))]),
+        "stages": compare_latency(pairs, lambda b, c: [
+            (stage, b["stages"].get(stage), c["stages"].get(stage)) for stage in set(b["stages"]) & set(c["stages"])
+        ]),
+        "intents": compare_latency(pairs, lambda b, c: [
+            (b["outcome"].get("intent") or "-", b.get("latency_ms"), c.get("latency_ms"))
+        ]),
+        "depth": compare_latency(pairs, lambda b, c: [(_depth(b["turn"]), b.get("latency_ms"), c.get("latency_ms"))]),
+        "decisions": {
+            "compared": compared,
+            "changed": len(examples),
+            "change_rate": round(len(examples) / compared, 4) if compared else 0.0,
+            "by_field": dict(mismatches),
+            "examples": examples
+        }
+    }
+
+
+def print_diff(report, show):
+    def rows(title, groups):
+        print(f"\n{title}")
+        print(f"{'':<24}{'n':>6}" + "".join(f"{'p' + str(q):>11}{'Δ':>8}" for q in QUANTILES))
+        for name, (base, cand) in groups.items():
+            line = f"{name:<24}{cand['n']:>6}"
+            for q in QUANTILES:
+                value, change = cand[f"p{q}"], _change(base[f"p{q}"], cand[f"p{q}"])
+                line += f"{'-' if value is None else f'{value:.1f}':>11}{'-' if change is None else f'{change:+.0%}':>8}"
+            print(line)
+
+    print(f"\n📊 Lượt: {report['turns']}")
+    rows("⏱️ Độ trễ chat_turn (ms, ứng viên và thay đổi so với baseline)", report["latency"])
+    rows("Theo stage", report["stages"])
+    rows("Theo intent (của baseline)", report["intents"])
+    rows("Theo lượt trong phiên", report["depth"])
+
+    decisions = report["decisions"]
+    print(
+        f"\n🧭 Quyết định khác nhau: {decisions['changed']}/{decisions['compared']} "
+        f"({decisions['change_rate']:.1%}) {decisions['by_field']}"
+    )
+    for example in decisions["examples"][:show]:
+        print(f"  {example['session'][:8]}#{example['turn']} {example['query'][:60]!r}: {example['changed']}")
+
+
+def write_records(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in sorted(records, key=lambda r: (r["session"], r["turn"])):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured chat turns and diff latency and decisions")
+    parser.add_argument("capture", nargs="*", help="Capture JSONL file(s); rotated files may be passed together")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="Base URL of the build to replay against")
+    target.add_argument("--local", action="store_true", help="Run the API in-process against an embedded Qdrant and the fake LLM")
+    target.add_argument("--diff", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Only diff two capture/replay files")
+    parser.add_argument("--stub-models", action="store_true", help="With --local, use the deterministic benchmark cross-encoder")
+    parser.add_argument("--concurrency", type=int, default=1, help="Sessions replayed at once (1 keeps latencies comparable)")
+    parser.add_argument("--limit", type=int, default=None, help="Replay at most this many sessions")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="Fixture corpus JSON for the --local index")
+    parser.add_argument("--ready-timeout", type=float, default=600.0, help="Seconds to wait for model loading with --local")
+    parser.add_argument("--show", type=int, default=10, help="Changed decisions to print")
+    parser.add_argument("--max-slowdown", type=float, default=None, help="Exit 1 if chat_turn p95 grew by more than this fraction")
+    parser.add_argument("--max-changed", type=float, default=None, help="Exit 1 if more than this fraction of decisions changed")
+    parser.add_argument("-o", "--output", help="Write the replayed turns as JSONL (usable as a later --diff input)")
+    parser.add_argument("--report", help="Write the diff report as JSON")
+    fake_llm.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.diff:
+        baseline, candidate = load_records([args.diff[0]]), load_records([args.diff[1]])
+    else:
+        if not args.capture or not (args.url or args.local):
+            parser.error("give capture file(s) and --url or --local, or use --diff BASELINE CANDIDATE")
+        baseline = load_records(args.capture)
+        if args.limit:
+            keep = set(list(group_sessions(baseline))[:args.limit])
+            baseline = {key: record for key, record in baseline.items() if key[0] in keep}
+
+        servers, workdir = [], None
+        try:
+            if args.local:
+                before_app = None
+                if args.stub_models:
+                    from benchmarks import stubs
+                    before_app = stubs.install
+                base_url, servers, workdir, _ = start_local(args, before_app=before_app)
+            else:
+                base_url = args.url.rstrip("/")
+            results = asyncio.run(replay(base_url, baseline, args))
+        finally:
+            for server in servers:
+                server.should_exit = True
+            if workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+        if args.output:
+            write_records(args.output, results)
+            print(f"💾 Đã ghi {len(results)} lượt: {args.output}")
+        candidate = {(record["session"], record["turn"]): record for record in results}
+
+    report = diff(baseline, candidate)
+    print_diff(report, args.show)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failed = []
+    latency = report["latency"].get("chat_turn")
+    slowdown = _change(latency[0]["p95"], latency[1]["p95"]) if latency else None
+    if args.max_slowdown is not None and slowdown is not None and slowdown > args.max_slowdown:
+        failed.append(f"p95 chat_turn {slowdown:+.0%}")
+    if args.max_changed is not None and report["decisions"]["change_rate"] > args.max_changed:
+        failed.append(f"quyết định khác {report['decisions']['change_rate']:.1%}")
+    if report["turns"]["failed"]:
+        failed.append(f"{report['turns']['failed']} lượt lỗi")
+    if failed:
+        print(f"\n❌ {', '.join(failed)}")
+        sys.exit(1)
+    print("\n✅ Không vượt ngưỡng")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+Load test for the ViMedical API. Virtual users send a weighted mix of requests while their number
+follows a ramp profile; the report gives throughput and p50/p95/p99 latency per endpoint and per stage.
+
+Against a running server:
+    python -m loadtest.run --url http://localhost:8000 --mix chat=6,diagnose=3,messages=1 --ramp 10:30,10:60,40:60
+
+Fully offline: an embedded Qdrant seeded from the fixture corpus and the fake LLM server run in this process.
+    python -m loadtest.run --local --users 20 --duration 60 --llm-latency-ms 1500 --output report.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import Counter, defaultdict
+import httpx
+from . import fake_llm
+from .seed import CORPUS_PATH, load_corpus, seed
+
+API_PREFIX = "/api/v1"
+
+# Later turns of a conversation, sent after a fixture question opened it
+FOLLOW_UPS = [
+    "Tôi còn bị sốt nữa",
+    "Tôi cũng thấy buồn nôn và chóng mặt",
+    "Bệnh này có nguy hiểm không?",
+    "Tôi nên làm gì để giảm triệu chứng?",
+    "Bệnh này có lây không?"
+]
+
+DEFAULT_MIX = "chat=6,diagnose=3,messages=1"
+
+
+class LoadContext:
+    """
+    State shared by the virtual users: the HTTP client, the current user target and the recorded samples.
+    """
+
+    def __init__(self, client, questions, mix, args):
+        self.client = client
+        self.questions = questions
+        self.names = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.turns_per_session = args.turns
+        self.think_time = args.think_time
+        self.rng = random.Random(args.seed)
+        self.target_users = 0
+        self.stopped = False
+        self.started = time.perf_counter()
+        # (start offset, endpoint, latency seconds, status code or "timeout"/"error")
+        self.samples = []
+        self.tiers = Counter()
+
+    async def timed(self, endpoint, method, url, **kwargs):
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            outcome = response.status_code
+        except httpx.TimeoutException:
+            outcome = "timeout"
+        except httpx.HTTPError:
+            outcome = "error"
+        self.samples.append((start - self.started, endpoint, time.perf_counter() - start, outcome))
+        return response
+
+
+class UserState:
+    def __init__(self):
+        self.session_id = None
+        self.turns = 0
+        self.previous_symptoms = ""
+        self.etag = None
+
+
+async def new_session(ctx, state):
+    response = await ctx.timed("session_new", "POST", f"{API_PREFIX}/session/new")
+    if response is not None and response.status_code == 200:
+        state.session_id = response.json()["session_id"]
+        state.turns = 0
+        state.previous_symptoms = ""
+        state.etag = None
+    return state.session_id
+
+
+async def do_chat(ctx, state):
+    if state.session_id is None or state.turns >= ctx.turns_per_session:
+        if await new_session(ctx, state) is None:
+            return
+    message = ctx.rng.choice(ctx.questions) if state.turns == 0 else ctx.rng.choice(FOLLOW_UPS)
+    state.turns += 1
+    response = await ctx.timed("chat", "POST", f"{API_PREFIX}/chat", json={
+        "message": message,
+        "session_id": state.session_id,
+        "previous_symptoms": state.previous_symptoms
+    })
+    if response is not None and response.status_code == 200:
+        data = response.json()
+        state.previous_symptoms = data.get("symptoms", state.previous_symptoms)
+        ctx.tiers[data.get("tier", "llm")] += 1
+
+
+async def do_diagnose(ctx, state):
+    await ctx.timed("diagnose", "POST", f"{API_PREFIX}/diagnose", json={"message": ctx.rng.choice(ctx.questions)})
+
+
+async def do_messages(ctx, state):
+    if state.session_id is None and await new_session(ctx, state) is None:
+        return
+    headers = {"If-None-Match": state.etag} if state.etag else {}
+    response = await ctx.timed("messages", "GET", f"{API_PREFIX}/session/{state.session_id}/messages", headers=headers)
+    if response is not None and response.status_code == 200:
+        state.etag = response.headers.get("etag")
+
+
+async def do_health(ctx, state):
+    await ctx.timed("health", "GET", "/health")
+
+
+ACTIONS = {
+    "chat": do_chat,
+    "diagnose": do_diagnose,
+    "messages": do_messages,
+    "health": do_health
+}
+
+
+async def virtual_user(ctx, index):
+    state = UserState()
+    # Users above the current target finish their request in flight and leave
+    while not ctx.stopped and index < ctx.target_users:
+        action = ctx.rng.choices(ctx.names, weights=ctx.weights)[0]
+        await ACTIONS[action](ctx, state)
+        if ctx.think_time > 0:
+            await asyncio.sleep(ctx.rng.expovariate(1.0 / ctx.think_time))
+
+
+def parse_mix(spec):
+    mix = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise ValueError(f"Unknown endpoint '{name}' in mix (expected one of {', '.join(ACTIONS)})")
+        mix.append((name, float(weight or 1)))
+    if not mix or sum(weight for _, weight in mix) <= 0:
+        raise ValueError("Request mix must contain at least one endpoint with a positive weight")
+    return mix
+
+
+def parse_ramp(spec):
+    """
+    "10:30,10:60,40:60" -> [(10, 30.0), (10, 60.0), (40, 60.0)]: each stage moves the number of users
+    linearly from the previous stage's level (0 at the start) to its own over its duration.
+    """
+    stages = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        users, _, seconds = item.partition(":")
+        stages.append((int(users), float(seconds)))
+    if not stages:
+        raise ValueError("Ramp profile must contain at least one stage")
+    return stages
+
+
+def target_users(stages, elapsed):
+    level, start = 0, 0.0
+    for users, seconds in stages:
+        if elapsed < start + seconds:
+            return round(level + (users - level) * (elapsed - start) / seconds)
+        level, start = users, start + seconds
+    return level
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(q / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def summarize(samples, duration):
+    latencies = sorted(latency for _, _, latency, outcome in samples if isinstance(outcome, int) and outcome < 400)
+    outcomes = Counter(outcome for _, _, _, outcome in samples)
+    rejected = outcomes[429] + outcomes[503]
+    return {
+        "requests": len(samples),
+        "ok": len(latencies),
+        "rejected": rejected,
+        "errors": len(samples) - len(latencies) - rejected,
+        "throughput_rps": round(len(latencies) / duration, 2) if duration > 0 else 0.0,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(latencies[-1] if latencies else None),
+        "status": {str(outcome): count for outcome, count in sorted(outcomes.items(), key=lambda item: str(item[0]))}
+    }
+
+
+def build_report(ctx, stages, duration):
+    by_endpoint = defaultdict(list)
+    for sample in ctx.samples:
+        by_endpoint[sample[1]].append(sample)
+
+    stage_reports = []
+    level, start = 0, 0.0
+    for users, seconds in stages:
+        if seconds > 0:
+            window = [sample for sample in ctx.samples if start <= sample[0] < start + seconds]
+            stage_reports.append({"users": f"{level}->{users}", "seconds": seconds, **summarize(window, seconds)})
+        level, start = users, start + seconds
+
+    return {
+        "duration_seconds": round(duration, 2),
+        "overall": summarize(ctx.samples, duration),
+        "endpoints": {name: summarize(samples, duration) for name, samples in sorted(by_endpoint.items())},
+        "stages": stage_reports,
+        "chat_tiers": dict(ctx.tiers)
+    }
+
+
+def print_report(report):
+    columns = ("requests", "ok", "rejected", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    header = f"{'':<16}" + "".join(f"{name.replace('throughput_', ''):>10}" for name in columns)
+
+    def row(label, stats):
+        return f"{label:<16}" + "".join(f"{'-' if stats[name] is None else stats[name]:>10}" for name in columns)
+
+    print(f"\n📊 Kết quả sau {report['duration_seconds']}s")
+    print(header)
+    for name, stats in report["endpoints"].items():
+        print(row(name, stats))
+    print(row("TOTAL", report["overall"]))
+    if report["stages"]:
+        print("\n📈 Theo từng stage")
+        print(header)
+        for stage in report["stages"]:
+            print(row(f"{stage['users']} ({stage['seconds']:g}s)", stage))
+    if report["chat_tiers"]:
+        print(f"\nChat tiers: {report['chat_tiers']}")
+    if "llm" in report:
+        print(f"Fake LLM: {report['llm']}")
+
+
+async def run_load(base_url, stages, mix, args):
+    questions = [q for qs in load_corpus(args.corpus)["questions"].values() for q in qs]
+    max_users = max(users for users, _ in stages)
+    limits = httpx.Limits(max_connections=max_users, max_keepalive_connections=max_users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        ctx = LoadContext(client, questions, mix, args)
+        total = sum(seconds for _, seconds in stages)
+        users = {}
+        while True:
+            elapsed = time.perf_counter() - ctx.started
+            if elapsed >= total:
+                break
+            ctx.target_users = target_users(stages, elapsed)
+            for index in range(ctx.target_users):
+                if index not in users or users[index].done():
+                    users[index] = asyncio.ensure_future(virtual_user(ctx, index))
+            await asyncio.sleep(0.1)
+        ctx.stopped = True
+        # Requests still in flight are recorded, but only those started within the profile count per stage
+        await asyncio.gather(*users.values())
+        return build_report(ctx, stages, total)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(app, port, timeout=30.0):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name=f"loadtest-server-{port}", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError(f"Server on port {port} failed to start")
+        time.sleep(0.05)
+    return server
+
+
+def wait_ready(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(f"{base_url}/ready", timeout=5)
+            if response.status_code == 200:
+                return
+            components = response.json().get("components", {})
+            if any(component.get("status") == "failed" for component in components.values()):
+                raise RuntimeError(f"API failed to initialize: {components}")
+        except httpx.HTTPError:
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"API not ready after {timeout}s")
+
+
+def start_local(args, before_app=None):
+    """
+    Seed an embedded Qdrant, start the fake LLM and the API in background threads, and
+    return (base_url, servers, workdir, llm_url). Models must already be in the local Hugging Face cache.
+    before_app, if given, runs once the environment is configured and before the app is imported.
+    """
+    workdir = tempfile.mkdtemp(prefix="vimedical-loadtest-")
+    qdrant_path = os.path.join(workdir, "qdrant")
+
+    fake_llm.configure(args)
+    llm_port = free_port()
+    servers = [start_server(fake_llm.app, llm_port)]
+
+    # Service modules read their configuration at import time, so this must precede importing the app
+    os.environ.update(
+        QDRANT_PATH=qdrant_path,
+        LLM_BASE_URL=f"http://127.0.0.1:{llm_port}/v1",
+        OPENROUTER_API_KEY="loadtest"
+    )
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    print(f"🌱 Seeding embedded Qdrant: {seed(qdrant_path, args.corpus)}")
+    if before_app:
+        before_app()
+
+    from app.main import app
+
+    api_port = free_port()
+    servers.append(start_server(app, api_port))
+    base_url = f"http://127.0.0.1:{api_port}"
+    print(f"⏳ Chờ API sẵn sàng tại {base_url} ...")
+    wait_ready(base_url, args.ready_timeout)
+    return base_url, servers, workdir, f"http://127.0.0.1:{llm_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the ViMedical API")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running API")
+    target.add_argument("--local", action="store_true", help="Run the API in-process against an embedded Qdrant and the fake LLM")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Weighted endpoint mix over {', '.join(ACTIONS)}")
+    parser.add_argument("--ramp", help="Ramp profile 'users:seconds,...'; overrides --users/--duration")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent virtual users (without --ramp)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Test length in seconds (without --ramp)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between a user's requests, in seconds")
+    parser.add_argument("--turns", type=int, default=3, help="Chat turns per session before a user starts a new one")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the request mix")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="Fixture corpus JSON (messages, and the --local index)")
+    parser.add_argument("--ready-timeout", type=float, default=600.0, help="Seconds to wait for model loading with --local")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    fake_llm.add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+        stages = parse_ramp(args.ramp) if args.ramp else [(args.users, 0.0), (args.users, args.duration)]
+    except ValueError as e:
+        parser.error(str(e))
+
+    servers, workdir, llm_url = [], None, None
+    try:
+        if args.local:
+            base_url, servers, workdir, llm_url = start_local(args)
+        else:
+            base_url = args.url.rstrip("/")
+        print(f"🚀 {base_url}: mix={args.mix}, stages={stages}")
+        report = asyncio.run(run_load(base_url, stages, mix, args))
+        if llm_url:
+            report["llm"] = httpx.get(f"{llm_url}/stats", timeout=5).json()
+    finally:
+        for server in servers:
+            server.should_exit = True
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if report["overall"]["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
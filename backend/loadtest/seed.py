@@ -0,0 +1,85 @@
+"""
+Build an embedded Qdrant index from the fixture corpus, for running the API without Qdrant Cloud.
+
+    python -m loadtest.seed --path .qdrant-loadtest
+    QDRANT_PATH=.qdrant-loadtest python run.py
+"""
+import os
+import json
+import time
+import argparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "corpus.json")
+VECTOR_SIZE = 384
+
+
+def load_corpus(path=CORPUS_PATH):
+    """
+    Fixture corpus: {"questions": {disease: [question, ...]}, "information": [chunk, ...]},
+    chunks already in the shape create_index.extract_chunks produces.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def question_items(corpus):
+    return [
+        {"text": q, "metadata": {"disease": disease, "source": "questions_merged", "type": "question"}}
+        for disease, questions in corpus["questions"].items()
+        for q in questions
+    ]
+
+
+def seed(path, corpus_path=CORPUS_PATH):
+    """
+    (Re)create both collections under `path` and return the number of points in each.
+    The embedded store holds a file lock, so this must run before the API opens the same path.
+    """
+    from qdrant_client import QdrantClient
+    from qdrant_client.http.models import Distance, VectorParams, PointStruct
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from app.services.rag_chain import EMBEDDING_MODEL, COLLECTION_QUESTIONS, COLLECTION_INFORMATION
+
+    corpus = load_corpus(corpus_path)
+    embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    client = QdrantClient(path=path)
+    counts = {}
+    try:
+        for collection_name, items in (
+            (COLLECTION_QUESTIONS, question_items(corpus)),
+            (COLLECTION_INFORMATION, corpus["information"])
+        ):
+            start = time.perf_counter()
+            client.recreate_collection(
+                collection_name=collection_name,
+                vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE)
+            )
+            vectors = embedding.embed_documents([item["text"] for item in items])
+            client.upsert(
+                collection_name=collection_name,
+                points=[
+                    PointStruct(id=i, vector=vector, payload={"text": item["text"], "metadata": item["metadata"]})
+                    for i, (item, vector) in enumerate(zip(items, vectors))
+                ]
+            )
+            counts[collection_name] = len(items)
+            logger.info(f"✅ {collection_name}: {len(items)} điểm sau {time.perf_counter() - start:.1f}s")
+    finally:
+        client.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed an embedded Qdrant index from the load-test fixture corpus")
+    parser.add_argument("--path", default=".qdrant-loadtest", help="Directory for the embedded Qdrant data")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="Fixture corpus JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(seed(args.path, args.corpus), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
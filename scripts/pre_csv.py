@@ -1,18 +1,44 @@
-import pandas as pd
+import argparse
 import json
+import pandas as pd
+
+INPUT_FILE = "data/ViMedical_Disease.csv"
+JSON_OUTPUT = "scripts/questions_merged.json"
+PARQUET_OUTPUT = "scripts/questions_merged.parquet"
+
+
+def load_questions(path):
+    df = pd.read_csv(path, usecols=["Disease", "Question"], dtype=str).dropna()
+
+    # Normalize whitespace/unicode and drop per-disease duplicates in one vectorized pass
+    df["Disease"] = df["Disease"].str.normalize("NFC").str.replace(r"\s+", " ", regex=True).str.strip()
+    df["Question"] = (
+        df["Question"].str.normalize("NFC").str.replace(r"\s+", " ", regex=True).str.strip()
+    )
+    df = df[(df["Disease"] != "") & (df["Question"] != "")]
+    df = df.assign(key=df["Question"].str.lower()).drop_duplicates(subset=["Disease", "key"])
+    return df.drop(columns="key").rename(columns={"Disease": "disease", "Question": "question"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group ViMedical questions by disease")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--format", choices=["json", "parquet", "both"], default="both")
+    args = parser.parse_args()
 
-df = pd.read_csv("data/ViMedical_Disease.csv")
+    df = load_questions(args.input)
+    n_diseases = df["disease"].nunique()
 
-disease_questions = {}
-for _, row in df.iterrows():
-    disease = row["Disease"]
-    question = row["Question"]
+    if args.format in ("parquet", "both"):
+        df.to_parquet(PARQUET_OUTPUT, index=False)
+        print(f"✅ Saved {PARQUET_OUTPUT} with {len(df)} questions.")
 
-    if disease not in disease_questions:
-        disease_questions[disease] = []
-    disease_questions[disease].append(question)
+    if args.format in ("json", "both"):
+        disease_questions = df.groupby("disease", sort=False)["question"].agg(list).to_dict()
+        with open(JSON_OUTPUT, "w", encoding="utf-8") as f:
+            json.dump(disease_questions, f, ensure_ascii=False)
+        print(f"✅ Saved {JSON_OUTPUT} with {n_diseases} diseases.")
 
-with open("scripts/questions_merged.json", "w", encoding="utf-8") as f:
-    json.dump(disease_questions, f, ensure_ascii=False, indent=2)
 
-print(f"✅ Saved questions_merged.json with {len(disease_questions)} diseases.")
+if __name__ == "__main__":
+    main()
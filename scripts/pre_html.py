@@ -1,10 +1,20 @@
 import os
 import json
+import hashlib
+from multiprocessing import Pool
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
 INPUT_FOLDER = "data/Corpus"
-OUTPUT_FILE = "scripts/clean_chunks.json"
+OUTPUT_FILE = "scripts/clean_chunks.jsonl"
+STATE_FILE = "scripts/clean_chunks.state.json"
+WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
 CHUNK_WORDS = 150
 EXCLUDE_KEYWORDS = ["HỆ THỐNG BỆNH VIỆN", "Fanpage", "Hotline", "Website", "Đặt lịch hẹn", "Mục lục"]
 
@@ -22,7 +32,7 @@ def parse_html_file(path, source_name):
     with open(path, 'r', encoding='utf-8') as f:
         html_content = f.read()
 
-    soup = BeautifulSoup(html_content, 'html.parser')
+    soup = BeautifulSoup(html_content, HTML_PARSER)
 
     root = {
         "source": source_name,
@@ -66,20 +76,92 @@ def parse_html_file(path, source_name):
     return root
 
 
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_unchanged(path, entry):
+    if not entry:
+        return False
+    stat = os.stat(path)
+    if entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+        return True
+    # Touched but not modified: refresh mtime so the next run skips the hash
+    if file_hash(path) == entry["sha256"]:
+        entry["mtime"], entry["size"] = stat.st_mtime, stat.st_size
+        return True
+    return False
+
+
+def parse_worker(fname):
+    path = os.path.join(INPUT_FOLDER, fname)
+    stat = os.stat(path)
+    result = parse_html_file(path, source_name=fname)
+    fingerprint = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": file_hash(path)}
+    # Serialize in the worker so the parent only writes lines
+    return fname, json.dumps(result, ensure_ascii=False), fingerprint
+
+
+def previous_records(path):
+    """
+    Stream (source, line) pairs from a previous output file, one line at a time.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line).get("source") or "", line.rstrip("\n")
+
+
 def process_all_html():
     os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    all_data = []
 
     files = sorted(f for f in os.listdir(INPUT_FOLDER) if f.endswith(".html"))
-    print(f"📁 Đang xử lý {len(files)} file HTML...")
-
-    for fname in tqdm(files):
-        path = os.path.join(INPUT_FOLDER, fname)
-        result = parse_html_file(path, source_name=fname)
-        all_data.append(result)
-
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
+    state = load_state() if os.path.exists(OUTPUT_FILE) else {}
+    unchanged = {f for f in files if is_unchanged(os.path.join(INPUT_FOLDER, f), state.get(f))}
+    pending = [f for f in files if f not in unchanged]
+    print(f"📁 Đang xử lý {len(pending)} file HTML ({len(unchanged)} không đổi, parser: {HTML_PARSER})...")
+
+    new_state = {f: state[f] for f in unchanged}
+    tmp_file = f"{OUTPUT_FILE}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as out, Pool(processes=max(WORKERS, 1)) as pool:
+        # Ordered imap yields parsed files in `pending` order, which follows `files`, so the
+        # output is sorted by source file whichever files were reparsed
+        parsed = pool.imap(parse_worker, pending, chunksize=8)
+        previous = previous_records(OUTPUT_FILE) if unchanged else iter(())
+        record = next(previous, None)
+        progress = tqdm(total=len(pending))
+        for fname in files:
+            if fname in unchanged:
+                # The previous output is sorted too: skip records of changed or deleted files
+                while record is not None and record[0] < fname:
+                    record = next(previous, None)
+                if record is not None and record[0] == fname:
+                    out.write(record[1] + "\n")
+                    record = next(previous, None)
+                    continue
+                # Its record is missing from the previous output (or out of order): parse it again
+                _, line, fingerprint = parse_worker(fname)
+            else:
+                _, line, fingerprint = next(parsed)
+                progress.update()
+            out.write(line + "\n")
+            new_state[fname] = fingerprint
+        progress.close()
+
+    os.replace(tmp_file, OUTPUT_FILE)
+    with open(STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(new_state, f, ensure_ascii=False)
 
     print(f"\n✅ Hoàn tất! Đã lưu kết quả vào {OUTPUT_FILE}")
 
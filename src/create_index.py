@@ -3,10 +3,20 @@ import logging
 from dotenv import load_dotenv
 import json
 import uuid
+import hashlib
+import argparse
+import time
+import queue
+import threading
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
+from qdrant_client.http.models import (
+    Distance, VectorParams, PointStruct, PointIdsList,
+    CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation
+)
 from sentence_transformers import SentenceTransformer
+import pyarrow.parquet as pq
 from tqdm import tqdm
+from dedup import dedupe_chunks
 
 # Load environment variables
 load_dotenv()
@@ -19,13 +29,26 @@ if not QDRANT_URL or not QDRANT_API_KEY:
     raise ValueError("⚠️ QDRANT_URL hoặc QDRANT_API_KEY không được cấu hình trong .env")
 
 # File paths
-CLEAN_CHUNKS_PATH = "D:/Vimedical/scripts/clean_chunks.json"
+CLEAN_CHUNKS_PATH = "D:/Vimedical/scripts/clean_chunks.jsonl"
 QUESTIONS_PATH = "D:/Vimedical/scripts/questions_merged.json"
+QUESTIONS_PARQUET_PATH = "D:/Vimedical/scripts/questions_merged.parquet"
+MANIFEST_PATH = "D:/Vimedical/scripts/index_manifest.json"
 
-# Collection names
+# Collection names (served to the API as Qdrant aliases)
 COLLECTION_QUESTIONS = "vimedical-questions"
 COLLECTION_INFORMATION = "vimedical-information"
 
+# Ingest pipeline tuning
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "100"))
+ENCODE_PROCESSES = int(os.getenv("INGEST_ENCODE_PROCESSES", "1"))
+UPLOAD_WORKERS = int(os.getenv("INGEST_UPLOAD_WORKERS", "4"))
+QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+# Seconds to wait for Qdrant to apply acknowledged (wait=False) upserts before giving up
+APPLY_TIMEOUT = float(os.getenv("INGEST_APPLY_TIMEOUT", "300"))
+
+# Near-duplicate chunk elimination (estimated Jaccard over word shingles)
+DEDUP_THRESHOLD = float(os.getenv("INGEST_DEDUP_THRESHOLD", "0.85"))
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -38,13 +61,20 @@ qdrant_client = QdrantClient(
     check_compatibility=False
 )
 
-# Load embedding model
-try:
-    model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-    logger.info("✅ Mô hình SentenceTransformer đã được tải thành công!")
-except Exception as e:
-    logger.error(f"❌ Lỗi khi tải mô hình SentenceTransformer: {e}")
-    raise
+# Embedding model, loaded on first use so that encoder worker processes
+# (which re-import this module) do not each load a copy.
+model = None
+
+def get_model():
+    global model
+    if model is None:
+        try:
+            model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
+            logger.info("✅ Mô hình SentenceTransformer đã được tải thành công!")
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi tải mô hình SentenceTransformer: {e}")
+            raise
+    return model
 
 # Normalize disease name
 def normalize_disease_name(disease_name):
@@ -52,9 +82,21 @@ def normalize_disease_name(disease_name):
     normalized = " ".join(word.capitalize() for word in normalized.split())
     return normalized
 
-# Load JSON file
+# Stream records from a JSON Lines file
+def iter_jsonl_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+# Load JSON file (.jsonl files are returned as a lazy iterator)
 def load_json_file(path):
     try:
+        if path.endswith(".jsonl"):
+            if os.path.getsize(path) == 0:
+                raise ValueError(f"⚠️ File {path} rỗng.")
+            return iter_jsonl_file(path)
         with open(path, "r", encoding="utf-8") as f:
             data = json.load(f)
             if not data:
@@ -64,6 +106,17 @@ def load_json_file(path):
         logger.error(f"❌ Lỗi khi tải file {path}: {e}")
         raise
 
+# Load (disease, question) pairs from the columnar cache written by pre_csv.py
+def load_questions_parquet(path):
+    try:
+        table = pq.read_table(path, columns=["disease", "question"])
+        if table.num_rows == 0:
+            raise ValueError(f"⚠️ File {path} rỗng.")
+        return list(zip(table.column("disease").to_pylist(), table.column("question").to_pylist()))
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi tải file {path}: {e}")
+        raise
+
 # Remove advertisements
 def remove_ads(text):
     ad_keywords = ["hotline", "liên hệ", "bệnh viện", "đăng ký", "ưu đãi", "giảm giá","Fangpage", "website", "đặt lịch hẹn", "mục lục"]
@@ -105,24 +158,75 @@ def extract_chunks(data):
                     })
     return chunks
 
-# Extract questions
+# Extract questions from a {disease: [questions]} dict or a list of (disease, question) pairs
 def extract_questions(data):
+    if isinstance(data, dict):
+        data = [(disease, q) for disease, qs in data.items() for q in qs]
     questions = []
-    for disease, qs in tqdm(data.items(), desc="Extracting questions"):
-        disease = normalize_disease_name(disease)
-        for q in qs:
-            q_clean = q.strip()
-            if len(q_clean.split()) > 5 and remove_ads(q_clean):
-                questions.append({
-                    "text": q_clean,
-                    "metadata": {
-                        "disease": disease,
-                        "source": "questions_merged",
-                        "type": "question"
-                    }
-                })
+    normalized = {}
+    for disease, q in tqdm(data, desc="Extracting questions"):
+        if disease not in normalized:
+            normalized[disease] = normalize_disease_name(disease)
+        q_clean = q.strip()
+        if len(q_clean.split()) > 5 and remove_ads(q_clean):
+            questions.append({
+                "text": q_clean,
+                "metadata": {
+                    "disease": normalized[disease],
+                    "source": "questions_merged",
+                    "type": "question"
+                }
+            })
     return questions
 
+# Deterministic point id derived from the text and metadata
+def point_id(item):
+    content = json.dumps({"text": item["text"], "metadata": item["metadata"]}, ensure_ascii=False, sort_keys=True)
+    return str(uuid.UUID(hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]))
+
+# Load manifest of indexed point ids per alias
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# Physical collection currently behind an alias
+def resolve_alias(alias):
+    for description in qdrant_client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+# Atomically point alias at collection_name, then drop the collection it replaced
+def switch_alias(alias, collection_name):
+    previous = resolve_alias(alias)
+    legacy = previous is None and alias in [c.name for c in qdrant_client.get_collections().collections]
+
+    # Delete-old and create-new alias operations go in one call, so readers always resolve the alias
+    operations = []
+    if previous is not None:
+        operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias)))
+    operations.append(CreateAliasOperation(create_alias=CreateAlias(collection_name=collection_name, alias_name=alias)))
+    if legacy:
+        # One-time migration from the old layout where the collection itself carried the alias name.
+        # Qdrant refuses an alias named like an existing collection, so the delete must come first;
+        # it runs right before the alias call, once the new collection is complete.
+        logger.warning(f"⚠️ Collection {alias} trùng tên alias, xóa để chuyển sang alias")
+        qdrant_client.delete_collection(alias)
+    qdrant_client.update_collection_aliases(change_aliases_operations=operations)
+    logger.info(f"🔀 Alias {alias} -> {collection_name}")
+
+    if previous is not None and previous != collection_name:
+        logger.info(f"🧹 Xóa collection cũ: {previous}")
+        qdrant_client.delete_collection(previous)
+
 # Create collection with index
 def create_collection_with_index(collection_name):
     try:
@@ -143,6 +247,11 @@ def create_collection_with_index(collection_name):
             field_name="metadata.disease",
             field_type="keyword"
         )
+        qdrant_client.create_payload_index(
+            collection_name=collection_name,
+            field_name="metadata.diseases",
+            field_type="keyword"
+        )
         qdrant_client.create_payload_index(
             collection_name=collection_name,
             field_name="metadata.section_title",
@@ -159,52 +268,214 @@ def create_collection_with_index(collection_name):
         logger.error(f"❌ Lỗi khi tạo collection {collection_name}: {e}")
         raise
 
-# Embed and upsert
-def embed_and_upsert(texts, collection_name, batch_size=100):
+# Encode texts, using the multi-process pool when one is running
+def encode_texts(texts, pool=None, batch_size=BATCH_SIZE):
+    encoder = get_model()
+    if pool is not None:
+        return encoder.encode_multi_process(texts, pool, batch_size=batch_size)
+    return encoder.encode(texts, batch_size=batch_size, show_progress_bar=False)
+
+# Upload worker: drains the queue until it receives the stop sentinel
+def upsert_worker(collection_name, batches, stats, errors, progress):
+    while True:
+        points = batches.get()
+        try:
+            if points is None:
+                return
+            if errors:
+                continue
+            start = time.perf_counter()
+            qdrant_client.upsert(collection_name=collection_name, points=points, wait=False)
+            elapsed = time.perf_counter() - start
+            with stats["lock"]:
+                stats["upload_seconds"] += elapsed
+                stats["uploaded"] += len(points)
+            progress.update(len(points))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            batches.task_done()
+
+# Embed and upsert: encoding (producer) and uploads (consumers) overlap through a bounded queue
+def embed_and_upsert(texts, collection_name, batch_size=BATCH_SIZE, encode_processes=ENCODE_PROCESSES,
+                     upload_workers=UPLOAD_WORKERS, queue_size=QUEUE_SIZE):
     if not texts:
         logger.warning(f"⚠️ Không có dữ liệu để upsert vào {collection_name}.")
-        return
+        return None
+
+    stats = {"lock": threading.Lock(), "encoded": 0, "uploaded": 0, "encode_seconds": 0.0, "upload_seconds": 0.0}
+    errors = []
+    batches = queue.Queue(maxsize=queue_size)
+    pool = None
+    if encode_processes > 1:
+        pool = get_model().start_multi_process_pool(["cpu"] * encode_processes)
+    # Each encode call covers several upload batches so worker processes stay busy
+    group_size = batch_size * max(encode_processes, 1)
 
+    progress = tqdm(total=len(texts), desc=f"Upserting {collection_name}", unit="pt")
+    workers = [
+        threading.Thread(target=upsert_worker, args=(collection_name, batches, stats, errors, progress), daemon=True)
+        for _ in range(max(upload_workers, 1))
+    ]
+    for worker in workers:
+        worker.start()
+
+    started = time.perf_counter()
     try:
-        for i in tqdm(range(0, len(texts), batch_size), desc=f"Upserting {collection_name}"):
-            batch = texts[i:i + batch_size]
-            vectors = model.encode([item["text"] for item in batch], show_progress_bar=False)
-            points = [
-                PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=vec.tolist(),
-                    payload={
-                        "text": item["text"],
-                        "metadata": item["metadata"]
-                    }
-                ) for item, vec in zip(batch, vectors)
-            ]
-            qdrant_client.upsert(collection_name=collection_name, points=points)
-            logger.info(f"✅ Uploaded {len(points)} points to {collection_name}")
-    except Exception as e:
-        logger.error(f"❌ Lỗi khi upsert vào collection {collection_name}: {e}")
-        raise
+        for i in range(0, len(texts), group_size):
+            if errors:
+                break
+            group = texts[i:i + group_size]
+            encode_start = time.perf_counter()
+            vectors = encode_texts([item["text"] for item in group], pool=pool, batch_size=batch_size)
+            stats["encode_seconds"] += time.perf_counter() - encode_start
+            stats["encoded"] += len(group)
+
+            for j in range(0, len(group), batch_size):
+                points = [
+                    PointStruct(
+                        id=point_id(item),
+                        vector=vec.tolist(),
+                        payload={
+                            "text": item["text"],
+                            "metadata": item["metadata"]
+                        }
+                    ) for item, vec in zip(group[j:j + batch_size], vectors[j:j + batch_size])
+                ]
+                # Blocks when uploads fall behind, bounding memory use
+                batches.put(points)
+    finally:
+        for _ in workers:
+            batches.put(None)
+        for worker in workers:
+            worker.join()
+        progress.close()
+        if pool is not None:
+            get_model().stop_multi_process_pool(pool)
+
+    if errors:
+        logger.error(f"❌ Lỗi khi upsert vào collection {collection_name}: {errors[0]}")
+        raise errors[0]
+
+    elapsed = time.perf_counter() - started
+    del stats["lock"]
+    stats["total_seconds"] = elapsed
+    stats["points_per_second"] = stats["uploaded"] / elapsed if elapsed else 0.0
+    logger.info(
+        f"✅ Uploaded {stats['uploaded']} points to {collection_name} in {elapsed:.1f}s "
+        f"({stats['points_per_second']:.1f} pt/s; encode {stats['encode_seconds']:.1f}s, "
+        f"upload {stats['upload_seconds']:.1f}s across {len(workers)} workers)"
+    )
+    return stats
+
+# Block until Qdrant has applied every acknowledged write: upserts are sent with wait=False,
+# so a failure on the server side only shows up as missing points
+def wait_for_points(collection_name, expected, timeout=APPLY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while True:
+        count = qdrant_client.count(collection_name=collection_name, exact=True).count
+        if count == expected:
+            return
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"⚠️ {collection_name} có {count} điểm sau {timeout:.0f}s, cần {expected}")
+        time.sleep(1)
+
+# Ids of every point stored in a collection
+def collection_point_ids(collection_name, batch_size=BATCH_SIZE):
+    ids = set()
+    offset = None
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name=collection_name, limit=batch_size, offset=offset,
+            with_payload=False, with_vectors=False
+        )
+        ids.update(str(point.id) for point in points)
+        if offset is None:
+            return ids
+
+# Full rebuild into a fresh collection, switched in behind the alias once complete
+def rebuild_collection(alias, items, manifest):
+    collection_name = f"{alias}-{time.strftime('%Y%m%d%H%M%S')}"
+    points = sorted({point_id(item) for item in items})
+    create_collection_with_index(collection_name)
+    embed_and_upsert(items, collection_name)
+    # The alias must only move once every write is applied, or the API could read a half-built index
+    wait_for_points(collection_name, len(points))
+    switch_alias(alias, collection_name)
+    manifest[alias] = {"collection": collection_name, "points": points}
+
+# Incremental sync: embed only new or changed items and delete vanished ones
+def sync_collection(alias, items, manifest, batch_size=BATCH_SIZE):
+    entry = manifest.get(alias)
+    collection_name = resolve_alias(alias)
+    if not entry or collection_name is None or entry.get("collection") != collection_name:
+        logger.warning(f"⚠️ Manifest không khớp với alias {alias}, chuyển sang xây dựng lại toàn bộ.")
+        rebuild_collection(alias, items, manifest)
+        return
+
+    # Reconcile against what the collection actually holds: a sync that crashed before saving
+    # the manifest can leave points the manifest does not know about
+    indexed = collection_point_ids(collection_name)
+    unrecorded = len(indexed - set(entry["points"]))
+    if unrecorded:
+        logger.warning(f"⚠️ {alias}: {unrecorded} điểm không có trong manifest")
+    current = {point_id(item): item for item in items}
+    added = [item for pid, item in current.items() if pid not in indexed]
+    vanished = sorted(indexed - current.keys())
+    logger.info(f"🔍 {alias}: {len(added)} mới/thay đổi, {len(vanished)} bị xóa, {len(current) - len(added)} giữ nguyên")
+
+    embed_and_upsert(added, collection_name)
+    for i in range(0, len(vanished), batch_size):
+        qdrant_client.delete(
+            collection_name=collection_name,
+            points_selector=PointIdsList(points=vanished[i:i + batch_size])
+        )
+    wait_for_points(collection_name, len(current))
+    manifest[alias] = {"collection": collection_name, "points": sorted(current)}
+
+# Questions as written by scripts/pre_csv.py; "auto" picks whichever output is newer
+def load_questions_data(fmt="auto"):
+    if fmt == "auto":
+        candidates = [p for p in (QUESTIONS_PARQUET_PATH, QUESTIONS_PATH) if os.path.exists(p)]
+        if not candidates:
+            raise FileNotFoundError(f"⚠️ Không tìm thấy {QUESTIONS_PATH} hoặc {QUESTIONS_PARQUET_PATH}")
+        fmt = "parquet" if max(candidates, key=os.path.getmtime) == QUESTIONS_PARQUET_PATH else "json"
+    logger.info(f"📄 Đọc câu hỏi từ {fmt}")
+    if fmt == "parquet":
+        return load_questions_parquet(QUESTIONS_PARQUET_PATH)
+    return load_json_file(QUESTIONS_PATH)
 
 def main():
+    parser = argparse.ArgumentParser(description="Build the ViMedical Qdrant index")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only embed new/changed items and delete vanished ones, based on the manifest")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="similarity above which chunks are merged as near-duplicates (0 disables)")
+    parser.add_argument("--questions-format", choices=["auto", "json", "parquet"], default="auto",
+                        help="questions file to read; auto uses the most recently written one")
+    args = parser.parse_args()
+
     try:
         chunks_data = load_json_file(CLEAN_CHUNKS_PATH)
-        questions_data = load_json_file(QUESTIONS_PATH)
+        questions_data = load_questions_data(args.questions_format)
 
-        # Extract chunks (without deduplication)
+        # Extract chunks and merge near-duplicate boilerplate
         chunks = extract_chunks(chunks_data)
         logger.info(f"✅ Extracted {len(chunks)} chunks.")
+        if args.dedup_threshold > 0:
+            chunks, _ = dedupe_chunks(chunks, threshold=args.dedup_threshold)
 
         # Extract questions
         questions = extract_questions(questions_data)
         logger.info(f"✅ Extracted {len(questions)} questions.")
 
-        # Create collections
-        create_collection_with_index(COLLECTION_INFORMATION)
-        create_collection_with_index(COLLECTION_QUESTIONS)
-
-        # Upsert data
-        embed_and_upsert(chunks, COLLECTION_INFORMATION, batch_size=100)
-        embed_and_upsert(questions, COLLECTION_QUESTIONS, batch_size=100)
+        manifest = load_manifest()
+        for alias, items in ((COLLECTION_INFORMATION, chunks), (COLLECTION_QUESTIONS, questions)):
+            if args.incremental:
+                sync_collection(alias, items, manifest)
+            else:
+                rebuild_collection(alias, items, manifest)
+            save_manifest(manifest)
 
         logger.info(f"✅ Đã xử lý tổng cộng {len(chunks)} thông tin và {len(questions)} câu hỏi.")
     except Exception as e:
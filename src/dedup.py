@@ -0,0 +1,123 @@
+import re
+import hashlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Universal hashing over a Mersenne prime keeps all products inside uint64
+MERSENNE_PRIME = (1 << 31) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def shingles(text, size=5):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def hash_shingle(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+class MinHasher:
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text, shingle_size=5):
+        values = np.array([hash_shingle(s) for s in shingles(text, shingle_size)], dtype=np.uint64)
+        values %= MERSENNE_PRIME
+        # (num_perm, num_shingles) permuted hashes; the minimum per row is the signature
+        permuted = (np.outer(self.a, values) + self.b[:, None]) % MERSENNE_PRIME
+        return permuted.min(axis=1) & MAX_HASH
+
+
+def estimate_similarity(sig_a, sig_b):
+    return float(np.mean(sig_a == sig_b))
+
+
+def lsh_params(threshold, num_perm):
+    """
+    Pick (bands, rows) whose S-curve crosses closest to the threshold
+    """
+    best = (1, num_perm)
+    best_error = float("inf")
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+def dedupe_chunks(chunks, threshold=0.85, num_perm=128, shingle_size=5):
+    """
+    Drop chunks whose estimated Jaccard similarity to an earlier chunk is at least threshold.
+    The kept chunk records every disease and source it stands in for in
+    metadata["diseases"] and metadata["sources"].
+    """
+    hasher = MinHasher(num_perm=num_perm)
+    bands, rows = lsh_params(threshold, num_perm)
+    buckets = [{} for _ in range(bands)]
+    kept = []
+    signatures = []
+    cross_disease = 0
+
+    for chunk in chunks:
+        sig = hasher.signature(chunk["text"], shingle_size)
+        keys = [sig[band * rows:(band + 1) * rows].tobytes() for band in range(bands)]
+
+        candidates = set()
+        for band, key in enumerate(keys):
+            candidates.update(buckets[band].get(key, ()))
+
+        match = None
+        for idx in sorted(candidates):
+            if estimate_similarity(sig, signatures[idx]) >= threshold:
+                match = idx
+                break
+
+        metadata = chunk["metadata"]
+        if match is not None:
+            rep = kept[match]["metadata"]
+            if metadata["disease"] not in rep["diseases"]:
+                rep["diseases"].append(metadata["disease"])
+                cross_disease += 1
+            if metadata.get("source") and metadata["source"] not in rep["sources"]:
+                rep["sources"].append(metadata["source"])
+            continue
+
+        idx = len(kept)
+        kept.append({
+            "text": chunk["text"],
+            "metadata": {
+                **metadata,
+                "diseases": [metadata["disease"]],
+                "sources": [metadata["source"]] if metadata.get("source") else []
+            }
+        })
+        signatures.append(sig)
+        for band, key in enumerate(keys):
+            buckets[band].setdefault(key, []).append(idx)
+
+    removed = len(chunks) - len(kept)
+    report = {
+        "before": len(chunks),
+        "after": len(kept),
+        "removed": removed,
+        "shrink_ratio": removed / len(chunks) if chunks else 0.0,
+        "cross_disease_merges": cross_disease,
+        "bands": bands,
+        "rows": rows
+    }
+    logger.info(
+        f"🧹 Dedup: {report['before']} -> {report['after']} chunks "
+        f"(-{report['shrink_ratio']:.1%}, {cross_disease} gộp giữa các bệnh, threshold={threshold})"
+    )
+    return kept, report
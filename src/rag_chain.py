@@ -66,9 +66,11 @@ def get_qa_chain():
     try:
         info_docs = information_vs.as_retriever(search_kwargs={"k": 8317}).invoke("all diseases")
         for doc in info_docs:
-            disease = doc.metadata.get("disease", "").strip()
-            if disease:
-                known_diseases.add(normalize_disease_name(disease))
+            # Deduplicated chunks list every disease they stand in for
+            for disease in [doc.metadata.get("disease", "")] + doc.metadata.get("diseases", []):
+                disease = disease.strip()
+                if disease:
+                    known_diseases.add(normalize_disease_name(disease))
         logger.info(f"🔍 Đã tải {len(known_diseases)} bệnh từ collection_information")
     except Exception as e:
         logger.error(f"❌ Lỗi khi lấy danh sách bệnh: {e}")
@@ -157,7 +159,10 @@ def get_qa_chain():
                         "ask_confirmation": False
                     }
 
-            filter_condition = Filter(must=[FieldCondition(key="metadata.disease", match=MatchValue(value=disease_detected))])
+            filter_condition = Filter(should=[
+                FieldCondition(key="metadata.disease", match=MatchValue(value=disease_detected)),
+                FieldCondition(key="metadata.diseases", match=MatchValue(value=disease_detected))
+            ])
             info_docs = information_vs.as_retriever(search_kwargs={"k": 6, "filter": filter_condition}).invoke(disease_detected)
             if info_docs:
                 context = "\n\n".join([doc.page_content for doc in info_docs])